@@ -0,0 +1,305 @@
+import os
+import io
+import json
+import time
+import queue
+import random
+import shutil
+import argparse
+import tempfile
+import resource
+import contextlib
+import multiprocessing
+from openpyxl import load_workbook
+from openpyxl.worksheet.datavalidation import DataValidation
+from fake_services import FakeSpotify, FakeYouTube, FakeDrive, fake_video_id, stable_hash
+
+# Mesure des scripts sans réseau ni quota : chaque étape tourne contre des faux serveurs
+# locaux (fake_services.py) et sur un classeur TITRES synthétique de la taille voulue.
+
+TEMPLATE_FILE = "Programmation_template.xlsx"
+BENCHMARK_DIR = os.path.join("cache", "benchmark")  # classeurs générés (cache/ est ignoré par git)
+SHEET_NAME = "TITRES"
+STAGES = ['fetch', 'metadata', 'youtube', 'download']
+VALIDE_FORMULA = '=IF(H{r}="","",IF(OR(H{r}=3,H{r}=4),TRUE,IF(OR(H{r}=1,H{r}=2,H{r}="NaN"),FALSE,"")))'
+
+
+def make_workbook(path, n_rows, seed=0, template=TEMPLATE_FILE):
+    """
+    Génère un classeur à partir du modèle avec n_rows lignes TITRES complètes
+    (mêmes noms que le catalogue des faux serveurs). Le fichier est réutilisé s'il existe déjà.
+    """
+    if os.path.exists(path):
+        return path
+    rng = random.Random(seed)
+    workbook = load_workbook(template)
+    playlists = [cell.value for cell in workbook['PLAYLISTS']['A'][1:] if cell.value] or ['Benchmark']
+    sheet = workbook[SHEET_NAME]
+    sheet.delete_rows(2, sheet.max_row)
+    for i in range(n_rows):
+        r = i + 2
+        confidence = rng.randint(1, 4)
+        n = stable_hash(f"Titre {i}")
+        sheet.append([
+            playlists[i % len(playlists)],
+            f"Artiste {i % 997}",
+            f"Titre {i}",
+            f"Album {n % 500}",
+            f"{1970 + n % 55}-01-01",
+            n % 7 == 0,
+            n % 100,
+            confidence,
+            VALIDE_FORMULA.format(r=r),
+            rng.random() < 0.5,
+            f"https://www.youtube.com/watch?v={fake_video_id(f'Titre {i}')}",
+        ])
+    last_row = n_rows + 1
+    for table in sheet.tables.values():
+        table.ref = f"A1:K{last_row}"
+        if table.autoFilter is not None:
+            table.autoFilter.ref = table.ref
+    # Liste déroulante de la colonne PLAYLIST sur toutes les lignes
+    sheet.data_validations.dataValidation = []
+    validation = DataValidation(type="list", formula1="Playlists", allow_blank=True)
+    validation.add(f"A2:A{last_row}")
+    sheet.add_data_validation(validation)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    workbook.save(path)
+    return path
+
+
+class ScaledSleep:
+    """
+    Remplace le module time dans les scripts mesurés : les pauses du rate limiting sont
+    comptabilisées puis raccourcies (scale=0 : aucune pause), le reste est délégué à time.
+    monotonic() avance aussi du temps de pause économisé, pour que les budgets de spotify_pool
+    se remplissent comme si les pauses avaient eu lieu.
+    """
+    def __init__(self, scale):
+        self.scale = scale
+        self.requested = 0.0
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+    def monotonic(self):
+        return time.monotonic() + self.requested * (1 - self.scale)
+
+    def sleep(self, seconds):
+        self.requested += seconds
+        if self.scale:
+            time.sleep(seconds * self.scale)
+
+
+def redirect_youtube(base_url):
+    """
+    youtubesearchpython n'a pas d'URL configurable : les appels httpx de la bibliothèque
+    sont redirigés de https://www.youtube.com vers le faux serveur.
+    """
+    from youtubesearchpython.core import requests as core_requests
+    import httpx
+
+    class RedirectedHttpx:
+        def __getattr__(self, name):
+            return getattr(httpx, name)
+
+        def call(self, method, url, **kwargs):
+            url = url.replace("https://www.youtube.com", base_url)
+            # proxies vide : inutile de le transmettre (argument retiré des versions récentes de httpx)
+            if not kwargs.get('proxies'):
+                kwargs.pop('proxies', None)
+            return getattr(httpx, method)(url, **kwargs)
+
+        def post(self, url, **kwargs):
+            return self.call('post', url, **kwargs)
+
+        def get(self, url, **kwargs):
+            return self.call('get', url, **kwargs)
+
+    core_requests.httpx = RedirectedHttpx()
+
+
+def run_stage(stage, workbook_path, urls, options, results):
+    """Exécute une étape dans un processus neuf (mémoire mesurée séparément) et renvoie ses mesures."""
+    # Les URLs Spotify sont lues à l'import des modules
+    os.environ['SPOTIFY_ACCOUNTS_URL'] = urls['spotify']
+    os.environ['SPOTIFY_API_URL'] = f"{urls['spotify']}/v1"
+    import excel_reader
+    import spotify_pool
+    from metrics import METRICS
+
+    saves = []
+    original_save = excel_reader.ExcelReader.save
+
+    def timed_save(self, *args, **kwargs):
+        start = time.perf_counter()
+        result = original_save(self, *args, **kwargs)
+        saves.append(time.perf_counter() - start)
+        return result
+    excel_reader.ExcelReader.save = timed_save
+
+    sleeper = ScaledSleep(options['sleep_scale'])
+    output = contextlib.nullcontext() if options['verbose'] else contextlib.redirect_stdout(io.StringIO())
+    errors = contextlib.nullcontext() if options['verbose'] else contextlib.redirect_stderr(io.StringIO())
+    n = options['stage_rows']
+    with output, errors:
+        start = time.perf_counter()
+        reader = excel_reader.ExcelReader(workbook_path)
+        tracks = reader.read_tracks(SHEET_NAME)
+        load_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if stage == 'fetch':
+            import playlist_fetcher
+            spotify_pool.time = sleeper
+            spotify = spotify_pool.SpotifyPool([{'client_id': 'benchmark', 'client_secret': 'benchmark'}])
+            present_titles = {(track.artiste, track.titre) for track in tracks}
+            found = playlist_fetcher.get_tracks_by_genre('Benchmark', n, spotify, present_titles)
+            for artist, title, _ in found:
+                reader.append_row(SHEET_NAME, {"PLAYLIST": tracks[0].playlist, "ARTISTE": artist, "TITRE": title, "LIEN": ""})
+            reader.save()
+            rows = len(found)
+        elif stage == 'metadata':
+            import metadata
+            metadata.time = sleeper
+            spotify_pool.time = sleeper
+            fetcher = metadata.SpotifyMetadataFetcher(reader, SHEET_NAME, client_id='benchmark', client_secret='benchmark')
+            fetcher.process(tracks[:n])
+            rows = min(n, len(tracks))
+        elif stage == 'youtube':
+            redirect_youtube(urls['youtube'])
+            import ytb_finder_fast
+            ytb_finder_fast.time = sleeper
+            searcher = ytb_finder_fast.YouTubeSearcher(reader, SHEET_NAME)
+            searcher.process(tracks[:n], max_workers=1)
+            rows = min(n, len(tracks))
+        elif stage == 'download':
+            import bot_downloader
+            bot_downloader.time = sleeper
+            tracks = tracks[:n]
+            # Liens vers le média servi par le faux YouTube (téléchargé par l'extracteur générique de yt-dlp)
+            for track in tracks:
+                track.lien = f"{urls['youtube']}/watch?v={fake_video_id(track.titre)}"
+            with tempfile.TemporaryDirectory() as cache_root:
+                bot_downloader.download_and_upload_to_drive(
+                    reader, tracks, SHEET_NAME, None, ['https://www.googleapis.com/auth/drive.file'], 'root', cache_root,
+                    download_workers=options['download_workers'], upload_workers=options['upload_workers'],
+                    api_endpoint=f"{urls['drive']}/", cookies_browser=None)
+            rows = len(tracks)
+        seconds = time.perf_counter() - start
+
+    results.put({
+        'stage': stage,
+        'rows': rows,
+        'seconds': seconds,
+        'load_s': load_s,
+        'saves': len(saves),
+        'save_s': sum(saves),
+        'sleep_s': sleeper.requested,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'metrics': METRICS.snapshot(),
+    })
+
+
+def per_row(before, after, rows):
+    """Requêtes par ligne traitée, par route, entre deux relevés des compteurs d'un faux serveur."""
+    counts = {route: after[route] - before.get(route, 0) for route in after if after[route] != before.get(route, 0)}
+    return {route: count / rows for route, count in counts.items()} if rows else counts
+
+
+def benchmark(args):
+    """Lance les faux serveurs puis chaque étape demandée sur une copie fraîche du classeur."""
+    workbook = make_workbook(os.path.join(BENCHMARK_DIR, f"titres_{args.rows}_{args.seed}.xlsx"), args.rows, args.seed)
+    common = dict(latency=args.latency, error_rate=args.error_rate, retry_after=args.retry_after, seed=args.seed)
+    services = {
+        'spotify': FakeSpotify(n_playlists=args.playlists, tracks_per_playlist=args.tracks_per_playlist,
+                               catalogue_size=max(args.rows * 2, 1000), **common).start(),
+        'youtube': FakeYouTube(**common).start(),
+        'drive': FakeDrive(**common).start(),
+    }
+    urls = {name: service.url for name, service in services.items()}
+    options = {
+        'stage_rows': args.stage_rows,
+        'sleep_scale': args.sleep_scale,
+        'verbose': args.verbose,
+        'download_workers': args.download_workers,
+        'upload_workers': args.upload_workers,
+    }
+    context = multiprocessing.get_context('spawn')
+    report = []
+    try:
+        for stage in args.stages:
+            if stage == 'download' and shutil.which('ffmpeg') is None:
+                print("download : ignoré (ffmpeg introuvable)")
+                continue
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                copy = shutil.copy(workbook, os.path.join(tmp_dir, "titres.xlsx"))
+                before = {name: service.snapshot() for name, service in services.items()}
+                results = context.Queue()
+                process = context.Process(target=run_stage, args=(stage, copy, urls, options, results))
+                process.start()
+                # Résultat lu avant join : un processus ne se termine pas tant que sa file n'est pas vidée
+                result = None
+                while result is None and (process.is_alive() or not results.empty()):
+                    try:
+                        result = results.get(timeout=1)
+                    except queue.Empty:
+                        pass
+                process.join()
+                if result is None or process.exitcode != 0:
+                    print(f"{stage} : échec (code {process.exitcode})")
+                    continue
+            result['requests_per_row'] = {
+                name: per_row(before[name], service.snapshot(), result['rows'])
+                for name, service in services.items()
+            }
+            result['requests_per_row'] = {name: counts for name, counts in result['requests_per_row'].items() if counts}
+            result['rows_per_s'] = result['rows'] / result['seconds'] if result['seconds'] else 0.0
+            report.append(result)
+            print_result(result)
+    finally:
+        for service in services.values():
+            service.stop()
+    return report
+
+
+def print_result(result):
+    print(f"{result['stage']:<9} {result['rows']:>6} lignes  {result['rows_per_s']:>8.1f} lignes/s  "
+          f"chargement {result['load_s']:.2f}s  {result['saves']} sauvegardes ({result['save_s']:.2f}s)  "
+          f"pauses demandées {result['sleep_s']:.1f}s  RSS max {result['peak_rss_mb']:.0f} Mo")
+    for name, counts in result['requests_per_row'].items():
+        details = ", ".join(f"{route}={value:.2f}" for route, value in sorted(counts.items()))
+        print(f"{'':<9} {name} (requêtes/ligne) : {details}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark hors ligne des scripts contre des faux serveurs Spotify, YouTube et Drive.")
+    parser.add_argument('--rows', type=int, default=1000, help="taille du classeur TITRES généré (ex: 1000, 10000, 100000)")
+    parser.add_argument('--stage-rows', type=int, default=200, help="nombre de lignes traitées par étape")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--latency', type=float, default=0.0, help="latence ajoutée à chaque requête (secondes)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="proportion de réponses 429 (Spotify, Drive) ou 403 (YouTube)")
+    parser.add_argument('--retry-after', type=int, default=0, help="valeur de l'en-tête Retry-After des erreurs injectées")
+    parser.add_argument('--sleep-scale', type=float, default=0.0, help="facteur appliqué aux pauses du rate limiting (0 : aucune pause)")
+    parser.add_argument('--playlists', type=int, default=20, help="nombre de playlists du faux Spotify")
+    parser.add_argument('--tracks-per-playlist', type=int, default=50)
+    parser.add_argument('--download-workers', type=int, default=4)
+    parser.add_argument('--upload-workers', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="fichier où écrire le rapport (JSON)")
+    parser.add_argument('--verbose', action='store_true', help="afficher la sortie des scripts mesurés")
+    return parser.parse_args(argv)
+
+
+# Exécution principale
+if __name__ == "__main__":
+    args = parse_args()
+    print("=" * 90)
+    print("Benchmark hors ligne (faux serveurs locaux, aucun quota consommé)")
+    print(f"Classeur : {args.rows} lignes, {args.stage_rows} lignes par étape, latence {args.latency}s, erreurs {args.error_rate:.0%}")
+    print("=" * 90)
+    report = benchmark(args)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'config': vars(args), 'stages': report}, file, indent=2)
+        print(f"Rapport écrit dans {args.json}")
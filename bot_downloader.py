@@ -1,46 +1,228 @@
 
+import io
 import os
 import json
+import base64
+import time
+import random
+import queue
+import hashlib
+import threading
+import subprocess
+import tempfile
+import multiprocessing
+import requests
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 from mutagen.easyid3 import EasyID3
 from mutagen.mp3 import MP3
+from mutagen.easymp4 import EasyMP4
+from mutagen.oggopus import OggOpus
+from mutagen.id3 import ID3, APIC, TIT2, TPE1, TALB, TDRC
+from mutagen.mp4 import MP4, MP4Cover
+from mutagen.flac import Picture
 from yt_dlp import YoutubeDL
+from yt_dlp.cookies import extract_cookies_from_browser
 from tqdm import tqdm
 import warnings
 import re
-from excel_reader import ExcelReader
+from excel_reader import ExcelReader, input_hash, stage_done, HASH_COLUMNS
+from file_cache import FileCache
+from drive_sync import DriveMirror, FOLDER_MIMETYPE
+from metrics import METRICS
+from profiling import spanned, start_from_args
+import cassette
+from link_validator import extract_video_id
 warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
 
+# Marqueur de fin de flux entre les étapes du pipeline
+STOP = object()
+
 # Google Drive
-from googleapiclient.http import MediaFileUpload
+import httplib2
+import google_auth_httplib2
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.http import MediaFileUpload, MediaUpload
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
 
-def authenticate_service_account(service_account_file, scopes):
-    """ Fonction pour authentifier le compte de service Google Drive.
+# Uploads reprenables : taille des morceaux (multiple de 256 Ko) et statuts HTTP à réessayer
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# Formats de sortie : le mp3 réencode (compatible avec tous les lecteurs),
+# m4a et opus gardent le flux natif de YouTube avec une simple copie (quasiment aucun CPU)
+AUDIO_FORMATS = {
+    'mp3': {
+        'ytdl_format': 'bestaudio/best',
+        'ext': 'mp3',
+        'mimetype': 'audio/mpeg',
+        'ffmpeg_format': 'mp3',
+        'streamable': True,
+        'codec_args': ['-c:a', 'libmp3lame', '-b:a', '{quality}k'],
+    },
+    'm4a': {
+        'ytdl_format': 'bestaudio[ext=m4a]/bestaudio/best',
+        'ext': 'm4a',
+        'mimetype': 'audio/mp4',
+        'ffmpeg_format': 'ipod',
+        'streamable': False,  # le conteneur MP4 a besoin de revenir en arrière dans le fichier
+        'acodec': 'mp4a',
+        'codec_args': ['-c:a', 'copy'],
+        'fallback_args': ['-c:a', 'aac', '-b:a', '{quality}k'],
+    },
+    'opus': {
+        'ytdl_format': 'bestaudio[acodec=opus]/bestaudio/best',
+        'ext': 'opus',
+        'mimetype': 'audio/ogg',
+        'ffmpeg_format': 'opus',
+        'streamable': True,
+        'acodec': 'opus',
+        'codec_args': ['-c:a', 'copy'],
+        'fallback_args': ['-c:a', 'libopus', '-b:a', '{quality}k'],
+    },
+}
+
+# Estimation de la taille d'un fichier quand YouTube ne l'annonce pas (budget disque)
+DEFAULT_STAGING_ESTIMATE = 15 * 1024 * 1024
+
+# Taille maximale du cache audio local (éviction LRU au-delà)
+AUDIO_CACHE_MAX_BYTES = 5 * 1024 ** 3
+
+# Taille maximale du cache des pochettes d'album (environ 100 Ko par album)
+COVER_CACHE_MAX_BYTES = 200 * 1024 ** 2
+
+def load_drive_credentials(service_account_file, scopes):
+    """ Charge les credentials du compte de service (anonymes si aucun fichier, pour un serveur Drive local de test).
     """
-    creds = service_account.Credentials.from_service_account_file(
+    if service_account_file is None:
+        return AnonymousCredentials()
+    return service_account.Credentials.from_service_account_file(
         service_account_file,
         scopes=scopes
     )
-    return build('drive', 'v3', credentials=creds)
 
-def upload_to_shared_drive(file_path, drive_service, folder_id):
+def build_drive_service(credentials, api_endpoint=None, timeout=60):
+    """ Construit un client Drive avec son propre transport HTTP authentifié (une connexion persistante).
+    """
+    http = httplib2.Http(timeout=timeout)
+    # 308 signifie « morceau reçu » pour les uploads reprenables, pas une redirection
+    http.redirect_codes = http.redirect_codes - {308}
+    authorized_http = google_auth_httplib2.AuthorizedHttp(credentials, http=http)
+    if api_endpoint:
+        # Serveur Drive local (tests) : toutes les URLs, y compris celles d'upload, doivent pointer vers lui
+        document = json.loads(get_static_doc('drive', 'v3'))
+        document['rootUrl'] = api_endpoint
+        document.pop('mtlsRootUrl', None)
+        return build_from_document(document, http=authorized_http)
+    return build('drive', 'v3', http=authorized_http, cache_discovery=False)
+
+def authenticate_service_account(service_account_file, scopes, api_endpoint=None):
+    """ Fonction pour authentifier le compte de service Google Drive.
+    """
+    creds = load_drive_credentials(service_account_file, scopes)
+    return build_drive_service(creds, api_endpoint=api_endpoint)
+
+def upload_to_shared_drive(file_path, drive_service, folder_id, chunk_size=UPLOAD_CHUNK_SIZE, max_retries=5,
+                           mimetype='audio/mpeg'):
     """ Fonction pour uploader un fichier dans un dossier partagé sur Google Drive.
+    Upload reprenable par morceaux : en cas d'erreur transitoire, seul le morceau en échec
+    est renvoyé, après une attente exponentielle.
+    """
+    media = MediaFileUpload(file_path, mimetype=mimetype, chunksize=chunk_size, resumable=True)
+    return upload_media(drive_service, media, os.path.basename(file_path), folder_id, max_retries).get('id')
+
+def upload_media(drive_service, media, file_name, folder_id, max_retries=5):
+    """ Envoie un média reprenable morceau par morceau, avec nouvel essai du morceau en échec.
+    Retourne la réponse de Drive (id, taille, md5Checksum).
     """
-    file_name = os.path.basename(file_path)
     file_metadata = {
         'name': file_name,
         'parents': [folder_id]
     }
-    media = MediaFileUpload(file_path, mimetype='audio/mpeg')
-    file = drive_service.files().create(
+    request = drive_service.files().create(
         body=file_metadata,
         media_body=media,
-        fields='id',
+        fields='id, size, md5Checksum',
         supportsAllDrives=True
-    ).execute()
-    return file.get('id')
+    )
+    response = None
+    retries = 0
+    while response is None:
+        try:
+            with METRICS.request('drive', 'upload_chunk'):
+                _, response = request.next_chunk()
+            retries = 0
+        except HttpError as e:
+            if e.resp.status not in RETRYABLE_STATUS or retries >= max_retries:
+                raise
+            retries += 1
+            wait_before_retry(retries, f"HTTP {e.resp.status}", file_name)
+        except (OSError, httplib2.HttpLib2Error) as e:
+            if retries >= max_retries:
+                raise
+            retries += 1
+            wait_before_retry(retries, e, file_name)
+    return response
+
+class PipeMediaUpload(MediaUpload):
+    """
+    Média reprenable lu depuis un flux non seekable (sortie standard de ffmpeg), de taille
+    inconnue à l'avance. Seuls le morceau en cours (pour pouvoir le renvoyer) et le suivant
+    sont gardés en mémoire.
+    """
+    def __init__(self, stream, mimetype, chunksize=UPLOAD_CHUNK_SIZE, prefix=b''):
+        super().__init__()
+        self._stream = stream
+        self._mimetype = mimetype
+        self._chunksize = chunksize
+        self._buffer = prefix  # octets envoyés avant le flux (ex: tag ID3 écrit par mutagen)
+        self._offset = 0  # position dans le flux du premier octet du tampon
+        self._next = 0  # début du prochain morceau à envoyer
+        self._size = None  # connue seulement une fois la fin du flux atteinte
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        # Appelée avant getbytes() à chaque morceau : on lit un octet au-delà du prochain
+        # morceau pour annoncer la taille totale dès l'envoi du dernier morceau.
+        self._fill(self._next + self._chunksize + 1)
+        return self._size
+
+    def resumable(self):
+        return True
+
+    def _fill(self, end):
+        while self._size is None and self._offset + len(self._buffer) < end:
+            data = self._stream.read(end - self._offset - len(self._buffer))
+            if not data:
+                self._size = self._offset + len(self._buffer)
+                break
+            self._buffer += data
+
+    def getbytes(self, begin, length):
+        # Les octets avant `begin` ont été confirmés par Drive : on les oublie
+        if begin > self._offset:
+            self._buffer = self._buffer[begin - self._offset:]
+            self._offset = begin
+        self._fill(begin + length)
+        data = self._buffer[begin - self._offset:begin - self._offset + length]
+        self._next = begin + len(data)
+        return data
+
+def wait_before_retry(retries, reason, file_name):
+    """ Attente exponentielle (avec un peu d'aléa) avant de renvoyer un morceau.
+    """
+    delay = min(2 ** retries + random.random(), 64)
+    print(f"\nErreur pendant l'upload de {file_name} ({reason}), nouvel essai dans {delay:.1f}s...")
+    METRICS.slept(delay, 'drive_upload')
+    time.sleep(delay)
 
 def get_or_create_drive_folder(service, folder_name, parent_id=None, drive_id=None):
     """
@@ -70,12 +252,18 @@ def get_or_create_drive_folder(service, folder_name, parent_id=None, drive_id=No
         # À défaut, chercher partout
         list_kwargs["corpora"] = "allDrives"
 
-    results = service.files().list(**list_kwargs).execute()
+    with METRICS.request('drive', 'list'):
+        results = service.files().list(**list_kwargs).execute()
     folders = results.get('files', [])
 
     if folders:
         return folders[0]['id']
+    return create_drive_folder(service, folder_name, parent_id=parent_id)
 
+def create_drive_folder(service, folder_name, parent_id=None):
+    """
+    Crée un dossier (compatible Drive partagé) et retourne son identifiant.
+    """
     metadata = {
         'name': folder_name,
         'mimeType': 'application/vnd.google-apps.folder',
@@ -83,107 +271,880 @@ def get_or_create_drive_folder(service, folder_name, parent_id=None, drive_id=No
     if parent_id:
         metadata['parents'] = [parent_id]
 
-    folder = service.files().create(
-        body=metadata,
-        fields='id',
-        supportsAllDrives=True
-    ).execute()
+    with METRICS.request('drive', 'create_folder'):
+        folder = service.files().create(
+            body=metadata,
+            fields='id',
+            supportsAllDrives=True
+        ).execute()
     return folder.get('id')
 
-def download_and_upload_to_drive(excel_reader, tracks_df, sheet_name, service_account_file, scopes, parent_folder_id, cache_root):
+class StagingBudget:
     """
-    Fonction principale pour télécharger les morceaux depuis YouTube et les uploader sur Google Drive.
+    Budget d'octets pour les fichiers en attente sur le disque local. Les téléchargements
+    réservent leur taille avant d'écrire et attendent (contre-pression) quand le budget
+    est épuisé ; les uploads libèrent la place une fois le fichier local supprimé.
     """
-    # Authentification Google Drive
-    drive_service = authenticate_service_account(service_account_file, scopes)
-    # === TÉLÉCHARGEMENT DES MORCEAUX ===
-    # Créer le dossier racine de téléchargement cache
-    os.makedirs(cache_root, exist_ok=True)
-    # Barre de progression
-    for idx, row in tqdm(tracks_df.iterrows(), total=len(tracks_df), desc="Téléchargement des morceaux"):
-        playlist = row['PLAYLIST']  # Nom de la playlist
-        artiste_raw = str(row['ARTISTE'])  # Nom de l'artiste
-        titre =  str(row['TITRE'])  # Titre de la chanson
-        album = str(row['ALBUM'])  # Nom de l'album
-        date = row['SORTIE']  # Date de sortie
-        youtube_url = row['LIEN']  # URL YouTube
-
-        # Extraction des artistes
-        # suppression de ce qu'il y a entre parenthèses
-        artiste_raw = re.sub(r'\(.*?\)', '', artiste_raw)
-        # remplacer les différentes mentions de feat., ft., avec, et, & par une virgule
-        separators = [r"\s+feat\.?\s+", r"\s+ft\.?\s+", r"\s+avec\s+", r"\s+et\s+", r"\s*&\s*"]
-        for sep in separators: artiste_raw = re.sub(sep, ',', artiste_raw, flags=re.IGNORECASE)
-        # On remplace les points virgules par une seule virgule
-        artiste_raw = re.sub(r'\s*;\s*', ',', artiste_raw)
-        # On supprime les espaces en début et fin de chaîne
-        artiste_raw = artiste_raw.strip()
-        # On récupère le nom des artistes
-        artist_names_raw = artiste_raw.split(',') if ',' in artiste_raw else [artiste_raw]
-        main_artist = artist_names_raw[0] if artist_names_raw else ""
-        # Créer le nom du fichier
-        filename = f"{artiste_raw} - {titre}.mp3".replace("/", "_").replace("\\", "_")
-        # éviter les noms de fichiers trop longs
-        if len(filename) > 100:
-            filename = f"{main_artist} - {titre}.mp3".replace("/", "_").replace("\\", "_")
-        if len(filename) > 100:
-            filename = f"{titre}.mp3".replace("/", "_").replace("\\", "_")
-        if len(filename) > 100:
-            filename = filename[:95] + "(...).mp3"
-        
-        # Créer le dossier de la playlist
-        #sanitize le nom de la playlist
-        playlist = playlist.replace("/", "_").replace("\\", "_")
-        playlist_folder = os.path.join(cache_root, playlist)
-        os.makedirs(playlist_folder, exist_ok=True)
-
-        output_path = os.path.join(playlist_folder, filename)
-
-        # Configuration de yt-dlp
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'cookiesfrombrowser': ('firefox',),  # Utiliser les cookies de Firefox
-            'outtmpl': output_path.replace(".mp3", ".%(ext)s"),
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'quiet': True,           # Supprime tous les logs standards
-            'no_warnings': True,      # Supprime les warnings
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, n_bytes, block=True):
+        """
+        Réserve n_bytes. Avec block=False (étapes en aval), la place est comptée sans attendre :
+        bloquer une étape qui libère de la place pourrait tout figer, et les files bornées
+        limitent déjà ce dépassement.
+        """
+        if self.max_bytes is None:
+            return
+        with self.condition:
+            # Un fichier plus gros que tout le budget passe quand même, mais seul
+            while block and self.used > 0 and self.used + n_bytes > self.max_bytes:
+                self.condition.wait()
+            self.used += n_bytes
+
+    def release(self, n_bytes):
+        if self.max_bytes is None:
+            return
+        with self.condition:
+            self.used -= n_bytes
+            self.condition.notify_all()
+
+def extract_browser_cookies(browser='firefox'):
+    """
+    Extrait une seule fois les cookies du navigateur (lecture et déchiffrement de sa base)
+    dans un fichier cookies.txt temporaire, lisible seulement par l'utilisateur.
+    """
+    cookie_jar = extract_cookies_from_browser(browser)
+    fd, cookie_file = tempfile.mkstemp(prefix="cookies-", suffix=".txt")
+    os.close(fd)
+    cookie_jar.save(cookie_file)
+    return cookie_file
+
+class DriveFolderCache:
+    """
+    Cache des identifiants de dossiers Drive par (dossier parent, playlist),
+    persisté dans un fichier JSON pour les exécutions suivantes.
+    """
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.lock = threading.Lock()
+        self.folders = {}
+        if os.path.exists(cache_file):
+            with open(cache_file, 'r') as file:
+                self.folders = json.load(file)
+
+    def key(self, parent_id, folder_name):
+        return f"{parent_id}/{folder_name}"
+
+    def get(self, parent_id, folder_name):
+        return self.folders.get(self.key(parent_id, folder_name))
+
+    def set(self, parent_id, folder_name, folder_id):
+        self.folders[self.key(parent_id, folder_name)] = folder_id
+
+    def invalidate(self, parent_id, folder_name):
+        with self.lock:
+            self.folders.pop(self.key(parent_id, folder_name), None)
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+        tmp_file = self.cache_file + ".tmp"
+        with open(tmp_file, 'w') as file:
+            json.dump(self.folders, file, indent=1)
+        os.replace(tmp_file, self.cache_file)
+
+    def prepare(self, service, parent_id, folder_names, existing):
+        """
+        Remplace les dossiers connus du dossier parent par les dossiers existants ({nom: id}, miroir
+        Drive à jour, voir drive_sync.py), puis crée les dossiers manquants des playlists folder_names.
+        Retourne les dossiers créés {nom: id}.
+        """
+        created = {}
+        with self.lock:
+            prefix = self.key(parent_id, "")
+            self.folders = {key: value for key, value in self.folders.items() if not key.startswith(prefix)}
+            for name, folder_id in existing.items():
+                self.set(parent_id, name, folder_id)
+            for name in set(folder_names) - set(existing):
+                folder_id = create_drive_folder(service, name, parent_id=parent_id)
+                created[name] = folder_id
+                self.set(parent_id, name, folder_id)
+                print(f"Dossier Drive créé : {name}")
+            self.save()
+        return created
+
+    def get_or_create(self, service, parent_id, folder_name):
+        """Identifiant du dossier depuis le cache, sinon interrogation de Drive (une seule fois)."""
+        folder_id = self.get(parent_id, folder_name)
+        METRICS.cache('drive_folders', hit=folder_id is not None)
+        if folder_id:
+            return folder_id
+        with self.lock:
+            folder_id = self.get(parent_id, folder_name)
+            if not folder_id:
+                folder_id = get_or_create_drive_folder(service, folder_name, parent_id=parent_id)
+                self.set(parent_id, folder_name, folder_id)
+                self.save()
+            return folder_id
+
+@spanned('md5')
+def file_md5(file_path, chunk_size=1024 * 1024):
+    """Checksum MD5 d'un fichier local (même algorithme que le md5Checksum de Drive)."""
+    digest = hashlib.md5()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class DriveIndex:
+    """
+    Index en mémoire du contenu des dossiers Drive cibles (nom, taille, md5),
+    construit une seule fois avant le début des téléchargements à partir du miroir Drive.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.names = {}  # {folder_id: {nom: fichier}}
+        self.checksums = {}  # {folder_id: {md5: nom}}
+
+    def load(self, mirror, folder_ids):
+        for folder_id in set(folder_ids):
+            for file in mirror.files(folder_id):
+                self.add(folder_id, file['name'], file.get('size'), file.get('md5Checksum'), file['id'])
+
+    def add(self, folder_id, name, size=None, md5=None, file_id=None):
+        with self.lock:
+            self.names.setdefault(folder_id, {})[name] = {'id': file_id, 'size': size, 'md5Checksum': md5}
+            if md5:
+                self.checksums.setdefault(folder_id, {})[md5] = name
+
+    def remove(self, folder_id, name, file_id, md5=None):
+        """
+        Retire un fichier supprimé de Drive. Si un nouveau fichier du même nom l'a déjà remplacé
+        dans l'index (autre identifiant), seul le checksum de l'ancien contenu est oublié.
+        """
+        with self.lock:
+            names = self.names.get(folder_id, {})
+            if name in names and names[name].get('id') == file_id:
+                del names[name]
+            checksums = self.checksums.get(folder_id, {})
+            if md5 and checksums.get(md5) == name and names.get(name, {}).get('md5Checksum') != md5:
+                del checksums[md5]
+
+    def find_name(self, folder_id, name):
+        """Fichier de ce nom dans le dossier ({'id', 'size', 'md5Checksum'}), sinon None."""
+        return self.names.get(folder_id, {}).get(name)
+
+    def has_name(self, folder_id, name):
+        return name in self.names.get(folder_id, {})
+
+    def find_checksum(self, folder_id, md5):
+        """Nom du fichier de même contenu déjà présent dans le dossier, sinon None."""
+        return self.checksums.get(folder_id, {}).get(md5)
+
+def sanitize_playlist_name(playlist):
+    """Nom de playlist utilisable comme nom de dossier (local et Drive)."""
+    return playlist.replace("/", "_").replace("\\", "_")
+
+def build_track_job(track, cache_root, ext='mp3'):
+    """
+    Prépare les informations d'un morceau (noms, chemins) à partir d'un Track de l'Excel.
+    """
+    playlist = track.playlist  # Nom de la playlist
+    artiste_raw = track.artiste or ''  # Nom de l'artiste
+    titre = track.titre or ''  # Titre de la chanson
+    album = track.album  # Nom de l'album
+    date = track.sortie  # Date de sortie
+    youtube_url = track.lien  # URL YouTube
+
+    # Extraction des artistes
+    # suppression de ce qu'il y a entre parenthèses
+    artiste_raw = re.sub(r'\(.*?\)', '', artiste_raw)
+    # remplacer les différentes mentions de feat., ft., avec, et, & par une virgule
+    separators = [r"\s+feat\.?\s+", r"\s+ft\.?\s+", r"\s+avec\s+", r"\s+et\s+", r"\s*&\s*"]
+    for sep in separators: artiste_raw = re.sub(sep, ',', artiste_raw, flags=re.IGNORECASE)
+    # On remplace les points virgules par une seule virgule
+    artiste_raw = re.sub(r'\s*;\s*', ',', artiste_raw)
+    # On supprime les espaces en début et fin de chaîne
+    artiste_raw = artiste_raw.strip()
+    # On récupère le nom des artistes
+    artist_names_raw = artiste_raw.split(',') if ',' in artiste_raw else [artiste_raw]
+    main_artist = artist_names_raw[0] if artist_names_raw else ""
+    # Créer le nom du fichier
+    filename = f"{artiste_raw} - {titre}.{ext}".replace("/", "_").replace("\\", "_")
+    # éviter les noms de fichiers trop longs
+    if len(filename) > 100:
+        filename = f"{main_artist} - {titre}.{ext}".replace("/", "_").replace("\\", "_")
+    if len(filename) > 100:
+        filename = f"{titre}.{ext}".replace("/", "_").replace("\\", "_")
+    if len(filename) > 100:
+        filename = filename[:95] + f"(...).{ext}"
+
+    # Empreinte enregistrée au dernier upload (celle des anciennes valeurs si la ligne a été modifiée)
+    current_hash = input_hash(track, 'download')
+    previous_hash = track.empreinte_telecharge
+    changed = previous_hash is not None and previous_hash != current_hash
+
+    # Créer le dossier de la playlist
+    #sanitize le nom de la playlist
+    playlist = sanitize_playlist_name(playlist)
+    playlist_folder = os.path.join(cache_root, playlist)
+    os.makedirs(playlist_folder, exist_ok=True)
+
+    return {
+        'row': track.row,
+        'input_hash': current_hash,
+        # Ligne modifiée depuis son upload : l'ancien fichier Drive est remplacé
+        'previous_hash': previous_hash if changed else None,
+        'changed': changed,
+        'uploaded': stage_done(track, 'download'),  # TELECHARGE = VRAI : un fichier a été uploadé pour la ligne
+        'playlist': playlist,
+        'artiste': artiste_raw,
+        'titre': titre,
+        'album': album,
+        'date': date,
+        'album_id': track.album_id,  # Album Spotify et URL de sa pochette (metadata.py)
+        'cover_url': track.pochette,
+        'url': youtube_url,
+        'filename': filename,
+        'output_path': os.path.join(playlist_folder, filename),
+    }
+
+def convert_audio(source_path, output_path, audio_format='mp3', quality='192'):
+    """
+    Convertit un fichier audio avec ffmpeg dans le format de sortie demandé.
+    Pour les formats natifs (m4a, opus), le flux est simplement copié dans le conteneur
+    (pas de réencodage) ; si le codec téléchargé ne convient pas, on réencode en secours.
+    Exécutée dans le pool de processus : doit rester une fonction de module.
+    """
+    output = AUDIO_FORMATS[audio_format]
+    attempts = [output['codec_args']]
+    if output['codec_args'] == ['-c:a', 'copy']:
+        attempts.append(output['fallback_args'])
+    for codec_args in attempts:
+        command = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-i', source_path,
+            '-vn', *[arg.format(quality=quality) for arg in codec_args],
+            '-f', output['ffmpeg_format'], output_path,
+        ]
+        result = subprocess.run(command, capture_output=True)
+        if result.returncode == 0:
+            break
+    result.check_returncode()
+    os.remove(source_path)
+    return output_path
+
+def cover_cache_key(job):
+    """Clé du cache des pochettes : identifiant Spotify de l'album, sinon empreinte de l'URL de l'image."""
+    return job.get('album_id') or hashlib.sha1(str(job['cover_url']).encode()).hexdigest()[:16]
+
+def image_mimetype(data):
+    return 'image/png' if data.startswith(b'\x89PNG') else 'image/jpeg'
+
+def audio_cache_key(youtube_url, codec='mp3', quality='192'):
+    """
+    Clé du cache audio : identifiant de la vidéo YouTube + format de sortie.
+    Un même morceau présent dans plusieurs playlists partage donc le même fichier.
+    """
+    video_id = extract_video_id(youtube_url) or hashlib.sha1(str(youtube_url).encode()).hexdigest()[:16]
+    return f"{video_id}-{codec}-{quality}"
+
+@spanned('tag_audio')
+def tag_audio(job, audio_format='mp3'):
+    """ Rajoute les métadonnées présentes sur l'excel dans le fichier audio (titre, artiste, album, date),
+    avec le type de tags adapté au conteneur (ID3 pour le mp3, atomes MP4 pour le m4a, Vorbis pour l'opus).
+    """
+    if audio_format == 'mp3':
+        audio = MP3(job['output_path'], ID3=EasyID3)
+        if audio.tags is None:
+            audio.add_tags()
+    elif audio_format == 'm4a':
+        audio = EasyMP4(job['output_path'])
+    else:
+        audio = OggOpus(job['output_path'])
+    audio['title'] = job['titre']
+    audio['artist'] = job['artiste']
+    audio['album'] = job['album'] if pd.notna(job['album']) else "Inconnu"
+    audio['date'] = str(job['date']) if pd.notna(job['date']) else "Inconnu"
+    audio.save()
+    if job.get('cover'):
+        embed_cover(job['output_path'], job['cover'], audio_format)
+
+def id3_tag(metadata, cover):
+    """Tag ID3v2 (titre, artiste, album, date et pochette) à placer devant un flux mp3 sans tags."""
+    tags = ID3()
+    tags.add(TIT2(encoding=3, text=metadata['title']))
+    tags.add(TPE1(encoding=3, text=metadata['artist']))
+    tags.add(TALB(encoding=3, text=metadata['album']))
+    tags.add(TDRC(encoding=3, text=metadata['date']))
+    tags.add(APIC(encoding=3, mime=image_mimetype(cover), type=3, desc='Cover', data=cover))
+    buffer = io.BytesIO()
+    tags.save(buffer, padding=lambda info: 0)
+    return buffer.getvalue()
+
+def embed_cover(path, data, audio_format='mp3'):
+    """
+    Intègre la pochette (contenu de l'image) au fichier audio : cadre APIC pour le mp3,
+    atome covr pour le m4a, bloc METADATA_BLOCK_PICTURE pour l'opus.
+    """
+    mimetype = image_mimetype(data)
+    if audio_format == 'mp3':
+        tags = ID3(path)
+        tags.delall('APIC')
+        tags.add(APIC(encoding=3, mime=mimetype, type=3, desc='Cover', data=data))
+        tags.save(path)
+    elif audio_format == 'm4a':
+        audio = MP4(path)
+        image_format = MP4Cover.FORMAT_PNG if mimetype == 'image/png' else MP4Cover.FORMAT_JPEG
+        audio['covr'] = [MP4Cover(data, imageformat=image_format)]
+        audio.save()
+    else:
+        picture = Picture()
+        picture.type = 3  # couverture (recto)
+        picture.mime = mimetype
+        picture.desc = 'Cover'
+        picture.data = data
+        audio = OggOpus(path)
+        audio['metadata_block_picture'] = [base64.b64encode(picture.write()).decode('ascii')]
+        audio.save()
+
+
+class DownloadPipeline:
+    """
+    Pipeline téléchargement -> conversion -> tags -> upload.
+    Chaque étape a ses propres workers et les étapes communiquent par des files bornées :
+    - téléchargements yt-dlp dans un pool de threads (réseau),
+    - conversions ffmpeg dans un pool de processus dimensionné sur les cœurs (CPU),
+    - uploads Google Drive dans leur propre pool de threads (réseau),
+    - un seul écrivain (le thread principal) met à jour l'Excel.
+    """
+    def __init__(self, excel_reader, sheet_name, service_account_file, scopes, parent_folder_id, cache_root,
+                 download_workers=4, transcode_workers=None, upload_workers=4, queue_size=8, save_every=10,
+                 upload_chunk_size=UPLOAD_CHUNK_SIZE, api_endpoint=None, cookies_browser='firefox',
+                 audio_cache_max_bytes=AUDIO_CACHE_MAX_BYTES, audio_format='mp3', audio_quality='192',
+                 staging_max_bytes=None, stream_uploads=False, embed_covers=True,
+                 cover_cache_max_bytes=COVER_CACHE_MAX_BYTES):
+        self.excel_reader = excel_reader
+        # Format de sortie (voir AUDIO_FORMATS) ; la qualité ne sert qu'en cas de réencodage
+        self.audio_format = audio_format
+        self.audio_ext = AUDIO_FORMATS[audio_format]['ext']
+        self.audio_quality = audio_quality
+        self.stream_copy = AUDIO_FORMATS[audio_format]['codec_args'] == ['-c:a', 'copy']
+        # Upload en flux (ffmpeg -> Drive sans fichier de sortie) si le conteneur le permet
+        self.stream_uploads = stream_uploads and AUDIO_FORMATS[audio_format]['streamable']
+        if stream_uploads and not self.stream_uploads:
+            print(f"Le format {audio_format} ne peut pas être écrit en flux : upload depuis des fichiers.")
+        # Place disque maximale des fichiers en attente dans le dossier de cache
+        self.staging = StagingBudget(staging_max_bytes)
+        self.sheet_name = sheet_name
+        # Credentials chargés une seule fois, partagés par les clients Drive de chaque thread
+        self.drive_credentials = load_drive_credentials(service_account_file, scopes)
+        self.api_endpoint = api_endpoint
+        self.upload_chunk_size = upload_chunk_size
+        self.parent_folder_id = parent_folder_id
+        self.cache_root = cache_root
+        self.download_workers = download_workers
+        self.transcode_workers = transcode_workers or os.cpu_count() or 1
+        self.upload_workers = upload_workers
+        self.queue_size = queue_size
+        self.save_every = save_every
+        self.local = threading.local()
+        self.cookies_browser = cookies_browser
+        self.cookie_file = None
+        self.process_pool = None
+        self.ydl_lock = threading.Lock()
+        self.ydl_instances = []
+        self.folder_cache = DriveFolderCache(os.path.join(cache_root, "drive_folders.json"))
+        # Miroir local du dossier parent sur Drive, mis à jour par le flux des changements (voir drive_sync.py)
+        self.drive_mirror = DriveMirror(os.path.join(cache_root, "drive_mirror.sqlite"), parent_folder_id)
+        self.drive_index = DriveIndex()
+        # Cache audio partagé entre playlists : chaque (vidéo, format) n'est téléchargé et converti qu'une fois
+        self.audio_cache = FileCache(os.path.join(cache_root, "audio"), audio_cache_max_bytes)
+        self.inflight_lock = threading.Lock()
+        self.inflight = {}  # {clé: morceaux d'autres playlists en attente du même fichier}
+        # Pochettes d'album : téléchargées une fois par album, intégrées à chacun de ses morceaux
+        self.cover_cache = FileCache(os.path.join(cache_root, "covers"), cover_cache_max_bytes) if embed_covers else None
+        self.cover_locks = {}  # {clé: verrou}, un seul téléchargement par album à la fois
+        self.cover_failed = set()  # pochettes introuvables pendant cette exécution, pas redemandées
+
+        # Files bornées entre les étapes : un étage lent bloque l'étage précédent
+        self.download_queue = queue.Queue(maxsize=queue_size)
+        self.transcode_queue = queue.Queue(maxsize=queue_size)
+        self.upload_queue = queue.Queue(maxsize=queue_size)
+        self.status_queue = queue.Queue()
+
+    def get_drive_service(self):
+        """
+        Un client Google Drive par thread d'upload (httplib2 n'est pas thread-safe) :
+        chaque worker garde sa connexion authentifiée ouverte d'un upload à l'autre.
+        """
+        if not hasattr(self.local, 'drive_service'):
+            self.local.drive_service = build_drive_service(self.drive_credentials, api_endpoint=self.api_endpoint)
+        return self.local.drive_service
+
+    def report(self, job, ok, error=None, skipped=None):
+        self.status_queue.put({'job': job, 'ok': ok, 'error': error, 'skipped': skipped})
+
+    def start_stage(self, name, worker, n_workers, in_queue, next_queue=None, n_next=0):
+        """
+        Démarre les threads d'une étape. Quand tous ont terminé, on propage la fin
+        de flux (STOP) à l'étape suivante.
+        """
+        threads = [threading.Thread(target=self.stage_loop, args=(name, worker, in_queue), name=f"{name}-{i}", daemon=True)
+                   for i in range(n_workers)]
+        for thread in threads:
+            thread.start()
+
+        def close_stage():
+            for thread in threads:
+                thread.join()
+            for _ in range(n_next):
+                next_queue.put(STOP)
+
+        closer = threading.Thread(target=close_stage, name=f"{name}-closer", daemon=True)
+        closer.start()
+        return closer
+
+    def stage_loop(self, name, worker, in_queue):
+        while True:
+            job = in_queue.get()
+            if job is STOP:
+                return
+            try:
+                with METRICS.timer('stage_duration_seconds', stage=name):
+                    worker(job)
+            except Exception as e:
+                METRICS.inc('stage_errors_total', stage=name)
+                self.discard_files(job)
+                self.report(job, False, e)
+                # Les morceaux qui attendaient ce fichier échouent avec lui
+                for follower in self.release_followers(job):
+                    self.report(follower, False, e)
+
+    def discard_files(self, job):
+        """Supprime les fichiers intermédiaires d'un morceau en échec et libère leur place."""
+        for key in ('source_path', 'output_path'):
+            path = job.get(key)
+            if path and os.path.exists(path):
+                os.remove(path)
+            self.release_staging(job, key)
+
+    def release_staging(self, job, key):
+        """Rend au budget disque la place réservée pour un fichier local du morceau."""
+        self.staging.release(job.pop(f'{key}_bytes', 0))
+
+    def get_ydl(self):
+        """
+        Une instance YoutubeDL par thread de téléchargement, réutilisée pour tous les morceaux
+        (extracteurs initialisés une fois, cookies lus depuis le fichier extrait au démarrage).
+        """
+        if not hasattr(self.local, 'ydl'):
+            ydl_opts = {
+                'format': AUDIO_FORMATS[self.audio_format]['ytdl_format'],
+                'quiet': True,           # Supprime tous les logs standards
+                'no_warnings': True,      # Supprime les warnings
+            }
+            if self.cookie_file:
+                ydl_opts['cookiefile'] = self.cookie_file
+            self.local.ydl = YoutubeDL(ydl_opts)
+            with self.ydl_lock:
+                self.ydl_instances.append(self.local.ydl)
+        return self.local.ydl
+
+    def release_followers(self, job):
+        """Libère la clé en cours de traitement et retourne les morceaux qui l'attendaient."""
+        if not job.get('leader'):
+            return []
+        job['leader'] = False
+        with self.inflight_lock:
+            return self.inflight.pop(job['cache_key'], [])
+
+    def fetch_cover(self, job):
+        """
+        Pochette de l'album du morceau (contenu de l'image) ou None. Le premier morceau d'un album
+        la télécharge dans le cache, les suivants (y compris en parallèle) la lisent dans le cache.
+        """
+        if self.cover_cache is None or not job.get('cover_url'):
+            return None
+        key = cover_cache_key(job)
+        with self.inflight_lock:
+            lock = self.cover_locks.setdefault(key, threading.Lock())
+        with lock:
+            data = self.cover_cache.read(key, 'jpg')
+            METRICS.cache('covers', hit=data is not None)
+            if data is not None or key in self.cover_failed:
+                return data
+            temp_path = self.cover_cache.temp_path(key, 'jpg')
+            try:
+                with METRICS.request('spotify', 'cover'):
+                    response = requests.get(job['cover_url'], timeout=30)
+                response.raise_for_status()
+                data = response.content
+                with open(temp_path, 'wb') as file:
+                    file.write(data)
+                self.cover_cache.put(key, temp_path, 'jpg')
+            except (requests.RequestException, OSError) as e:
+                # Morceau envoyé sans pochette plutôt qu'en échec
+                print(f"\nPochette indisponible pour {job['titre']} : {e}")
+                self.cover_failed.add(key)
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                return None
+            return data
+
+    def download(self, job):
+        """Étape 1 : téléchargement de l'audio brut (sans conversion), sauf s'il est déjà en cache."""
+        job['cover'] = self.fetch_cover(job)
+        cached = False
+        if not self.stream_uploads:
+            job['cache_key'] = audio_cache_key(job['url'], self.audio_format, 'copy' if self.stream_copy else self.audio_quality)
+            with self.inflight_lock:
+                if job['cache_key'] in self.inflight:
+                    # Même vidéo déjà en cours pour une autre playlist : on attend son fichier
+                    self.inflight[job['cache_key']].append(job)
+                    return
+                cached = self.audio_cache.get(job['cache_key'], self.audio_ext) is not None
+                METRICS.cache('audio', hit=cached)
+                if not cached:
+                    self.inflight[job['cache_key']] = []
+                    job['leader'] = True
+        if cached:
+            self.transcode_queue.put(job)
+            return
+        ydl = self.get_ydl()
+        # Modèle de sortie propre à ce morceau (l'instance n'est utilisée que par ce thread)
+        ydl.params['outtmpl']['default'] = os.path.splitext(job['output_path'])[0] + ".source.%(ext)s"
+        # Métadonnées d'abord (taille du format choisi), puis réservation de la place disque
+        with METRICS.request('youtube', 'extract_info'):
+            info = ydl.extract_info(job['url'], download=False)
+        job['source_path_bytes'] = info.get('filesize') or info.get('filesize_approx') or DEFAULT_STAGING_ESTIMATE
+        job['acodec'] = info.get('acodec') or ''
+        self.staging.acquire(job['source_path_bytes'])
+        with METRICS.request('youtube', 'media'):
+            info = ydl.process_ie_result(info, download=True)
+        job['source_path'] = info['requested_downloads'][0]['filepath']
+        if self.stream_uploads:
+            # Conversion faite à la volée par le thread d'upload
+            self.upload_queue.put(job)
+        else:
+            self.transcode_queue.put(job)
+
+    def transcode(self, job):
+        """
+        Étape 2 : conversion (ou copie de flux) dans le pool de processus vers le cache audio,
+        puis copie et tags pour chaque playlist qui a besoin du morceau.
+        """
+        followers = []
+        if job.get('source_path'):
+            temp_path = self.audio_cache.temp_path(job['cache_key'], self.audio_ext)
+            with METRICS.timer('ffmpeg_duration_seconds', mode='convert'):
+                self.process_pool.submit(convert_audio, job['source_path'], temp_path,
+                                         self.audio_format, self.audio_quality).result()
+            self.audio_cache.put(job['cache_key'], temp_path, self.audio_ext)
+            self.release_staging(job, 'source_path')
+            followers = self.release_followers(job)
+        self.prepare_upload(job)
+        for follower in followers:
+            try:
+                self.prepare_upload(follower)
+            except Exception as e:
+                self.discard_files(follower)
+                self.report(follower, False, e)
+
+    def prepare_upload(self, job):
+        """Copie le fichier du cache dans le dossier de la playlist, écrit les tags et le passe à l'upload."""
+        cache_path = self.audio_cache.get(job['cache_key'], self.audio_ext)
+        job['output_path_bytes'] = os.path.getsize(cache_path) if cache_path else DEFAULT_STAGING_ESTIMATE
+        self.staging.acquire(job['output_path_bytes'], block=False)
+        self.audio_cache.copy_to(job['cache_key'], self.audio_ext, job['output_path'])
+        tag_audio(job, self.audio_format)
+        self.upload_queue.put(job)
+
+    def upload(self, job):
+        """Étape 3 : upload vers Google Drive puis suppression du fichier local."""
+        drive_service = self.get_drive_service()
+        # Dossier de la playlist dans le dossier racine (résolu une seule fois par exécution)
+        drive_playlist_folder_id = self.playlist_folder(drive_service, job['playlist'])
+        # Fichier des anciennes valeurs d'une ligne modifiée, cherché avant que le nouveau ne le masque dans l'index
+        previous = self.previous_upload(job, drive_playlist_folder_id)
+        if self.stream_uploads:
+            self.stream_upload(job, drive_service, drive_playlist_folder_id, previous)
+            return
+        # Même contenu déjà uploadé (sous un autre nom par exemple) : pas de doublon.
+        # Une ligne modifiée est toujours uploadée, son ancien fichier est remplacé ensuite.
+        md5 = file_md5(job['output_path'])
+        duplicate = None if job['changed'] else self.drive_index.find_checksum(drive_playlist_folder_id, md5)
+        if duplicate:
+            os.remove(job['output_path'])
+            self.release_staging(job, 'output_path')
+            self.report(job, True, skipped=duplicate)
+            return
+        try:
+            file_id = upload_to_shared_drive(job['output_path'], drive_service, drive_playlist_folder_id,
+                                             chunk_size=self.upload_chunk_size,
+                                             mimetype=AUDIO_FORMATS[self.audio_format]['mimetype'])
+            self.record_upload(drive_playlist_folder_id, {'id': file_id, 'name': job['filename'],
+                                                          'size': os.path.getsize(job['output_path']), 'md5Checksum': md5}, job)
+        except HttpError as e:
+            # Dossier supprimé depuis la mise en cache : on l'oublie pour la prochaine fois
+            if e.resp.status == 404:
+                self.folder_cache.invalidate(self.parent_folder_id, job['playlist'])
+                self.drive_mirror.remove(drive_playlist_folder_id)
+            raise
+        self.trash_previous(drive_service, previous, file_id)
+        # Supprimer le fichier local après l'upload
+        os.remove(job['output_path'])
+        self.release_staging(job, 'output_path')
+        self.report(job, True)
+
+    def stream_upload(self, job, drive_service, folder_id, previous=None):
+        """
+        Upload en flux : ffmpeg convertit (ou copie) le fichier source et écrit les tags
+        sur sa sortie standard, envoyée directement dans un upload reprenable.
+        Le fichier converti n'est jamais écrit ni relu sur le disque.
+        """
+        output = AUDIO_FORMATS[self.audio_format]
+        codec_args = output['codec_args']
+        if self.stream_copy and not job.get('acodec', '').startswith(output['acodec']):
+            codec_args = output['fallback_args']
+        metadata = {
+            'title': job['titre'],
+            'artist': job['artiste'],
+            'album': job['album'] if pd.notna(job['album']) else "Inconnu",
+            'date': str(job['date']) if pd.notna(job['date']) else "Inconnu",
         }
+        command = ['ffmpeg', '-loglevel', 'error', '-i', job['source_path'], '-vn', '-map_metadata', '-1',
+                   *[arg.format(quality=self.audio_quality) for arg in codec_args]]
+        prefix = b''
+        if job.get('cover') and self.audio_format == 'mp3':
+            # Sur une sortie non seekable, ffmpeg ne sait pas finaliser un tag ID3 avec image :
+            # le tag complet (textes et pochette) est écrit par mutagen et envoyé avant le flux.
+            # En opus, les tags sont dans le flux Ogg lui-même : pas de pochette en mode flux.
+            prefix = id3_tag(metadata, job['cover'])
+            command += ['-id3v2_version', '0']
+        else:
+            for key, value in metadata.items():
+                command += ['-metadata', f'{key}={value}']
+        command += ['-f', output['ffmpeg_format'], 'pipe:1']
+
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        response = None
+        # Conversion et upload avancent ensemble : durée mesurée de bout en bout
+        with METRICS.timer('ffmpeg_duration_seconds', mode='stream'):
+            try:
+                media = PipeMediaUpload(process.stdout, output['mimetype'], chunksize=self.upload_chunk_size, prefix=prefix)
+                # Sortie vide (source illisible) : on ne crée pas de fichier vide sur Drive
+                if media.size() != 0:
+                    response = upload_media(drive_service, media, job['filename'], folder_id)
+            finally:
+                process.stdout.close()
+                stderr = process.stderr.read()
+                process.wait()
+        if process.returncode != 0 or response is None:
+            # Sortie de ffmpeg incomplète : on ne garde pas un fichier tronqué sur Drive
+            if response:
+                drive_service.files().delete(fileId=response['id'], supportsAllDrives=True).execute()
+            raise RuntimeError(f"ffmpeg a échoué : {stderr.decode(errors='replace').strip()}")
+        self.record_upload(folder_id, {**response, 'name': job['filename']}, job)
+        self.trash_previous(drive_service, previous, response['id'])
+        os.remove(job['source_path'])
+        self.release_staging(job, 'source_path')
+        self.report(job, True)
+
+    def playlist_folder(self, drive_service, playlist):
+        """
+        Identifiant du dossier Drive de la playlist. Un dossier résolu sur Drive (pas encore connu,
+        ex: worker de job_queue.py) est ajouté au miroir : il n'est pas relisté à la prochaine synchronisation.
+        """
+        known = self.folder_cache.get(self.parent_folder_id, playlist)
+        folder_id = self.folder_cache.get_or_create(drive_service, self.parent_folder_id, playlist)
+        if folder_id != known:
+            self.drive_mirror.add({'id': folder_id, 'name': playlist, 'mimeType': FOLDER_MIMETYPE}, self.parent_folder_id)
+        return folder_id
+
+    def record_upload(self, folder_id, file, job):
+        """
+        Ajoute un fichier uploadé ({'id', 'name', 'size', 'md5Checksum'}) à l'index et au miroir Drive,
+        associé à l'empreinte de la ligne pour pouvoir le remplacer si elle est modifiée.
+        """
+        self.drive_index.add(folder_id, file['name'], file.get('size'), file.get('md5Checksum'), file['id'])
+        self.drive_mirror.add(file, folder_id)
+        self.drive_mirror.record_upload(job['input_hash'], file['id'])
 
-        # Téléchargement et upload vers Google Drive
+    def previous_upload(self, job, folder_id):
+        """
+        Ligne modifiée depuis son upload : fichier uploadé pour ses anciennes valeurs, retrouvé par
+        l'ancienne empreinte ou, pour un upload antérieur à leur suivi, par le même nom dans le même
+        dossier (lien modifié) si la ligne est marquée TELECHARGE = VRAI. None pour une ligne non
+        modifiée : un fichier du même nom qu'elle n'a pas uploadé n'est jamais remplacé.
+        """
+        if not job['changed']:
+            return None
+        previous = self.drive_mirror.uploaded_file(job['previous_hash'])
+        if previous is None and job['uploaded']:
+            known = self.drive_index.find_name(folder_id, job['filename'])
+            if known and known.get('id'):
+                previous = {**known, 'parent_id': folder_id, 'name': job['filename']}
+        return previous
+
+    def trash_previous(self, drive_service, previous, file_id):
+        """Met à la corbeille le fichier remplacé par file_id et le retire de l'index et du miroir Drive."""
+        if previous is None or previous['id'] == file_id:
+            return
+        try:
+            with METRICS.request('drive', 'trash'):
+                drive_service.files().update(fileId=previous['id'], body={'trashed': True},
+                                             supportsAllDrives=True).execute()
+        except HttpError as e:
+            # Déjà supprimé à la main : il suffit de l'oublier
+            if e.resp.status != 404:
+                raise
+        if previous['parent_id']:
+            self.drive_index.remove(previous['parent_id'], previous['name'], previous['id'], previous.get('md5Checksum'))
+        self.drive_mirror.remove(previous['id'])
+        self.drive_mirror.forget_upload(previous['id'])
+
+    def feed(self, tracks):
         try:
-            with YoutubeDL(ydl_opts) as ydl:
-                ydl.download([youtube_url])
-                # rajoute les metadonnée présentent sur l'excel dans le fichier mp3 (titre, artiste, album, date, explicit)
-                audio = MP3(output_path, ID3=EasyID3)
-                audio['title'] = titre
-                audio['artist'] = artiste_raw
-                audio['album'] = album if pd.notna(album) else "Inconnu"
-                audio['date'] = str(date) if pd.notna(date) else "Inconnu"
-                audio.save()
-                # Crée ou récupère le dossier de la playlist dans le dossier racine
-                drive_playlist_folder_id = get_or_create_drive_folder(drive_service, playlist, parent_id=parent_folder_id)
-                # Upload vers Google Drive
-                # Upload le fichier dans le bon dossier
-                upload_to_shared_drive(output_path, drive_service, drive_playlist_folder_id)
-                print(f"Uploadé : {filename} (ID Drive : {drive_playlist_folder_id})")
-                # Supprimer le fichier local après l'upload
-                os.remove(output_path)
-                print(f"Supprimé localement : {filename}")
-                # mettre à jour la valeur de la colonne 'TELECHARGEMENT' dans l'Excel
-                excel_reader.update_row(sheet_name, idx, {
-                    'TELECHARGE': 'VRAI',  # Marquer comme téléchargé
-                })
-                excel_reader.save()  # Enregistrer les modifications dans l'Excel
+            for track in tracks:
+                try:
+                    job = build_track_job(track, self.cache_root, ext=self.audio_ext)
+                except Exception as e:
+                    print(f"\nLigne {track.row} ignorée : {e}")
+                    continue
+                # Déjà sur Drive : on marque la ligne sans rien télécharger
+                # (sauf ligne modifiée : le fichier du même nom est celui des anciennes valeurs)
+                if not job['changed'] and self.already_uploaded(job):
+                    self.report(job, True, skipped=job['filename'])
+                    continue
+                self.download_queue.put(job)
         except Exception as e:
-            print(f"\nErreur lors du téléchargement de {titre} ({youtube_url}) : {e}")
+            # Source des lignes en erreur (ex: base de job_queue.py) : les morceaux déjà en file terminent
+            print(f"\nLecture des lignes interrompue : {e}")
+        finally:
+            # Toujours envoyé, sinon les étapes suivantes et le lecteur des statuts attendent indéfiniment
+            for _ in range(self.download_workers):
+                self.download_queue.put(STOP)
+
+    def prepare_folders(self, playlists=()):
+        """
+        Met à jour le miroir Drive (les changements depuis la dernière exécution, un listing complet
+        la première fois), crée à l'avance les dossiers manquants des playlists à traiter,
+        puis indexe depuis le miroir le contenu de tous les dossiers de playlist.
+        """
+        folder_names = {sanitize_playlist_name(playlist) for playlist in playlists}
+        drive_service = self.get_drive_service()
+        self.drive_mirror.sync(drive_service)
+        existing = self.drive_mirror.folders()
+        created = self.folder_cache.prepare(drive_service, self.parent_folder_id, folder_names, existing)
+        for name, folder_id in created.items():
+            self.drive_mirror.add({'id': folder_id, 'name': name, 'mimeType': FOLDER_MIMETYPE}, self.parent_folder_id)
+        self.drive_index.load(self.drive_mirror, list(existing.values()) + list(created.values()))
+
+    def already_uploaded(self, job):
+        """Vrai si un fichier du même nom existe déjà dans le dossier Drive de la playlist."""
+        folder_id = self.folder_cache.get(self.parent_folder_id, job['playlist'])
+        return bool(folder_id) and self.drive_index.has_name(folder_id, job['filename'])
+
+    def start(self, tracks):
+        """
+        Démarre toutes les étapes sur un itérable de Track, consommé au fil de l'eau.
+        Les statuts arrivent dans status_queue, suivis de STOP quand le dernier upload est fini.
+        """
+        os.makedirs(self.cache_root, exist_ok=True)
+        # Le pool de processus est créé avant les threads (spawn : pas de fork d'un processus multi-thread)
+        self.process_pool = ProcessPoolExecutor(max_workers=self.transcode_workers, mp_context=multiprocessing.get_context('spawn'))
+        # Cookies du navigateur lus et déchiffrés une seule fois pour toute l'exécution
+        self.cookie_file = extract_browser_cookies(self.cookies_browser) if self.cookies_browser else None
+        threading.Thread(target=self.feed, args=(tracks,), name="feeder", daemon=True).start()
+        self.start_stage("download", self.download, self.download_workers, self.download_queue,
+                         self.transcode_queue, self.transcode_workers)
+        self.start_stage("transcode", self.transcode, self.transcode_workers, self.transcode_queue,
+                         self.upload_queue, self.upload_workers)
+        last = self.start_stage("upload", self.upload, self.upload_workers, self.upload_queue)
+        threading.Thread(target=lambda: (last.join(), self.status_queue.put(STOP)), name="status-closer", daemon=True).start()
+
+    def close(self):
+        """Libère les ressources de l'exécution (pool de processus, instances yt-dlp, cookies)."""
+        if self.process_pool:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+        for ydl in self.ydl_instances:
+            ydl.close()
+        if self.cookie_file:
+            os.remove(self.cookie_file)
+            self.cookie_file = None
+
+    def run(self, tracks, total=None):
+        """
+        Lance le pipeline sur un itérable de Track et écrit les statuts dans l'Excel.
+        """
+        try:
+            self.start(tracks)
+            self.write_statuses(total)
+        finally:
+            self.close()
+            self.excel_reader.save()
+
+    def write_statuses(self, total=None):
+        """Écrivain unique : seul le thread principal touche au classeur Excel."""
+        done = 0
+        with tqdm(total=total, desc="Téléchargement des morceaux") as pbar:
+            while True:
+                status = self.status_queue.get()
+                if status is STOP:
+                    return
+                if self.write_status(status):
+                    done += 1
+                    # Sauvegarde périodique
+                    if done % self.save_every == 0:
+                        self.excel_reader.save()
+                pbar.update(1)
+
+    def write_status(self, status):
+        """Affiche le statut d'un morceau et marque sa ligne si besoin. Retourne True si la ligne a changé."""
+        job = status['job']
+        if not status['ok']:
+            print(f"\nErreur lors du téléchargement de {job['titre']} ({job['url']}) : {status['error']}")
+            return False
+        if status['skipped']:
+            print(f"Déjà présent sur Drive : {job['filename']} ({status['skipped']})")
+        else:
+            print(f"Uploadé : {job['filename']}")
+        METRICS.rows('download')
+        # mettre à jour la valeur de la colonne 'TELECHARGE' dans l'Excel
+        self.excel_reader.write_row(self.sheet_name, job['row'], {
+            'TELECHARGE': 'VRAI',  # Marquer comme téléchargé
+            HASH_COLUMNS['download']: job['input_hash'],
+        })
+        return True
+
+def download_and_upload_to_drive(excel_reader, tracks, sheet_name, service_account_file, scopes, parent_folder_id, cache_root,
+                                 download_workers=4, transcode_workers=None, upload_workers=4,
+                                 upload_chunk_size=UPLOAD_CHUNK_SIZE, api_endpoint=None, cookies_browser='firefox',
+                                 audio_cache_max_bytes=AUDIO_CACHE_MAX_BYTES, audio_format='mp3',
+                                 staging_max_bytes=None, stream_uploads=False, embed_covers=True,
+                                 cover_cache_max_bytes=COVER_CACHE_MAX_BYTES):
+    """
+    Fonction principale pour télécharger les morceaux depuis YouTube et les uploader sur Google Drive.
+    """
+    pipeline = DownloadPipeline(excel_reader, sheet_name, service_account_file, scopes, parent_folder_id, cache_root,
+                                download_workers=download_workers, transcode_workers=transcode_workers,
+                                upload_workers=upload_workers, upload_chunk_size=upload_chunk_size,
+                                api_endpoint=api_endpoint, cookies_browser=cookies_browser,
+                                audio_cache_max_bytes=audio_cache_max_bytes, audio_format=audio_format,
+                                staging_max_bytes=staging_max_bytes, stream_uploads=stream_uploads,
+                                embed_covers=embed_covers, cover_cache_max_bytes=cover_cache_max_bytes)
+    pipeline.prepare_folders({track.playlist for track in tracks if track.playlist})
+    pipeline.run(tracks, total=len(tracks))
     return
 
 
 if __name__ == "__main__":
+    CASSETTE = cassette.start_from_args("bot_downloader")  # --record, --replay (voir cassette.py)
+    PROFILER = start_from_args("bot_downloader")  # --profile, --profile-memory (voir profiling.py)
     # === CONFIGURATION ===
     EXCEL_FILE = "Programmation_template.xlsx"  # Remplace par le nom du fichier
     DOWNLOAD_ROOT = "cache"    # Dossier racine des téléchargements
@@ -192,7 +1153,21 @@ if __name__ == "__main__":
     with open(SERVICE_ACCOUNT_FILE, 'r') as file:
         CLIENT_EMAIL = json.load(file)['client_email']  # Email du compte de service
     SHEET_NAME = "TITRES"  # Nom de la feuille dans le fichier Excel
+    DOWNLOAD_WORKERS = 4  # Téléchargements YouTube simultanés
+    TRANSCODE_WORKERS = os.cpu_count()  # Conversions ffmpeg simultanées (une par cœur)
+    UPLOAD_WORKERS = 4  # Uploads Google Drive simultanés
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Taille des morceaux d'upload (multiple de 256 Ko)
+    AUDIO_FORMAT = 'mp3'  # 'mp3' (réencodage, tous lecteurs), 'm4a' ou 'opus' (copie du flux natif, sans réencodage)
+    AUDIO_CACHE_MAX_BYTES = 5 * 1024 ** 3  # Taille maximale du cache audio partagé entre playlists (5 Go)
+    STAGING_MAX_BYTES = None  # Place disque max des fichiers en attente d'upload (ex: 500 * 1024 ** 2), None : illimitée
+    STREAM_UPLOADS = False  # True : ffmpeg envoie directement vers Drive (mp3/opus), sans fichier converti ni cache audio
+    EMBED_COVERS = True  # Pochette de l'album (colonne POCHETTE, voir metadata.py) intégrée à chaque fichier
+    COVER_CACHE_MAX_BYTES = 200 * 1024 ** 2  # Taille maximale du cache des pochettes, une par album (200 Mo)
+    COOKIES_BROWSER = 'firefox'  # Navigateur dont on extrait les cookies une fois par exécution (None : aucun)
+    DRIVE_API_ENDPOINT = os.getenv('DRIVE_API_ENDPOINT')  # ex: http://localhost:8000/ pour un faux serveur Drive
+    METRICS_FILE = "cache/metrics/bot_downloader"  # Mesures exportées en .json et .prom (node exporter)
     EXCEL_READER = ExcelReader(EXCEL_FILE)
+    METRICS.start_export(METRICS_FILE)
     
     print("==================================================================================================")
     print("Bienvenue dans l'uploader de playlist dans google drive !                                        |")
@@ -208,9 +1183,13 @@ if __name__ == "__main__":
     print("                                                                                                 |")
     print("Appuyez sur Ctrl+C pour arrêter le programme                                                     |")
     print("==================================================================================================")
-    df = EXCEL_READER.read_dataframe(SHEET_NAME)
-    df = df[df['TELECHARGE'] == False]
-    print(f"Il y a {len(df)} titres à uploader dans l'Excel '{EXCEL_FILE}' (feuille '{SHEET_NAME}')")
+    tracks = EXCEL_READER.read_tracks(SHEET_NAME)
+    # titres pas encore téléchargés, ou dont le lien, l'artiste, le titre ou la playlist a changé depuis
+    changed = EXCEL_READER.changed_rows(SHEET_NAME, tracks, 'download')
+    # ignorer les liens morts signalés par link_validator.py
+    tracks = [track for track in tracks
+              if (track.telecharge == False or track.row in changed) and track.disponible != 'FAUX']
+    print(f"Il y a {len(tracks)} titres à uploader dans l'Excel '{EXCEL_FILE}' (feuille '{SHEET_NAME}'), dont {len(changed)} modifiés depuis leur upload")
     
     # demander à l'utilisateur de donner le lien du dossier partagé dans Google Drive
     shared_folder_link = input("--> Veuillez entrer le lien du dossier partagé dans Google Drive : ")
@@ -233,8 +1212,8 @@ if __name__ == "__main__":
             print(f"La playlist '{playlist_name}' n'existe pas dans l'Excel. Les playlists disponibles sont : {available_playlists}")
             exit()
         # filtrer l'Excel pour ne garder que les titres de la playlist spécifiée
-        df = df[df['PLAYLIST'] == playlist_name]
-        print(f"Uploader uniquement la playlist : {playlist_name} ({len(df)} titres)")
+        tracks = [track for track in tracks if track.playlist == playlist_name]
+        print(f"Uploader uniquement la playlist : {playlist_name} ({len(tracks)} titres)")
     elif choice == "2":
         print("Uploader toutes les playlists.")
     else:
@@ -245,7 +1224,13 @@ if __name__ == "__main__":
         print("Téléchargement annulé.")
         exit()
     # Lancer le téléchargement et l'upload
-    download_and_upload_to_drive(EXCEL_READER, df, SHEET_NAME, SERVICE_ACCOUNT_FILE, SCOPES, PARENT_FOLDER_ID, DOWNLOAD_ROOT)
+    download_and_upload_to_drive(EXCEL_READER, tracks, SHEET_NAME, SERVICE_ACCOUNT_FILE, SCOPES, PARENT_FOLDER_ID, DOWNLOAD_ROOT,
+                                 download_workers=DOWNLOAD_WORKERS, transcode_workers=TRANSCODE_WORKERS,
+                                 upload_workers=UPLOAD_WORKERS, upload_chunk_size=UPLOAD_CHUNK_SIZE,
+                                 api_endpoint=DRIVE_API_ENDPOINT, cookies_browser=COOKIES_BROWSER,
+                                 audio_cache_max_bytes=AUDIO_CACHE_MAX_BYTES, audio_format=AUDIO_FORMAT,
+                                 staging_max_bytes=STAGING_MAX_BYTES, stream_uploads=STREAM_UPLOADS,
+                                 embed_covers=EMBED_COVERS, cover_cache_max_bytes=COVER_CACHE_MAX_BYTES)
     print("Téléchargement et upload terminés.")
     print("Tous les fichiers ont été uploadés et les entrées Excel mises à jour.")
 
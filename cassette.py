@@ -0,0 +1,241 @@
+import os
+import gzip
+import json
+import time
+import base64
+import atexit
+import hashlib
+import argparse
+import threading
+from collections import defaultdict, deque
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import requests
+import httpx
+import httplib2
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+# Cassettes HTTP : enregistrement des requêtes et réponses des API (Spotify via requests et spotipy,
+# YouTube via youtubesearchpython/httpx, Drive via httplib2) puis rejeu hors ligne, pour comparer
+# des changements sur des entrées identiques. Les téléchargements en flux (yt-dlp) ne sont pas enregistrés.
+
+# En-têtes qui ne décrivent plus le corps enregistré (déjà décompressé)
+DROPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'status'}
+# Secrets remplacés par REDACTED avant l'écriture : jetons des réponses d'authentification (Spotify
+# /api/token, OAuth Google) et en-têtes d'autorisation. Le rejeu n'en a pas besoin (les API ne sont pas appelées)
+SECRET_FIELDS = {'access_token', 'refresh_token', 'id_token'}
+SECRET_HEADERS = {'authorization', 'proxy-authorization'}
+REDACTED = 'REDACTED'
+
+
+class CassetteMiss(Exception):
+    """Requête absente de la cassette en mode rejeu."""
+
+
+def normalize_url(url):
+    """URL avec les paramètres triés, pour que l'ordre des paramètres ne change pas la clé."""
+    parts = urlsplit(str(url))
+    return urlunsplit(parts._replace(query=urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))))
+
+def body_digest(body):
+    if body is None:
+        return ""
+    if isinstance(body, str):
+        body = body.encode()
+    if not isinstance(body, (bytes, bytearray)):
+        body = repr(body).encode()
+    return hashlib.sha1(body).hexdigest()[:16]
+
+def clean_headers(headers):
+    return {key: value for key, value in headers.items()
+            if key.lower() not in DROPPED_HEADERS and not key.startswith('-')}
+
+def redact_headers(headers):
+    return {key: REDACTED if key.lower() in SECRET_HEADERS else value for key, value in headers.items()}
+
+def redact_content(text):
+    """Corps JSON avec les jetons remplacés par REDACTED (inchangé s'il n'en contient pas)."""
+    if not any(f'"{field}"' in text for field in SECRET_FIELDS):
+        return text
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return text
+    if not isinstance(data, dict):
+        return text
+    return json.dumps({key: REDACTED if key in SECRET_FIELDS else value for key, value in data.items()})
+
+
+class Cassette:
+    """
+    Fichier JSON Lines compressé (gzip), une entrée par échange : méthode, URL, empreinte du corps
+    de la requête, statut, en-têtes et corps de la réponse (jetons masqués), durée.
+    En rejeu, une requête est servie par l'entrée de même méthode, URL et corps, sinon (corps variable :
+    horodatage d'un jeton, frontière multipart) par la suivante de même méthode et URL.
+    """
+    def __init__(self, path, mode, latency_scale=0.0):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Mode de cassette inconnu : {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.lock = threading.Lock()
+        self.patches = []
+        self.file = None
+        self.entries = []
+        self.by_body = defaultdict(deque)  # {(méthode, url, corps): [indices]}
+        self.by_url = defaultdict(deque)   # {(méthode, url): [indices]}
+        self.last = {}  # dernière entrée servie par clé, resservie si la cassette est épuisée
+        self.used = set()
+        if mode == 'record':
+            self.file = gzip.open(path, 'wt', encoding='utf-8')
+        else:
+            self.load()
+
+    def load(self):
+        with gzip.open(self.path, 'rt', encoding='utf-8') as file:
+            try:
+                for line in file:
+                    self.entries.append(json.loads(line))
+            except (EOFError, json.JSONDecodeError):
+                pass  # fin tronquée d'un enregistrement interrompu
+        for index, entry in enumerate(self.entries):
+            self.by_body[(entry['method'], entry['url'], entry['body'])].append(index)
+            self.by_url[(entry['method'], entry['url'])].append(index)
+        print(f"Cassette {self.path} : {len(self.entries)} échanges chargés (rejeu)")
+
+    def record(self, method, url, body, status, headers, content, elapsed):
+        try:
+            text, encoding = redact_content(content.decode('utf-8')), 'text'
+        except UnicodeDecodeError:
+            text, encoding = base64.b64encode(content).decode(), 'base64'
+        entry = {
+            'method': method, 'url': normalize_url(url), 'body': body_digest(body),
+            'status': status, 'headers': redact_headers(clean_headers(headers)), 'content': text, 'encoding': encoding,
+            'elapsed': round(elapsed, 4),
+        }
+        with self.lock:
+            self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def take(self, method, url, body):
+        """Entrée à servir pour une requête (voir la docstring de la classe)."""
+        url = normalize_url(url)
+        body_key, url_key = (method, url, body_digest(body)), (method, url)
+        with self.lock:
+            for key, queue in ((body_key, self.by_body[body_key]), (url_key, self.by_url[url_key])):
+                while queue and queue[0] in self.used:
+                    queue.popleft()
+                if queue:
+                    index = queue.popleft()
+                    self.used.add(index)
+                    self.last[body_key] = self.last[url_key] = index
+                    return self.entries[index]
+            index = self.last.get(body_key, self.last.get(url_key))
+        if index is None:
+            raise CassetteMiss(f"{method} {url} absent de la cassette {self.path}")
+        return self.entries[index]
+
+    def play(self, method, url, body):
+        """Entrée à servir, après la durée enregistrée multipliée par latency_scale."""
+        entry = self.take(method, url, body)
+        if self.latency_scale:
+            time.sleep(entry['elapsed'] * self.latency_scale)
+        content = entry['content'].encode() if entry['encoding'] == 'text' else base64.b64decode(entry['content'])
+        return entry, content
+
+    def patch(self, owner, name, replacement):
+        self.patches.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, replacement)
+
+    def install(self):
+        """Remplace les méthodes d'envoi de requests, httpx et httplib2."""
+        cassette = self
+        requests_send = HTTPAdapter.send
+        httpx_handle = httpx.HTTPTransport.handle_request
+        httplib2_request = httplib2.Http.request
+
+        def send(adapter, request, stream=False, **kwargs):
+            if stream:
+                # Téléchargement en flux (yt-dlp) : jamais enregistré
+                return requests_send(adapter, request, stream=stream, **kwargs)
+            if cassette.mode == 'replay':
+                entry, content = cassette.play(request.method, request.url, request.body)
+                response = requests.Response()
+                response.status_code = entry['status']
+                response.headers = CaseInsensitiveDict(entry['headers'])
+                response._content = content
+                response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+                response.url = request.url
+                response.request = request
+                response.connection = adapter
+                return response
+            start = time.perf_counter()
+            response = requests_send(adapter, request, stream=stream, **kwargs)
+            cassette.record(request.method, request.url, request.body, response.status_code,
+                            dict(response.headers), response.content, time.perf_counter() - start)
+            return response
+
+        def handle_request(transport, request):
+            body = request.read()
+            if cassette.mode == 'replay':
+                entry, content = cassette.play(request.method, request.url, body)
+                return httpx.Response(entry['status'], headers=entry['headers'], content=content, request=request)
+            start = time.perf_counter()
+            response = httpx_handle(transport, request)
+            content = response.read()
+            response.close()
+            cassette.record(request.method, request.url, body, response.status_code,
+                            dict(response.headers), content, time.perf_counter() - start)
+            # Corps déjà décompressé : il est renvoyé tel quel
+            return httpx.Response(response.status_code, headers=clean_headers(response.headers),
+                                  content=content, request=request)
+
+        def http_request(http, uri, method="GET", body=None, headers=None, *args, **kwargs):
+            if cassette.mode == 'replay':
+                entry, content = cassette.play(method, uri, body)
+                return httplib2.Response({**entry['headers'], 'status': str(entry['status'])}), content
+            start = time.perf_counter()
+            response, content = httplib2_request(http, uri, method, body, headers, *args, **kwargs)
+            cassette.record(method, uri, body, response.status, dict(response), content, time.perf_counter() - start)
+            return response, content
+
+        self.patch(HTTPAdapter, 'send', send)
+        self.patch(httpx.HTTPTransport, 'handle_request', handle_request)
+        self.patch(httplib2.Http, 'request', http_request)
+        return self
+
+    def close(self):
+        """Restaure les méthodes d'origine et ferme la cassette."""
+        for owner, name, original in reversed(self.patches):
+            setattr(owner, name, original)
+        self.patches = []
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def install(path, mode, latency_scale=0.0):
+    """Active l'enregistrement (mode='record') ou le rejeu (mode='replay') d'une cassette."""
+    return Cassette(path, mode, latency_scale).install()
+
+
+def start_from_args(name, argv=None):
+    """
+    Lit les options de cassette de la ligne de commande d'un script (--record / --replay) et active
+    l'enregistrement ou le rejeu jusqu'à la sortie du programme. Les autres options sont laissées aux
+    autres lecteurs (profiling.start_from_args). Retourne la Cassette ou None.
+    """
+    parser = argparse.ArgumentParser(prog=f"{name}.py")
+    parser.add_argument('--record', metavar='CASSETTE', help="enregistrer les échanges HTTP dans une cassette (ex: cache/cassettes/run.jsonl.gz)")
+    parser.add_argument('--replay', metavar='CASSETTE', help="rejouer une cassette au lieu d'appeler les API")
+    parser.add_argument('--replay-latency', type=float, nargs='?', const=1.0, default=0.0, metavar='FACTEUR',
+                        help="rejouer aussi les durées enregistrées (multipliées par FACTEUR, 1 par défaut)")
+    args, _ = parser.parse_known_args(argv)
+    if args.record and args.replay:
+        parser.error("--record et --replay ne peuvent pas être utilisés ensemble")
+    if not (args.record or args.replay):
+        return None
+    os.makedirs(os.path.dirname(args.record or args.replay) or ".", exist_ok=True)
+    recording = install(args.record or args.replay, 'record' if args.record else 'replay', args.replay_latency)
+    atexit.register(recording.close)
+    return recording
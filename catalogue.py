@@ -0,0 +1,398 @@
+import os
+import re
+import csv
+import gzip
+import json
+import lzma
+import time
+import sqlite3
+import tarfile
+import argparse
+import threading
+import unicodedata
+import warnings
+from datetime import date, datetime
+from spotify_pool import album_image
+from excel_reader import input_hash
+
+warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
+
+# Catalogue local (SQLite) : artiste + titre normalisés -> album, date de sortie, explicite, popularité
+# (et pour les résultats Spotify, identifiant et pochette de l'album).
+# Alimenté par les résultats Spotify au fil des exécutions, les lignes déjà remplies de l'Excel,
+# les cassettes enregistrées, un export CSV (ISRC...) ou un dump MusicBrainz.
+# metadata.py le consulte avant tout appel à l'API Spotify.
+
+# Priorité des sources quand un même titre est connu plusieurs fois (la plus petite gagne)
+SOURCES = {'spotify': 0, 'excel': 1, 'csv': 2, 'musicbrainz': 3}
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    artist_key TEXT NOT NULL,
+    title_key TEXT NOT NULL,
+    source TEXT NOT NULL,
+    artist TEXT,
+    title TEXT,
+    album TEXT,
+    release_date TEXT,
+    explicit INTEGER,
+    popularity INTEGER,
+    isrc TEXT,
+    updated_at REAL,
+    album_id TEXT,
+    image_url TEXT,
+    PRIMARY KEY (artist_key, title_key, source)
+);
+CREATE INDEX IF NOT EXISTS tracks_isrc ON tracks (isrc);
+"""
+# Colonnes ajoutées depuis la première version du catalogue (ALTER TABLE sur les fichiers existants)
+ADDED_COLUMNS = {'album_id': 'TEXT', 'image_url': 'TEXT'}
+# Index plein texte des titres, pour retrouver « Titre - Remastered 2011 » à partir de « Titre »
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS titles USING fts5(title_key, content='tracks', content_rowid='rowid');
+CREATE TRIGGER IF NOT EXISTS tracks_insert AFTER INSERT ON tracks BEGIN
+    INSERT INTO titles (rowid, title_key) VALUES (new.rowid, new.title_key);
+END;
+CREATE TRIGGER IF NOT EXISTS tracks_delete AFTER DELETE ON tracks BEGIN
+    INSERT INTO titles (titles, rowid, title_key) VALUES ('delete', old.rowid, old.title_key);
+END;
+"""
+UPSERT = """
+    INSERT INTO tracks (artist_key, title_key, source, artist, title, album, release_date, explicit, popularity, isrc,
+                        updated_at, album_id, image_url)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (artist_key, title_key, source) DO UPDATE SET
+        artist = excluded.artist, title = excluded.title, album = excluded.album,
+        release_date = excluded.release_date, explicit = COALESCE(excluded.explicit, explicit),
+        popularity = COALESCE(excluded.popularity, popularity), isrc = COALESCE(excluded.isrc, isrc),
+        updated_at = excluded.updated_at, album_id = COALESCE(excluded.album_id, album_id),
+        image_url = COALESCE(excluded.image_url, image_url)
+"""
+# Dumps MusicBrainz : un même enregistrement apparaît sur l'album d'origine et sur les compilations,
+# on garde la sortie la plus ancienne
+KEEP_EARLIEST = " WHERE tracks.release_date IS NULL OR excluded.release_date < tracks.release_date"
+
+# Mêmes séparateurs d'artistes et mentions « feat » que metadata.py
+ARTIST_SEPARATORS = [r"\s+feat\.?\s+", r"\s+ft\.?\s+", r"\s+avec\s+", r"\s+et\s+", r"\s*&\s*", r"\s*;\s*"]
+FEATURING_PATTERN = r'[\(\[\-]?\s*(feat|ft|with|avec|et)\b.*$'
+# Mention de version en fin de titre (« - Remastered 2011 », « (Mono) », « - Single Version ») :
+# même enregistrement, le titre sans la mention doit correspondre exactement au titre recherché
+VERSION_PATTERN = (r'\s*(?:\s-\s|[\(\[])[^()\[\]]*?\b(remaster(ed)?|version|edit|mono|stereo|single|deluxe|bonus track)\b'
+                   r'[^()\[\]]*?[\)\]]?\s*$')
+
+
+def normalize(text):
+    """Clé de recherche : minuscules, sans accents ni ponctuation, espaces simples."""
+    if text is None:
+        return ""
+    text = unicodedata.normalize('NFKD', str(text))
+    text = "".join(char for char in text if not unicodedata.combining(char)).casefold()
+    return re.sub(r'[\W_]+', ' ', text).strip()
+
+def title_key(title):
+    """Clé d'un titre, sans les mentions d'artistes invités."""
+    return normalize(re.sub(FEATURING_PATTERN, '', str(title or ''), flags=re.IGNORECASE))
+
+def version_key(title):
+    """Clé d'un titre sans ses mentions de version (remaster, mono, single...)."""
+    title = str(title or '')
+    while True:
+        stripped = re.sub(VERSION_PATTERN, '', title, flags=re.IGNORECASE)
+        if stripped == title or not stripped.strip():
+            return title_key(title)
+        title = stripped
+
+def split_artists(artists):
+    """Liste des artistes d'un champ ARTISTE (« A feat. B », « A & B », « A, B »...)."""
+    artists = re.sub(r'\(.*?\)', '', str(artists or ''))
+    for sep in ARTIST_SEPARATORS:
+        artists = re.sub(sep, ',', artists, flags=re.IGNORECASE)
+    return [name.strip() for name in artists.split(',') if name.strip()]
+
+def parse_explicit(value):
+    if value is None or isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('1', 'true', 'vrai', 'yes', 'oui', 'explicit'):
+        return True
+    if text in ('0', 'false', 'faux', 'no', 'non', 'clean'):
+        return False
+    return None
+
+def parse_popularity(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+def parse_date(value):
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%d')
+    return str(value) if value not in (None, '') else None
+
+
+class Catalogue:
+    """
+    Index local des titres. Une connexion SQLite par thread (workers de l'orchestrateur),
+    le fichier peut être partagé par plusieurs processus.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        connection = self.connection()
+        connection.executescript(SCHEMA)
+        existing = {row['name'] for row in connection.execute("PRAGMA table_info(tracks)")}
+        for column, column_type in ADDED_COLUMNS.items():
+            if column not in existing:
+                connection.execute(f"ALTER TABLE tracks ADD COLUMN {column} {column_type}")
+        try:
+            connection.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            # SQLite compilé sans FTS5 : correspondances exactes uniquement
+            self.fts = False
+
+    def connection(self):
+        if not hasattr(self.local, 'connection'):
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA busy_timeout=60000")
+            connection.row_factory = sqlite3.Row
+            self.local.connection = connection
+        return self.local.connection
+
+    def add(self, records, source, keep_earliest=False):
+        """
+        Ajoute des titres ({'artist', 'title', 'album', 'release_date', 'explicit', 'popularity', 'isrc'}),
+        une entrée par artiste crédité. Retourne le nombre d'entrées écrites.
+        """
+        now = time.time()
+        rows = []
+        for record in records:
+            key = title_key(record['title'])
+            if not key:
+                continue
+            explicit = parse_explicit(record.get('explicit'))
+            values = (source, record.get('artist'), record.get('title'), record.get('album'),
+                      parse_date(record.get('release_date')), None if explicit is None else int(explicit),
+                      parse_popularity(record.get('popularity')), record.get('isrc'), now,
+                      record.get('album_id'), record.get('image_url'))
+            artists = record['artists'] if 'artists' in record else split_artists(record.get('artist'))
+            for artist in artists:
+                if normalize(artist):
+                    rows.append((normalize(artist), key) + values)
+        if not rows:
+            return 0
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(UPSERT + (KEEP_EARLIEST if keep_earliest else ""), rows)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def add_spotify_track(self, track, artist=None, title=None):
+        """
+        Enregistre un résultat de recherche Spotify, sous ses artistes et son titre, et sous
+        l'artiste et le titre recherchés (artist, title) pour les retrouver sans index plein texte.
+        """
+        if not track.get('artists'):
+            return 0
+        record = {
+            'artist': ", ".join(a['name'] for a in track['artists']),
+            'artists': [a['name'] for a in track['artists']],
+            'title': track['name'],
+            'album': track['album']['name'],
+            'release_date': track['album']['release_date'],
+            'explicit': track['explicit'],
+            'popularity': track.get('popularity'),
+            'isrc': track.get('external_ids', {}).get('isrc'),
+            'album_id': track['album'].get('id'),
+            'image_url': album_image(track['album']),
+        }
+        records = [record]
+        if artist and title and (normalize(artist), title_key(title)) != (normalize(record['artists'][0]), title_key(record['title'])):
+            records.append({**record, 'artists': [artist], 'title': title})
+        return self.add(records, 'spotify')
+
+    def lookup(self, artist, title):
+        """
+        Métadonnées d'un titre ({'ALBUM', 'SORTIE', 'EXPLICITE', 'POPULARITE', 'ALBUM_ID', 'POCHETTE'},
+        None si inconnu) ou None.
+        Correspondance exacte des clés d'abord, puis, pour le même artiste, un titre identique une fois
+        les mentions de version retirées (« Titre - Remastered 2011 » pour « Titre », mais pas
+        « Love Me Do » pour « Love ») ; le plus court s'il y en a plusieurs.
+        """
+        artist_key, key = normalize(artist), title_key(title)
+        if not artist_key or not key:
+            return None
+        connection = self.connection()
+        rows = connection.execute("SELECT * FROM tracks WHERE artist_key = ? AND title_key = ?", (artist_key, key)).fetchall()
+        if not rows and self.fts:
+            key = version_key(title) or key
+            query = " ".join(f'"{token}"' for token in key.split())  # tous les mots
+            candidates = connection.execute("""
+                SELECT tracks.* FROM titles JOIN tracks ON tracks.rowid = titles.rowid
+                WHERE titles MATCH ? AND tracks.artist_key = ? LIMIT 100
+            """, (query, artist_key)).fetchall()
+            rows = [row for row in candidates if version_key(row['title']) == key]
+            if rows:
+                shortest = min(len(row['title_key']) for row in rows)
+                rows = [row for row in rows if len(row['title_key']) == shortest]
+        if not rows:
+            return None
+        row = min(rows, key=lambda row: SOURCES.get(row['source'], len(SOURCES)))
+        return {
+            'ALBUM': row['album'],
+            'SORTIE': row['release_date'],
+            'EXPLICITE': None if row['explicit'] is None else bool(row['explicit']),
+            'POPULARITE': row['popularity'],
+            'ALBUM_ID': row['album_id'],
+            'POCHETTE': row['image_url'],
+        }
+
+    def import_tracks(self, tracks):
+        """
+        Lignes de l'Excel déjà enrichies (Track de ExcelReader.read_tracks), à appeler avant changed_rows.
+        Seules les lignes dont l'empreinte EMPREINTE_METADATA correspond à l'artiste et au titre actuels
+        sont importées : une ligne modifiée garde l'album de ses anciennes valeurs, et une ligne sans
+        empreinte (changed_rows l'enregistre ensuite) a des métadonnées d'origine inconnue.
+        """
+        return self.add(({
+            'artist': track.artiste, 'title': track.titre, 'album': track.album, 'release_date': track.sortie,
+            'explicit': track.explicite, 'popularity': track.popularite, 'album_id': track.album_id,
+            'image_url': track.pochette,
+        } for track in tracks if track.artiste and track.titre and track.album
+            and track.empreinte_metadata == input_hash(track, 'metadata')), 'excel')
+
+    def import_csv(self, path, delimiter=None):
+        """
+        Export CSV/TSV (séparateur détecté, ex: table ISRC -> artiste, titre, album) avec une ligne d'en-tête ;
+        colonnes reconnues : artist/ARTISTE, title/TITRE, album/ALBUM, release_date/SORTIE,
+        explicit/EXPLICITE, popularity/POPULARITE, isrc.
+        """
+        aliases = {'artiste': 'artist', 'artists': 'artist', 'titre': 'title', 'name': 'title', 'sortie': 'release_date',
+                   'date': 'release_date', 'explicite': 'explicit', 'popularite': 'popularity'}
+        with open_dump(path) as file:
+            if delimiter is None:
+                delimiter = csv.Sniffer().sniff(file.readline(), delimiters=',;\t|').delimiter
+                file.seek(0)
+            reader = csv.DictReader(file, delimiter=delimiter)
+            records = ({aliases.get(k.strip().lower(), k.strip().lower()): v for k, v in row.items() if k} for row in reader)
+            return self.add_batches((record for record in records if record.get('artist') and record.get('title')), 'csv')
+
+    def import_musicbrainz(self, path):
+        """
+        Dump JSON des sorties MusicBrainz (fichier « release », une sortie par ligne, éventuellement
+        compressé en .gz/.xz, ou l'archive release.tar.xz complète).
+        """
+        def records(lines):
+            for line in lines:
+                release = json.loads(line)
+                release_artists = [credit['name'] for credit in release.get('artist-credit', [])]
+                for medium in release.get('media', []):
+                    for track in medium.get('tracks', []) or []:
+                        recording = track.get('recording') or {}
+                        artists = [credit['name'] for credit in track.get('artist-credit') or recording.get('artist-credit') or []]
+                        yield {
+                            'artists': artists or release_artists,
+                            'artist': ", ".join(artists or release_artists),
+                            'title': track.get('title') or recording.get('title'),
+                            'album': release.get('title'),
+                            'release_date': release.get('date') or None,
+                            'isrc': (recording.get('isrcs') or [None])[0],
+                        }
+
+        if '.tar' in os.path.basename(path):
+            with tarfile.open(path) as archive:
+                member = next(m for m in archive.getmembers() if m.name.endswith('mbdump/release'))
+                lines = (line.decode('utf-8') for line in archive.extractfile(member))
+                return self.add_batches(records(lines), 'musicbrainz', keep_earliest=True)
+        with open_dump(path) as file:
+            return self.add_batches(records(file), 'musicbrainz', keep_earliest=True)
+
+    def import_cassette(self, path):
+        """Résultats de recherche Spotify enregistrés dans une cassette (--record, voir cassette.py)."""
+        from cassette import Cassette
+        def tracks():
+            for entry in Cassette(path, 'replay').entries:
+                if entry['status'] != 200 or '/search' not in entry['url'] or entry['encoding'] != 'text':
+                    continue
+                try:
+                    items = json.loads(entry['content']).get('tracks', {}).get('items', [])
+                except json.JSONDecodeError:
+                    continue
+                yield from (item for item in items if item and item.get('album'))
+        added = 0
+        for track in tracks():
+            added += self.add_spotify_track(track)
+        return added
+
+    def add_batches(self, records, source, keep_earliest=False, batch_size=10000):
+        """Ajoute un flux de titres par lots (dumps de plusieurs millions de lignes)."""
+        added, batch = 0, []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                added += self.add(batch, source, keep_earliest)
+                batch = []
+                print(f"\r{added} entrées importées", end="", flush=True)
+        added += self.add(batch, source, keep_earliest)
+        print(f"\r{added} entrées importées")
+        return added
+
+    def stats(self):
+        """Nombre d'entrées par source."""
+        return dict(self.connection().execute("SELECT source, COUNT(*) FROM tracks GROUP BY source").fetchall())
+
+
+def open_dump(path):
+    """Ouvre un fichier texte, compressé ou non (.gz, .xz)."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    if path.endswith('.xz'):
+        return lzma.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Catalogue local des titres, consulté par metadata.py avant l'API Spotify.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('import-workbook', help="importe les lignes déjà enrichies de l'Excel")
+    for command, help_text in (('import-musicbrainz', "importe un dump JSON des sorties MusicBrainz"),
+                               ('import-csv', "importe un export CSV/TSV (ISRC, artiste, titre, album...)"),
+                               ('import-cassette', "importe les recherches Spotify d'une cassette")):
+        subparser = subparsers.add_parser(command, help=help_text)
+        subparser.add_argument('path')
+    lookup = subparsers.add_parser('lookup', help="cherche un titre dans le catalogue")
+    lookup.add_argument('artist')
+    lookup.add_argument('title')
+    subparsers.add_parser('stats', help="nombre d'entrées par source")
+    return parser.parse_args(argv)
+
+
+# Exécution principale
+if __name__ == "__main__":
+    # === CONFIGURATION ===
+    EXCEL_FILE = "Programmation_template.xlsx"
+    SHEET_NAME = "TITRES"
+    CATALOGUE_FILE = "cache/catalogue.sqlite"  # Même fichier que dans metadata.py
+
+    args = parse_args()
+    CATALOGUE = Catalogue(CATALOGUE_FILE)
+    start = time.perf_counter()
+    if args.command == 'import-workbook':
+        from excel_reader import ExcelReader
+        print(f"{CATALOGUE.import_tracks(ExcelReader(EXCEL_FILE).read_tracks(SHEET_NAME))} entrées importées depuis {EXCEL_FILE}")
+    elif args.command == 'import-musicbrainz':
+        CATALOGUE.import_musicbrainz(args.path)
+    elif args.command == 'import-csv':
+        CATALOGUE.import_csv(args.path)
+    elif args.command == 'import-cassette':
+        print(f"{CATALOGUE.import_cassette(args.path)} entrées importées depuis {args.path}")
+    elif args.command == 'lookup':
+        print(CATALOGUE.lookup(args.artist, args.title) or "Titre absent du catalogue")
+    if args.command != 'lookup':
+        print(f"Catalogue {CATALOGUE_FILE} : {CATALOGUE.stats()} ({time.perf_counter() - start:.1f}s)")
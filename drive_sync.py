@@ -0,0 +1,320 @@
+import os
+import time
+import sqlite3
+import argparse
+import threading
+from googleapiclient.errors import HttpError
+from metrics import METRICS
+
+# Miroir local (SQLite) de l'arborescence Google Drive sous le dossier parent des playlists :
+# identifiants, noms, parents, tailles et checksums des dossiers et des fichiers.
+# La première synchronisation liste toute l'arborescence, les suivantes n'appliquent que les
+# changements (changes.list) depuis le page token enregistré : une petite requête par exécution.
+# bot_downloader.py le consulte au lieu de lister le dossier parent et chaque dossier de playlist.
+
+FOLDER_MIMETYPE = 'application/vnd.google-apps.folder'
+FILE_FIELDS = "id, name, mimeType, parents, size, md5Checksum, trashed"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    root_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    parent_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    mime_type TEXT,
+    size INTEGER,
+    md5 TEXT,
+    synced_at REAL,
+    PRIMARY KEY (root_id, id)
+);
+CREATE INDEX IF NOT EXISTS files_parent ON files (root_id, parent_id, name);
+CREATE TABLE IF NOT EXISTS roots (
+    root_id TEXT PRIMARY KEY,
+    page_token TEXT,
+    synced_at REAL
+);
+-- Fichier uploadé pour chaque empreinte des colonnes d'entrée d'une ligne (excel_reader.input_hash) :
+-- quand la ligne est modifiée, l'ancien fichier est retrouvé par l'ancienne empreinte et remplacé
+CREATE TABLE IF NOT EXISTS uploads (
+    root_id TEXT NOT NULL,
+    input_hash TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    PRIMARY KEY (root_id, input_hash)
+);
+"""
+UPSERT = """
+    INSERT INTO files (root_id, id, parent_id, name, mime_type, size, md5, synced_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (root_id, id) DO UPDATE SET
+        parent_id = excluded.parent_id, name = excluded.name, mime_type = excluded.mime_type,
+        size = excluded.size, md5 = excluded.md5, synced_at = excluded.synced_at
+"""
+# Un dossier et tout ce qu'il contient (suppression, déplacement hors de l'arborescence)
+DELETE_TREE = """
+    WITH RECURSIVE tree (id) AS (
+        SELECT ?
+        UNION SELECT files.id FROM files JOIN tree ON files.parent_id = tree.id WHERE files.root_id = ?
+    )
+    DELETE FROM files WHERE root_id = ? AND id IN tree
+"""
+# Page token refusé par Drive (trop ancien, invalide) : nouvelle synchronisation complète
+EXPIRED_TOKEN_STATUS = {400, 404, 410}
+
+
+def list_children(service, folder_id):
+    """Liste (avec pagination) le contenu d'un dossier Drive, dossiers et fichiers."""
+    files = []
+    page_token = None
+    while True:
+        with METRICS.request('drive', 'list'):
+            results = service.files().list(
+                q=f"'{folder_id}' in parents and trashed=false",
+                spaces="drive",
+                fields=f"nextPageToken, files({FILE_FIELDS})",
+                corpora="allDrives",
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True,
+                pageSize=1000,
+                pageToken=page_token,
+            ).execute()
+        files.extend(results.get('files', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return files
+
+
+class DriveMirror:
+    """
+    Miroir du dossier Drive root_id et de ses sous-dossiers. Une connexion SQLite par thread
+    (workers d'upload), le fichier peut contenir les miroirs de plusieurs dossiers parents.
+    """
+    def __init__(self, path, root_id):
+        self.path = path
+        self.root_id = root_id
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection().executescript(SCHEMA)
+
+    def connection(self):
+        if not hasattr(self.local, 'connection'):
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA busy_timeout=60000")
+            connection.row_factory = sqlite3.Row
+            self.local.connection = connection
+        return self.local.connection
+
+    def page_token(self):
+        row = self.connection().execute("SELECT page_token FROM roots WHERE root_id = ?", (self.root_id,)).fetchone()
+        return row['page_token'] if row else None
+
+    def sync(self, service, full=False):
+        """
+        Met le miroir à jour : listing complet la première fois (ou si full), sinon application des
+        changements depuis la dernière synchronisation. Retourne le nombre d'éléments listés ou modifiés.
+        """
+        page_token = None if full else self.page_token()
+        if page_token:
+            try:
+                return self.apply_changes(service, page_token)
+            except HttpError as e:
+                if e.resp.status not in EXPIRED_TOKEN_STATUS:
+                    raise
+                print(f"Page token Drive refusé (HTTP {e.resp.status}) : nouvelle synchronisation complète")
+        return self.full_sync(service)
+
+    def full_sync(self, service):
+        """Liste toute l'arborescence du dossier parent et remplace le miroir."""
+        # Token pris avant le listing : les changements faits pendant le listing seront réappliqués
+        with METRICS.request('drive', 'changes_start'):
+            page_token = service.changes().getStartPageToken(supportsAllDrives=True).execute()['startPageToken']
+        now = time.time()
+        rows = []
+        folders = [self.root_id]
+        while folders:
+            folder_id = folders.pop()
+            for file in list_children(service, folder_id):
+                rows.append(self.row(file, folder_id, now))
+                if file.get('mimeType') == FOLDER_MIMETYPE:
+                    folders.append(file['id'])
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM files WHERE root_id = ?", (self.root_id,))
+            connection.executemany(UPSERT, rows)
+            self.save_token(connection, page_token, now)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        METRICS.inc('drive_mirror_synced_total', mode='full')
+        return len(rows)
+
+    def apply_changes(self, service, page_token):
+        """Applique les changements Drive depuis page_token (une requête tant qu'il y en a moins de 1000)."""
+        changes = []
+        while True:
+            with METRICS.request('drive', 'changes'):
+                results = service.changes().list(
+                    pageToken=page_token,
+                    spaces="drive",
+                    fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))",
+                    includeItemsFromAllDrives=True,
+                    supportsAllDrives=True,
+                    pageSize=1000,
+                ).execute()
+            changes.extend(results.get('changes', []))
+            if 'newStartPageToken' in results:
+                page_token = results['newStartPageToken']
+                break
+            page_token = results['nextPageToken']
+
+        now = time.time()
+        connection = self.connection()
+        folders = {self.root_id} | {row['id'] for row in connection.execute(
+            "SELECT id FROM files WHERE root_id = ? AND mime_type = ?", (self.root_id, FOLDER_MIMETYPE))}
+        removed = []
+        pending = []
+        # Dernier état de chaque fichier seulement (un fichier peut apparaître dans plusieurs pages)
+        latest = {change['fileId']: change for change in changes}
+        for change in latest.values():
+            file = change.get('file')
+            if change.get('removed') or not file or file.get('trashed'):
+                removed.append(change['fileId'])
+            else:
+                pending.append(file)
+        folders -= set(removed)
+        # Un dossier créé peut arriver après ses fichiers dans la liste : on applique d'abord
+        # ce dont le parent est connu, jusqu'à ce que plus rien ne change
+        rows = []
+        new_folders = []
+        while pending:
+            outside = []
+            for file in pending:
+                parent_id = next((parent for parent in file.get('parents') or [] if parent in folders), None)
+                if parent_id is None:
+                    outside.append(file)
+                    continue
+                rows.append(self.row(file, parent_id, now))
+                if file.get('mimeType') == FOLDER_MIMETYPE and file['id'] not in folders:
+                    folders.add(file['id'])
+                    new_folders.append(file['id'])
+            if len(outside) == len(pending):
+                break
+            pending = outside
+        # Fichiers hors de l'arborescence : déplacés ailleurs (à retirer du miroir) ou sans rapport
+        removed += [file['id'] for file in pending]
+        # Dossier déplacé dans l'arborescence depuis ailleurs : son contenu n'apparaît pas dans les changements
+        while new_folders:
+            folder_id = new_folders.pop()
+            for file in list_children(service, folder_id):
+                rows.append(self.row(file, folder_id, now))
+                if file.get('mimeType') == FOLDER_MIMETYPE:
+                    new_folders.append(file['id'])
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for file_id in removed:
+                connection.execute(DELETE_TREE, (file_id, self.root_id, self.root_id))
+            connection.executemany(UPSERT, rows)
+            self.save_token(connection, page_token, now)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        METRICS.inc('drive_mirror_synced_total', mode='changes')
+        return len(changes)
+
+    def save_token(self, connection, page_token, now):
+        connection.execute("""
+            INSERT INTO roots (root_id, page_token, synced_at) VALUES (?, ?, ?)
+            ON CONFLICT (root_id) DO UPDATE SET page_token = excluded.page_token, synced_at = excluded.synced_at
+        """, (self.root_id, page_token, now))
+
+    def row(self, file, parent_id, now):
+        size = file.get('size')
+        return (self.root_id, file['id'], parent_id, file.get('name', ''), file.get('mimeType'),
+                int(size) if size is not None else None, file.get('md5Checksum'), now)
+
+    def add(self, file, parent_id):
+        """Enregistre un fichier ou un dossier créé par ce programme ({'id', 'name', 'mimeType', 'size', 'md5Checksum'})."""
+        self.connection().execute(UPSERT, self.row(file, parent_id, time.time()))
+
+    def remove(self, file_id):
+        """Retire un fichier, ou un dossier et son contenu, du miroir."""
+        self.connection().execute(DELETE_TREE, (file_id, self.root_id, self.root_id))
+
+    def record_upload(self, input_hash, file_id):
+        """Associe l'empreinte d'une ligne au fichier uploadé pour elle."""
+        self.connection().execute(
+            "INSERT OR REPLACE INTO uploads (root_id, input_hash, file_id) VALUES (?, ?, ?)",
+            (self.root_id, input_hash, file_id))
+
+    def uploaded_file(self, input_hash):
+        """
+        Fichier uploadé pour une empreinte ({'id', 'parent_id', 'name', 'md5Checksum'}), sinon None.
+        parent_id et name sont None si le fichier n'est plus dans le miroir (supprimé depuis).
+        """
+        row = self.connection().execute("""
+            SELECT uploads.file_id, files.parent_id, files.name, files.md5 FROM uploads
+            LEFT JOIN files ON files.root_id = uploads.root_id AND files.id = uploads.file_id
+            WHERE uploads.root_id = ? AND uploads.input_hash = ?
+        """, (self.root_id, input_hash)).fetchone()
+        if row is None:
+            return None
+        return {'id': row['file_id'], 'parent_id': row['parent_id'], 'name': row['name'], 'md5Checksum': row['md5']}
+
+    def forget_upload(self, file_id):
+        """Oublie les empreintes associées à un fichier remplacé."""
+        self.connection().execute("DELETE FROM uploads WHERE root_id = ? AND file_id = ?", (self.root_id, file_id))
+
+    def folders(self, parent_id=None):
+        """Sous-dossiers d'un dossier (par défaut le dossier parent) : {nom: id}."""
+        rows = self.connection().execute(
+            "SELECT id, name FROM files WHERE root_id = ? AND parent_id = ? AND mime_type = ? ORDER BY name, id",
+            (self.root_id, parent_id or self.root_id, FOLDER_MIMETYPE)).fetchall()
+        folders = {}
+        for row in rows:
+            folders.setdefault(row['name'], row['id'])
+        return folders
+
+    def files(self, folder_id):
+        """Fichiers d'un dossier, comme les renvoie l'API Drive ({'id', 'name', 'size', 'md5Checksum'})."""
+        rows = self.connection().execute(
+            "SELECT id, name, size, md5 FROM files WHERE root_id = ? AND parent_id = ? AND mime_type IS NOT ?",
+            (self.root_id, folder_id, FOLDER_MIMETYPE)).fetchall()
+        return [{'id': row['id'], 'name': row['name'], 'size': row['size'], 'md5Checksum': row['md5']} for row in rows]
+
+    def summary(self):
+        """Nombre de fichiers et taille totale de chaque dossier de playlist : [(nom, fichiers, octets)]."""
+        return [tuple(row) for row in self.connection().execute("""
+            SELECT folders.name, COUNT(files.id), COALESCE(SUM(files.size), 0)
+            FROM files AS folders LEFT JOIN files ON files.root_id = folders.root_id AND files.parent_id = folders.id
+            WHERE folders.root_id = ? AND folders.parent_id = ? AND folders.mime_type = ?
+            GROUP BY folders.id ORDER BY folders.name
+        """, (self.root_id, self.root_id, FOLDER_MIMETYPE))]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Miroir local (SQLite) du dossier Google Drive des playlists.")
+    parser.add_argument('folder', help="lien ou identifiant du dossier partagé dans Google Drive")
+    parser.add_argument('--full', action='store_true', help="refaire le listing complet au lieu d'appliquer les changements")
+    return parser.parse_args(argv)
+
+
+# Exécution principale
+if __name__ == "__main__":
+    from bot_downloader import authenticate_service_account
+    # === CONFIGURATION ===
+    SCOPES = ['https://www.googleapis.com/auth/drive.file']
+    SERVICE_ACCOUNT_FILE = "credentials/service_account.json"  # Fichier de compte de service
+    MIRROR_FILE = "cache/drive_mirror.sqlite"  # Même fichier que bot_downloader.py (DOWNLOAD_ROOT/drive_mirror.sqlite)
+    DRIVE_API_ENDPOINT = os.getenv('DRIVE_API_ENDPOINT')  # ex: http://localhost:8000/ pour un faux serveur Drive
+    args = parse_args()
+    parent_folder_id = args.folder.rstrip("/").split("/")[-1].split("?")[0]
+    mirror = DriveMirror(MIRROR_FILE, parent_folder_id)
+    service = authenticate_service_account(SERVICE_ACCOUNT_FILE, SCOPES, api_endpoint=DRIVE_API_ENDPOINT)
+    start = time.perf_counter()
+    mode = "listing complet" if args.full or not mirror.page_token() else "changements"
+    count = mirror.sync(service, full=args.full)
+    print(f"Miroir {MIRROR_FILE} à jour ({mode} : {count} éléments, {time.perf_counter() - start:.1f}s)")
+    for name, n_files, size in mirror.summary():
+        print(f"  {name:<40} {n_files:>6} fichiers  {size / 1024 ** 2:>10.1f} Mo")
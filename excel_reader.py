@@ -1,46 +1,370 @@
+import os
+import re
+import math
+import struct
+import hashlib
+import zipfile
+import posixpath
+import numpy as np
 import pandas as pd
 from copy import copy
 from openpyxl import load_workbook
-from openpyxl.worksheet.table import Table
+from openpyxl.worksheet.table import Table, TableColumn
 from openpyxl.worksheet.datavalidation import DataValidation
-from openpyxl.utils import get_column_letter
+from openpyxl.utils import get_column_letter, column_index_from_string
 from openpyxl.worksheet.cell_range import CellRange
 from openpyxl.utils.dataframe import dataframe_to_rows
 import warnings
+from xml.sax.saxutils import escape
+from xml.etree import ElementTree
+from metrics import METRICS
+from profiling import spanned
 warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
 
+# Colonnes de la feuille TITRES et attribut correspondant des Track
+TRACK_COLUMNS = {
+    'PLAYLIST': 'playlist', 'ARTISTE': 'artiste', 'TITRE': 'titre', 'ALBUM': 'album', 'SORTIE': 'sortie',
+    'EXPLICITE': 'explicite', 'POPULARITE': 'popularite', 'CONFIANCE': 'confiance', 'VALIDE': 'valide',
+    'TELECHARGE': 'telecharge', 'LIEN': 'lien', 'DISPONIBLE': 'disponible', 'VERIFIE_LE': 'verifie_le',
+    'EMPREINTE_METADATA': 'empreinte_metadata', 'EMPREINTE_YOUTUBE': 'empreinte_youtube',
+    'EMPREINTE_TELECHARGE': 'empreinte_telecharge', 'ALBUM_ID': 'album_id', 'POCHETTE': 'pochette',
+}
+# Colonnes d'entrée de chaque étape, et colonne où est gardée leur empreinte quand la ligne est traitée :
+# une ligne dont les entrées ont été modifiées dans l'Excel depuis est traitée à nouveau
+STAGE_INPUTS = {
+    'metadata': ('ARTISTE', 'TITRE'),
+    'youtube': ('ARTISTE', 'TITRE'),
+    'download': ('PLAYLIST', 'ARTISTE', 'TITRE', 'LIEN'),
+}
+HASH_COLUMNS = {'metadata': 'EMPREINTE_METADATA', 'youtube': 'EMPREINTE_YOUTUBE', 'download': 'EMPREINTE_TELECHARGE'}
+# Valeurs de TELECHARGE d'une ligne déjà uploadée (booléen Excel ou texte écrit par bot_downloader)
+DOWNLOADED_VALUES = (True, 'VRAI')
+# Colonnes texte, converties une seule fois en str à la lecture (ex: un titre « 1999 » saisi comme nombre)
+TEXT_COLUMNS = {'PLAYLIST', 'ARTISTE', 'TITRE', 'ALBUM', 'LIEN', 'ALBUM_ID', 'POCHETTE'}
+# Valeurs considérées comme vides, comme avec pandas.read_excel (ex: 'NaN' écrit quand rien n'est trouvé)
+EMPTY_VALUES = {'', 'NaN', 'nan', 'NA', 'N/A', '#N/A', 'NULL', 'null', 'None'}
+
+# Lecture du XML des feuilles pour la sauvegarde par patch (voir ExcelReader.save)
+MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+ROW_RE = re.compile(rb'<row\b[^>]*?\br="(\d+)"[^>]*?(/?)>')
+CELL_RE = re.compile(rb'<c\b[^>]*?\br="([A-Z]+)\d+"[^>]*?(?:/>|>.*?</c>)', re.S)
+STYLE_RE = re.compile(rb'\bs="(\d+)"')
+SPANS_RE = re.compile(rb'\sspans="[^"]*"')
+FORMULA_RE = re.compile(rb'<f[\s/>]')
+
+
+def cell_value(column, value):
+    """Valeur d'une cellule telle que stockée dans un Track : None si vide, str pour les colonnes texte."""
+    if value is None or value != value:  # None ou NaN
+        return None
+    if isinstance(value, str):
+        return None if value.strip() in EMPTY_VALUES else value
+    return str(value) if column in TEXT_COLUMNS else value
+
+
+def stage_done(track, stage):
+    """Vrai si la ligne a déjà été traitée par l'étape (métadonnées, lien ou upload présents)."""
+    if stage == 'metadata':
+        return track.album is not None
+    if stage == 'youtube':
+        return track.lien is not None
+    return track.telecharge in DOWNLOADED_VALUES
+
+
+def input_hash(track, stage):
+    """Empreinte (16 caractères hexadécimaux) des colonnes d'entrée de l'étape pour ce Track."""
+    values = "\x1f".join("" if track[column] is None else str(track[column]) for column in STAGE_INPUTS[stage])
+    return hashlib.blake2b(values.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def sheet_parts(archive):
+    """Chemin dans l'archive xlsx du XML de chaque feuille : {nom de la feuille: chemin}."""
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    relations = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    targets = {relation.get('Id'): relation.get('Target') for relation in relations}
+    parts = {}
+    for sheet in workbook.iter(f'{{{MAIN_NS}}}sheet'):
+        target = targets.get(sheet.get(f'{{{REL_NS}}}id'))
+        if target:
+            parts[sheet.get('name')] = (target.lstrip('/') if target.startswith('/')
+                                        else posixpath.normpath(posixpath.join('xl', target)))
+    return parts
+
+
+def copy_member(archive, output, info):
+    """
+    Recopie un fichier d'une archive zip dans une autre sans le décompresser ni le recompresser.
+    zipfile n'a pas d'API publique pour cela : l'en-tête local et les données compressées sont
+    écrits directement, puis l'entrée est ajoutée au répertoire central de l'archive de sortie.
+    """
+    archive.fp.seek(info.header_offset)
+    header = archive.fp.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack('<2H', header[26:30])
+    archive.fp.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+    data = archive.fp.read(info.compress_size)
+    copied = copy(info)
+    copied.flag_bits &= ~0x08  # CRC et tailles dans l'en-tête local plutôt que dans un data descriptor
+    copied.header_offset = output.fp.tell()
+    output.fp.write(copied.FileHeader())
+    output.fp.write(data)
+    output.filelist.append(copied)
+    output.NameToInfo[copied.filename] = copied
+    output.start_dir = output.fp.tell()
+    output._didModify = True
+
+
+def cell_xml(ref, style, cell):
+    """
+    Élément <c> d'une cellule openpyxl (le texte en inlineStr, comme l'écrit openpyxl),
+    avec le style qu'elle a dans le fichier. None si le type de valeur n'est pas géré.
+    """
+    attributes = f'r="{ref}"' + (f' s="{style.decode()}"' if style else '')
+    value = cell.value
+    if value is None:
+        return f'<c {attributes}/>'.encode()
+    if cell.data_type == 'b':
+        return f'<c {attributes} t="b"><v>{int(value)}</v></c>'.encode()
+    if cell.data_type == 'n' and math.isfinite(value):
+        number = int(value) if isinstance(value, (int, np.integer)) else float(value)
+        return f'<c {attributes}><v>{number}</v></c>'.encode()
+    if cell.data_type == 's':
+        text = escape(value)
+        return f'<c {attributes} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'.encode('utf-8')
+    return None
+
+
+def patch_row(row_xml, content, cells):
+    """
+    Nouveau XML d'une ligne dont les cellules {numéro de colonne: cellule openpyxl} ont changé.
+    None si la ligne ne peut pas être patchée (formule dans une cellule modifiée, contenu inattendu).
+    """
+    existing = {}
+    matched = 0
+    for match in CELL_RE.finditer(content):
+        existing[column_index_from_string(match.group(1).decode())] = match.group(0)
+        matched += len(match.group(0))
+    if matched != len(content):
+        return None
+    inserted = False
+    for column, cell in cells.items():
+        old = existing.get(column)
+        if old is not None and FORMULA_RE.search(old):
+            return None  # Formule (éventuellement partagée avec d'autres cellules) : laissée à openpyxl
+        style = STYLE_RE.search(old[:old.index(b'>')]) if old is not None else None
+        new = cell_xml(f"{get_column_letter(column)}{cell.row}", style and style.group(1), cell)
+        if new is None:
+            return None
+        inserted = inserted or old is None
+        existing[column] = new
+    if inserted:
+        # spans (colonnes occupées) n'est qu'une indication : retirée plutôt que recalculée
+        row_xml = SPANS_RE.sub(b'', row_xml)
+    row_xml = row_xml[:-2] + b'>' if row_xml.endswith(b'/>') else row_xml
+    return row_xml + b''.join(existing[column] for column in sorted(existing)) + b'</row>'
+
+
+def patch_sheet_xml(data, rows):
+    """
+    Remplace dans le XML d'une feuille les cellules modifiées ({ligne: {colonne: cellule openpyxl}}),
+    le reste du XML est recopié tel quel. None si une ligne est absente ou ne peut pas être patchée.
+    """
+    pieces = []
+    position = 0
+    for row in sorted(rows):
+        # Accès direct à la ligne (r est le premier attribut chez Excel et openpyxl), sinon parcours des lignes
+        start = data.find(b'<row r="%d"' % row, position)
+        match = ROW_RE.match(data, start) if start >= 0 else None
+        if match is None:
+            match = next((match for match in ROW_RE.finditer(data, position) if int(match.group(1)) >= row), None)
+        if match is None or int(match.group(1)) != row:
+            return None
+        if match.group(2):  # <row .../> sans cellule
+            content, end = b'', match.end()
+        else:
+            close = data.find(b'</row>', match.end())
+            if close < 0:
+                return None
+            content, end = data[match.end():close], close + len(b'</row>')
+        new_row = patch_row(match.group(0), content, rows[row])
+        if new_row is None:
+            return None
+        pieces += [data[position:match.start()], new_row]
+        position = end
+    pieces.append(data[position:])
+    return b''.join(pieces)
+
+
+class Track:
+    """
+    Une ligne de la feuille TITRES : une valeur par colonne (None si vide) et row, son numéro de ligne
+    dans la feuille, qui reste juste quels que soient les filtres appliqués à la liste.
+    Se lit aussi comme une ligne de DataFrame : track['ARTISTE'] est track.artiste.
+    """
+    __slots__ = ('row',) + tuple(TRACK_COLUMNS.values())
+
+    def __init__(self, row, values=None):
+        self.row = row
+        for attribute in TRACK_COLUMNS.values():
+            setattr(self, attribute, None)
+        if values:
+            self.update(values)
+
+    def __getitem__(self, column):
+        return getattr(self, TRACK_COLUMNS[column])
+
+    def update(self, values):
+        """Met à jour les colonnes connues à partir de {colonne: valeur} (les autres sont ignorées)."""
+        for column, value in values.items():
+            attribute = TRACK_COLUMNS.get(column)
+            if attribute:
+                setattr(self, attribute, cell_value(column, value))
+
+    def to_dict(self):
+        return {column: getattr(self, attribute) for column, attribute in TRACK_COLUMNS.items()}
+
+    def __repr__(self):
+        return f"Track(row={self.row}, artiste={self.artiste!r}, titre={self.titre!r})"
+
+
 class ExcelReader:
+    @spanned('workbook_load')
     def __init__(self, file_path):
         self.file_path = file_path
         self.workbook = load_workbook(filename=self.file_path)
+        self.headers = {}  # {feuille: {colonne: numéro de colonne}}, lu une fois par feuille
+        # Modifications depuis la dernière sauvegarde : cellules écrites par feuille {feuille: {(ligne, colonne)}},
+        # et changement de structure (colonne ou ligne ajoutée) qui impose une sauvegarde complète
+        self.dirty = {}
+        self.structure_changed = False
     
+    @spanned('read_dataframe')
     def read_dataframe(self, sheet_name):
         """Lit une feuille Excel et retourne un DataFrame (structure conservée)."""
         df = pd.read_excel(self.file_path, sheet_name=sheet_name, engine="openpyxl")
         return df
 
+    @spanned('read_tracks')
+    def read_tracks(self, sheet_name):
+        """
+        Lit les lignes d'une feuille depuis le classeur déjà chargé (sans relire le fichier)
+        et retourne une liste de Track. Les lignes vides sont ignorées sans décaler les numéros de ligne.
+        """
+        rows = self.workbook[sheet_name].iter_rows(values_only=True)
+        headers = next(rows, ())
+        columns = [(i, column, TRACK_COLUMNS[column]) for i, column in enumerate(headers) if column in TRACK_COLUMNS]
+        tracks = []
+        for row, values in enumerate(rows, start=2):
+            if all(value is None for value in values):
+                continue
+            track = Track(row)
+            for i, column, attribute in columns:
+                setattr(track, attribute, cell_value(column, values[i]))
+            tracks.append(track)
+        return tracks
+
+    def changed_rows(self, sheet_name, tracks, stage):
+        """
+        Numéros des lignes dont les colonnes d'entrée de l'étape ont changé depuis leur dernier
+        traitement (empreinte enregistrée différente de l'empreinte actuelle).
+        Les lignes sans empreinte traitées avant l'ajout des empreintes ne sont pas retraitées pour autant :
+        leur empreinte actuelle est enregistrée comme référence. Les lignes jamais traitées n'en reçoivent
+        pas : leur empreinte est celle des valeurs qu'elles auront au moment de leur traitement.
+        """
+        column = HASH_COLUMNS[stage]
+        self.ensure_columns(sheet_name, [column])
+        current = np.array([input_hash(track, stage) for track in tracks], dtype=object)
+        stored = np.array([track[column] for track in tracks], dtype=object)
+        missing = pd.isna(stored)
+        for i in np.flatnonzero(missing):
+            if stage_done(tracks[i], stage):
+                self.update_track(sheet_name, tracks[i], {column: current[i]})
+        changed = ~missing & (stored != current)
+        return {tracks[i].row for i in np.flatnonzero(changed)}
+
     def get_playlist_names(self):
         """Retourne la liste des playlists dans la feuille 'NOM PLAYLISTS'."""
         sheet_name = self.workbook.sheetnames[1]  # deuxième feuille
         df = pd.read_excel(self.file_path, sheet_name=sheet_name, engine="openpyxl")
         return df['Playlists'].dropna().unique().tolist()
 
-    def update_row(self, sheet_name, row_index, updates: dict):
+    def column_indexes(self, sheet_name):
+        """
+        Numéro de colonne de chaque en-tête, gardé en mémoire : relire l'en-tête à chaque écriture
+        parcourt toutes les cellules de la feuille (calcul de max_column).
+        """
+        if sheet_name not in self.headers:
+            sheet = self.workbook[sheet_name]
+            self.headers[sheet_name] = {cell.value: cell.column for cell in sheet[1] if cell.value is not None}
+        return self.headers[sheet_name]
+
+    @spanned('update_row')
+    def write_row(self, sheet_name, row, updates: dict):
         """
-        Met à jour une ligne existante (en base 0 pour row_index) dans une feuille,
-        sans casser les tables Excel.
+        Met à jour une ligne existante (row : numéro de ligne dans la feuille, 2 pour la première
+        ligne de données) sans casser les tables Excel.
         """
         sheet = self.workbook[sheet_name]
-        headers = [cell.value for cell in next(sheet.iter_rows(min_row=1, max_row=1))]
-        
+        columns = self.column_indexes(sheet_name)
         for col_name, value in updates.items():
-            if col_name in headers:
-                col_idx = headers.index(col_name) + 1
-                sheet.cell(row=row_index + 2, column=col_idx, value=value)  # +2 car Excel commence à 1 et +1 pour header
+            col_idx = columns.get(col_name)
+            if col_idx:
+                sheet.cell(row=row, column=col_idx, value=value)
+                self.dirty.setdefault(sheet_name, set()).add((row, col_idx))
+
+    def update_row(self, sheet_name, row_index, updates: dict):
+        """
+        Met à jour une ligne à partir de son index dans un DataFrame de read_dataframe (base 0).
+        Attention : read_dataframe saute les lignes vides, l'index peut alors être décalé ;
+        préférer update_track avec les Track de read_tracks.
+        """
+        self.write_row(sheet_name, row_index + 2, updates)  # +2 car Excel commence à 1 et +1 pour header
+
+    def update_track(self, sheet_name, track, updates: dict):
+        """Écrit les mises à jour dans la ligne du Track et les reporte dans le Track."""
+        self.write_row(sheet_name, track.row, updates)
+        track.update(updates)
 
+    def ensure_columns(self, sheet_name, columns):
+        """
+        Ajoute à droite de la table les colonnes manquantes (en-tête seulement),
+        en étendant la table Excel. Retourne la liste des colonnes ajoutées.
+        """
+        sheet = self.workbook[sheet_name]
+        headers = [cell.value for cell in sheet[1]]
+        missing = [col_name for col_name in columns if col_name not in headers]
+        if not missing:
+            return []
+
+        self.structure_changed = True
+        table = next((obj for obj in sheet._tables.values()), None)
+        for col_name in missing:
+            col_idx = sheet.max_column + 1
+            ref_cell = sheet.cell(row=1, column=col_idx - 1)
+            new_cell = sheet.cell(row=1, column=col_idx, value=col_name)
+            # Copier le style de l'en-tête précédent
+            new_cell.font = copy(ref_cell.font)
+            new_cell.fill = copy(ref_cell.fill)
+            new_cell.border = copy(ref_cell.border)
+            new_cell.alignment = copy(ref_cell.alignment)
+            self.headers.pop(sheet_name, None)
+            if table:
+                next_id = max((col.id for col in table.tableColumns), default=0) + 1
+                table.tableColumns.append(TableColumn(id=next_id, name=col_name))
+
+        # Étendre la table Excel jusqu'à la dernière colonne
+        if table:
+            last_row = CellRange(table.ref).max_row
+            table.ref = f"A1:{get_column_letter(sheet.max_column)}{last_row}"
+            if table.autoFilter:
+                table.autoFilter.ref = table.ref
+        return missing
+
+    @spanned('append_row')
     def append_row(self, sheet_name, new_data: dict):
         """
         Ajoute une nouvelle ligne à la fin du tableau existant, en préservant la structure.
+        Retourne le numéro de la ligne ajoutée.
         """
         sheet = self.workbook[sheet_name]
         table = next((obj for obj in sheet._tables.values()), None)
@@ -52,6 +376,7 @@ class ExcelReader:
 
         # Calcul de la nouvelle ligne
         new_row_idx = sheet.max_row + 1
+        self.structure_changed = True
 
         # Ajouter les valeurs une par une avec styles copiés de la ligne précédente
         for header, value in new_data.items():
@@ -96,8 +421,62 @@ class ExcelReader:
         )
         dv.ranges.add(f"{col_letter}2:{col_letter}{new_row_idx}")
         sheet.add_data_validation(dv)
+        return new_row_idx
 
     def save(self):
-        self.workbook.save(self.file_path)
+        """
+        Sauvegarde le classeur. Quand seules des cellules existantes ont été modifiées, seul le XML des
+        feuilles concernées est réécrit dans le fichier xlsx (voir patch_save) ; après un ajout de colonne
+        ou de ligne, ou si le patch n'est pas possible, le classeur entier est réécrit par openpyxl.
+        Sans modification depuis la dernière sauvegarde, le fichier n'est pas réécrit.
+        """
+        if not self.dirty and not self.structure_changed:
+            return
+        if not self.structure_changed:
+            with METRICS.timer('workbook_save_seconds', mode='patch'):
+                saved = self.patch_save()
+            if saved:
+                self.dirty = {}
+                return
+        with METRICS.timer('workbook_save_seconds', mode='full'):
+            self.workbook.save(self.file_path)
+        self.dirty = {}
+        self.structure_changed = False
+
+    def patch_save(self):
+        """
+        Réécrit dans le fichier xlsx les cellules modifiées depuis la dernière sauvegarde : le XML des
+        feuilles modifiées est patché cellule par cellule, les autres fichiers de l'archive sont recopiés
+        tels quels. Le fichier sur le disque doit correspondre au classeur chargé ou à la dernière sauvegarde.
+        Retourne False (sans rien écrire) si une cellule ne peut pas être patchée.
+        """
+        temp_path = f"{self.file_path}.{os.getpid()}.tmp"
+        try:
+            with zipfile.ZipFile(self.file_path) as archive:
+                parts = sheet_parts(archive)
+                patched = {}
+                for sheet_name, cells in self.dirty.items():
+                    sheet = self.workbook[sheet_name]
+                    rows = {}
+                    for row, column in cells:
+                        rows.setdefault(row, {})[column] = sheet.cell(row=row, column=column)
+                    data = patch_sheet_xml(archive.read(parts[sheet_name]), rows)
+                    if data is None:
+                        return False
+                    patched[parts[sheet_name]] = data
+                with zipfile.ZipFile(temp_path, 'w') as output:
+                    for info in archive.infolist():
+                        if info.filename in patched:
+                            # Compression rapide : c'est la partie la plus lourde, réécrite à chaque sauvegarde
+                            output.writestr(info, patched[info.filename], zipfile.ZIP_DEFLATED, 1)
+                        else:
+                            copy_member(archive, output, info)
+            os.replace(temp_path, self.file_path)
+            return True
+        except (KeyError, zipfile.BadZipFile, ElementTree.ParseError):
+            return False
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
 
 
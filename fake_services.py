@@ -0,0 +1,396 @@
+import io
+import json
+import base64
+import time
+import wave
+import random
+import hashlib
+import itertools
+import threading
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Faux serveurs HTTP locaux (Spotify, YouTube, Google Drive) pour mesurer les scripts
+# sans consommer de quota. Utilisés par benchmark.py.
+
+FOLDER_MIMETYPE = 'application/vnd.google-apps.folder'
+# Petite image JPEG (16x16) servie comme pochette d'album par le faux Spotify
+COVER_JPEG = base64.b64decode(
+    "/9j/4AAQSkZJRgABAgAAAQABAAD//gAPTGF2YzYxLjMuMTAwAP/bAEMACD4+ST5JVVVVVVVVZF1kaGhoZGRkZGhoaHBwcIODg3BwcGhocHB8fIODj5OP"
+    "h4eDh5OTm5uburqystnZ4P/////EAEsAAQEAAAAAAAAAAAAAAAAAAAAFAQEAAAAAAAAAAAAAAAAAAAAGEAEAAAAAAAAAAAAAAAAAAAAAEQEAAAAAAAAAAAAA"
+    "AAAAAAAA/8AAEQgAEAAQAwEiAAIRAAMRAP/aAAwDAQACEQMRAD8AggHY6//Z")
+
+
+def stable_hash(text):
+    """Entier déterministe (contrairement à hash(), qui change d'une exécution à l'autre)."""
+    return int(hashlib.md5(text.encode()).hexdigest()[:12], 16)
+
+def fake_video_id(text):
+    """Identifiant de 11 caractères au format YouTube, dérivé du texte."""
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+    n = stable_hash(text)
+    return "".join(alphabet[(n >> (6 * i)) % 64] for i in range(11))
+
+def catalogue_track(k):
+    """Morceau k du catalogue généré (mêmes noms que les lignes de benchmark.make_workbook)."""
+    return f"Artiste {k % 997}", f"Titre {k}"
+
+def silent_wav(seconds=3, rate=8000):
+    """Petit fichier WAV (silence) servi comme média par le faux YouTube."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b'\x00\x00' * int(seconds * rate))
+    return buffer.getvalue()
+
+
+class FakeService:
+    """
+    Serveur HTTP local dans un thread, avec latence configurable, injection d'erreurs
+    (ex: 429 avec Retry-After, 403) et compteurs de requêtes par route.
+    Les sous-classes implémentent route(handler, method, path, params, body) qui retourne
+    (nom de la route, statut, en-têtes, corps).
+    """
+    name = 'service'
+    error_status = 429
+    error_exempt = ()  # routes jamais en erreur
+
+    def __init__(self, latency=0.0, error_rate=0.0, retry_after=0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # connexions persistantes, comme les vraies API
+
+            def log_message(self, *args):
+                pass
+
+            def handle_any(self, method):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                service.respond(self, method, parsed.path, parse_qs(parsed.query), body)
+
+            def do_GET(self):
+                self.handle_any('GET')
+
+            def do_POST(self):
+                self.handle_any('POST')
+
+            def do_PUT(self):
+                self.handle_any('PUT')
+
+            def do_PATCH(self):
+                self.handle_any('PATCH')
+
+            def do_DELETE(self):
+                self.handle_any('DELETE')
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                pass  # connexions coupées par les clients (ex: yt-dlp après une sonde), sans intérêt ici
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, name=f"fake-{self.name}", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def respond(self, handler, method, path, params, body):
+        if self.latency:
+            time.sleep(self.latency)
+        route, status, headers, payload = self.route(handler, method, path, params, body)
+        with self.lock:
+            self.counts[route] += 1
+            inject = route not in self.error_exempt and self.random.random() < self.error_rate
+            if inject:
+                self.counts['errors_injected'] += 1
+        if inject:
+            status, headers = self.error_status, {'Retry-After': str(self.retry_after)}
+            payload = {'error': {'status': self.error_status, 'message': 'erreur injectée'}}
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload).encode()
+            headers = {'Content-Type': 'application/json', **headers}
+        handler.send_response(status)
+        for key, value in headers.items():
+            handler.send_header(key, value)
+        handler.send_header('Content-Length', str(len(payload)))
+        handler.end_headers()
+        if method != 'HEAD':
+            handler.wfile.write(payload)
+
+    def route(self, handler, method, path, params, body):
+        raise NotImplementedError
+
+
+class FakeSpotify(FakeService):
+    """Token, recherche de playlists et de titres, titres d'une playlist (catalogue généré), pochettes."""
+    name = 'spotify'
+    error_exempt = ('token', 'image')
+
+    def __init__(self, n_playlists=20, tracks_per_playlist=50, catalogue_size=20000, **kwargs):
+        super().__init__(**kwargs)
+        self.n_playlists = n_playlists
+        self.tracks_per_playlist = tracks_per_playlist
+        self.catalogue_size = catalogue_size
+
+    def route(self, handler, method, path, params, body):
+        if path == '/api/token':
+            return 'token', 200, {}, {'access_token': 'benchmark', 'token_type': 'Bearer', 'expires_in': 3600}
+        if path == '/v1/search':
+            query = params.get('q', [''])[0]
+            limit = int(params.get('limit', ['10'])[0])
+            if params.get('type', [''])[0] == 'playlist':
+                offset = int(params.get('offset', ['0'])[0])
+                items = [{'id': f"pl{i}", 'name': f"{query} {i}"}
+                         for i in range(offset, min(offset + limit, self.n_playlists))]
+                return 'search_playlist', 200, {}, {'playlists': {'items': items}}
+            return 'search_track', 200, {}, {'tracks': {'items': self.search_tracks(query, limit)}}
+        if path.startswith('/images/'):
+            return 'image', 200, {'Content-Type': 'image/jpeg'}, COVER_JPEG
+        if path.startswith('/v1/playlists/') and path.endswith('/tracks'):
+            playlist_id = path.split('/')[3]
+            rng = random.Random(playlist_id)
+            items = []
+            for _ in range(min(self.tracks_per_playlist, 100)):
+                artist, title = catalogue_track(rng.randrange(self.catalogue_size))
+                items.append({'track': {'name': title, 'artists': [{'name': artist}]}})
+            return 'playlist_tracks', 200, {}, {'items': items}
+        return 'not_found', 404, {}, {'error': {'status': 404}}
+
+    def search_tracks(self, query, limit):
+        """
+        Réponse construite à partir de la requête ('track:X artist:Y', 'artist:"Y" track:"X"'
+        ou texte libre) : un résultat correspondant suivi de résultats sans rapport.
+        """
+        fields = {}
+        for key in ('track', 'artist'):
+            marker = f"{key}:"
+            if marker in query:
+                value = query.split(marker, 1)[1]
+                for other in ('track:', 'artist:'):
+                    value = value.split(f" {other}")[0]
+                fields[key] = value.strip().strip('"')
+        title = fields.get('track', query.replace('"', ''))
+        artist = fields.get('artist', query.replace('"', ''))
+        n = stable_hash(f"{artist}|{title}")
+        items = [self.track_item(title, artist, n)]
+        for i in range(1, min(limit, 3)):
+            items.append(self.track_item(f"Autre titre {n % 1000 + i}", f"Autre artiste {i}", n + i))
+        return items
+
+    def track_item(self, title, artist, n):
+        return {
+            'name': title,
+            'artists': [{'name': artist}],
+            'album': {'id': f"album{n % 500}", 'name': f"Album {n % 500}", 'release_date': f"{1970 + n % 55}-01-01",
+                      'images': [{'url': f"{self.url}/images/album{n % 500}-{size}.jpg", 'width': size, 'height': size}
+                                 for size in (640, 300, 64)]},
+            'popularity': n % 100,
+            'explicit': n % 7 == 0,
+        }
+
+
+class FakeYouTube(FakeService):
+    """API interne de recherche (vidéos, chaînes), infos d'une vidéo et média téléchargeable par yt-dlp."""
+    name = 'youtube'
+    error_status = 403
+    error_exempt = ('media',)
+
+    def __init__(self, media_seconds=3, **kwargs):
+        super().__init__(**kwargs)
+        self.media = silent_wav(media_seconds)
+
+    def route(self, handler, method, path, params, body):
+        if path == '/youtubei/v1/search':
+            request = json.loads(body or b'{}')
+            query = request.get('query', '')
+            if str(request.get('params', '')).startswith('EgIQAg'):
+                return 'channel_search', 200, {}, self.search_response([self.channel_renderer(query)])
+            return 'video_search', 200, {}, self.search_response([self.video_renderer(query, i) for i in range(3)])
+        if path == '/youtubei/v1/player':
+            video_id = params.get('videoId', [''])[0]
+            # Une vidéo sur deux est « auto-générée » (chaîne Topic)
+            description = "Provided to YouTube by Benchmark" if stable_hash(video_id) % 2 else "Clip officiel"
+            return 'player', 200, {}, {'videoDetails': {
+                'videoId': video_id, 'title': video_id, 'author': 'Benchmark', 'channelId': 'UCbenchmark',
+                'lengthSeconds': '180', 'viewCount': '1000', 'shortDescription': description,
+            }}
+        if path == '/watch':
+            return 'media', 200, {'Content-Type': 'audio/wav'}, self.media
+        return 'not_found', 404, {}, {'error': {'code': 404}}
+
+    def search_response(self, items):
+        return {'contents': {'twoColumnSearchResultsRenderer': {'primaryContents': {'sectionListRenderer': {
+            'contents': [{'itemSectionRenderer': {'contents': items}}]}}}}}
+
+    def channel_renderer(self, query):
+        name = query.replace(' official channel', '').strip()
+        return {'channelRenderer': {'channelId': f"UC{fake_video_id(name)}", 'title': {'simpleText': name}}}
+
+    def video_renderer(self, query, i):
+        # Titre et chaîne reprennent la requête : le score de confiance trouve artiste et titre
+        title = query.strip() if i == 0 else f"{query.strip()} (live {i})"
+        return {'videoRenderer': {
+            'videoId': fake_video_id(f"{query}|{i}"),
+            'title': {'runs': [{'text': title}]},
+            'ownerText': {'runs': [{'text': query.strip(), 'navigationEndpoint': {'browseEndpoint': {'browseId': 'UCbenchmark'}}}]},
+            'lengthText': {'simpleText': '3:00'},
+            'viewCountText': {'simpleText': '1 000 vues'},
+            'publishedTimeText': {'simpleText': 'il y a 1 an'},
+        }}
+
+
+class FakeDrive(FakeService):
+    """Listing, flux des changements, création de dossiers, uploads reprenables, corbeille et suppression (API Drive v3)."""
+    name = 'drive'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.files = {}
+        self.sessions = {}
+        self.changes = []  # flux changes.list : le page token est la position dans cette liste
+        self.ids = itertools.count(1)
+
+    def route(self, handler, method, path, params, body):
+        if path == '/drive/v3/files' and method == 'GET':
+            return 'list', 200, {}, self.list_files(params)
+        if path == '/drive/v3/changes/startPageToken' and method == 'GET':
+            with self.lock:
+                return 'changes_start', 200, {}, {'startPageToken': str(len(self.changes))}
+        if path == '/drive/v3/changes' and method == 'GET':
+            return 'changes', 200, {}, self.list_changes(params)
+        if path == '/drive/v3/files' and method == 'POST':
+            metadata = json.loads(body or b'{}')
+            file = self.add_file(metadata, b'')
+            return 'create', 200, {}, {'id': file['id'], 'name': file['name']}
+        if path.startswith('/drive/v3/files/') and method == 'DELETE':
+            with self.lock:
+                if self.files.pop(path.rsplit('/', 1)[1], None):
+                    self.record_change(path.rsplit('/', 1)[1])
+            return 'delete', 204, {}, b''
+        if path.startswith('/drive/v3/files/') and method == 'PATCH':
+            file_id = path.rsplit('/', 1)[1]
+            with self.lock:
+                if file_id not in self.files:
+                    return 'update', 404, {}, {'error': {'code': 404}}
+                # Mise à la corbeille : le fichier disparaît des listings comme s'il était supprimé
+                if json.loads(body or b'{}').get('trashed'):
+                    file = self.files.pop(file_id)
+                else:
+                    file = self.files[file_id]
+                self.record_change(file_id)
+            return 'update', 200, {}, {'id': file_id, 'name': file['name']}
+        if path == '/upload/drive/v3/files' and method == 'POST':
+            session_id = str(next(self.ids))
+            with self.lock:
+                self.sessions[session_id] = {'metadata': json.loads(body or b'{}'), 'data': b''}
+            location = f"{self.url}/upload/drive/v3/files?uploadType=resumable&upload_id={session_id}"
+            return 'upload_start', 200, {'Location': location}, b''
+        if path == '/upload/drive/v3/files' and method == 'PUT':
+            return ('upload_chunk',) + self.upload_chunk(params['upload_id'][0], handler.headers.get('Content-Range', ''), body)
+        return 'not_found', 404, {}, {'error': {'code': 404}}
+
+    def add_file(self, metadata, data):
+        with self.lock:
+            file_id = f"file{next(self.ids)}"
+            self.files[file_id] = {
+                'id': file_id,
+                'name': metadata.get('name', ''),
+                'parent': (metadata.get('parents') or ['root'])[0],
+                'mimeType': metadata.get('mimeType', 'application/octet-stream'),
+                'size': str(len(data)),
+                'md5Checksum': hashlib.md5(data).hexdigest(),
+            }
+            self.record_change(file_id)
+            return self.files[file_id]
+
+    def api_file(self, file):
+        """Fichier tel que le renvoie l'API (parents en liste)."""
+        return {**{k: v for k, v in file.items() if k != 'parent'}, 'parents': [file['parent']], 'trashed': False}
+
+    def record_change(self, file_id):
+        """Ajoute l'état courant d'un fichier au flux des changements (verrou tenu), removed s'il n'existe plus."""
+        file = self.files.get(file_id)
+        change = {'fileId': file_id, 'removed': file is None}
+        if file is not None:
+            change['file'] = self.api_file(file)
+        self.changes.append(change)
+
+    def list_files(self, params):
+        """Interprète les requêtes utilisées par bot_downloader.py (parent, nom, dossier ou fichier)."""
+        query = params.get('q', [''])[0]
+        with self.lock:
+            files = list(self.files.values())
+        if "' in parents" in query:
+            parent = query.split("' in parents")[0].rsplit("'", 1)[1]
+            files = [f for f in files if f['parent'] == parent]
+        if f"mimeType!='{FOLDER_MIMETYPE}'" in query:
+            files = [f for f in files if f['mimeType'] != FOLDER_MIMETYPE]
+        elif f"mimeType='{FOLDER_MIMETYPE}'" in query:
+            files = [f for f in files if f['mimeType'] == FOLDER_MIMETYPE]
+        if "name='" in query:
+            name = query.split("name='", 1)[1].split("' and")[0].replace("\\'", "'")
+            files = [f for f in files if f['name'] == name]
+        start = int(params.get('pageToken', ['0'])[0])
+        size = int(params.get('pageSize', ['100'])[0])
+        response = {'files': [self.api_file(f) for f in files[start:start + size]]}
+        if start + size < len(files):
+            response['nextPageToken'] = str(start + size)
+        return response
+
+    def list_changes(self, params):
+        """Changements depuis pageToken, puis newStartPageToken sur la dernière page."""
+        start = int(params.get('pageToken', ['0'])[0])
+        size = int(params.get('pageSize', ['100'])[0])
+        with self.lock:
+            changes = self.changes[start:start + size]
+            end = len(self.changes)
+        response = {'changes': changes}
+        if start + size < end:
+            response['nextPageToken'] = str(start + size)
+        else:
+            response['newStartPageToken'] = str(end)
+        return response
+
+    def upload_chunk(self, session_id, content_range, body):
+        """Un morceau d'upload reprenable : 308 avec l'avancement, puis 200 avec le fichier créé."""
+        with self.lock:
+            session = self.sessions[session_id]
+        _, _, spec = content_range.partition(' ')
+        byte_range, _, total = spec.partition('/')
+        if byte_range != '*':
+            start = int(byte_range.split('-')[0])
+            if start == len(session['data']):
+                session['data'] += body
+        received = len(session['data'])
+        if total not in ('*', '') and received == int(total):
+            file = self.add_file(session['metadata'], session['data'])
+            with self.lock:
+                self.sessions.pop(session_id, None)
+            return 200, {}, {'id': file['id'], 'size': file['size'], 'md5Checksum': file['md5Checksum']}
+        headers = {'Range': f"bytes=0-{received - 1}"} if received else {}
+        return 308, headers, b''
@@ -0,0 +1,151 @@
+import os
+import time
+import shutil
+import threading
+from collections import OrderedDict
+
+
+# Fichier temporaire plus ancien que ça : laissé par un processus interrompu (un fichier en cours
+# d'écriture par un autre processus partageant le cache est modifié en continu)
+STALE_TEMP_SECONDS = 3600
+# Intervalle entre deux relectures du dossier : fichiers ajoutés ou supprimés par les autres processus
+RESCAN_SECONDS = 60
+
+
+class FileCache:
+    """
+    Stockage local de fichiers adressés par clé (ex: identifiant YouTube + format),
+    avec une taille maximale et une éviction LRU.
+    La date de dernier accès est conservée dans le mtime des fichiers, ce qui permet
+    de retrouver l'ordre LRU d'une exécution à l'autre.
+    Le dossier peut être partagé par plusieurs processus (workers de job_queue.py) : l'index est
+    relu depuis le disque avant l'éviction, au plus toutes les rescan_seconds, ce qui borne le
+    dépassement de la limite à ce que les autres processus ajoutent entre deux relectures.
+    """
+    def __init__(self, root, max_bytes, rescan_seconds=RESCAN_SECONDS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.rescan_seconds = rescan_seconds
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # {chemin: taille}, du moins récent au plus récent
+        self.total_bytes = 0
+        self.scanned_at = 0
+        os.makedirs(root, exist_ok=True)
+        with self.lock:
+            self.scan()
+
+    def scan(self):
+        """Reconstruit l'index en mémoire à partir des fichiers présents sur le disque (verrou tenu)."""
+        now = time.time()
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                    if filename.endswith(".tmp"):
+                        # Fichier incomplet d'une exécution interrompue (pas ceux en cours d'écriture)
+                        if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                            os.remove(path)
+                        continue
+                except FileNotFoundError:
+                    continue  # supprimé entre-temps par un autre processus
+                files.append((stat.st_mtime, path, stat.st_size))
+        self.entries = OrderedDict((path, size) for _, path, size in sorted(files))
+        self.total_bytes = sum(self.entries.values())
+        self.scanned_at = time.monotonic()
+
+    def path_for(self, key, ext):
+        """Chemin du fichier d'une clé, réparti en sous-dossiers pour limiter leur taille."""
+        return os.path.join(self.root, key[:2], f"{key}.{ext}")
+
+    def temp_path(self, key, ext):
+        """
+        Chemin temporaire dans le cache (même disque : le rangement final est un simple renommage),
+        propre au processus et au thread.
+        """
+        path = self.path_for(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+
+    def get(self, key, ext):
+        """Retourne le chemin du fichier en cache (et le marque comme récemment utilisé), sinon None."""
+        path = self.path_for(key, ext)
+        with self.lock:
+            if path not in self.entries:
+                # Rangé depuis la dernière relecture par un autre processus qui partage le dossier
+                try:
+                    self.entries[path] = os.path.getsize(path)
+                except FileNotFoundError:
+                    return None
+                self.total_bytes += self.entries[path]
+            self.entries.move_to_end(path)
+        return path if self.touch(path) else None
+
+    def put(self, key, src_path, ext):
+        """Range un fichier dans le cache (déplacement) puis applique la limite de taille."""
+        path = self.path_for(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.lock:
+            os.replace(src_path, path)
+            if time.monotonic() - self.scanned_at > self.rescan_seconds:
+                self.scan()
+            self.total_bytes -= self.entries.pop(path, 0)
+            self.entries[path] = os.path.getsize(path)
+            self.total_bytes += self.entries[path]
+            self.evict(keep=path)
+        return path
+
+    def copy_to(self, key, ext, dest_path):
+        """
+        Copie le fichier en cache vers dest_path. Seul l'index est mis à jour sous le verrou :
+        la copie se fait en dehors, un fichier supprimé entre-temps (éviction) lève KeyError.
+        """
+        path = self.get(key, ext)
+        if path is None:
+            raise KeyError(key)
+        try:
+            shutil.copyfile(path, dest_path)
+        except FileNotFoundError:
+            self.forget(path)
+            raise KeyError(key)
+        return dest_path
+
+    def read(self, key, ext):
+        """Contenu du fichier en cache (lu hors du verrou, comme copy_to), sinon None."""
+        path = self.get(key, ext)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            self.forget(path)
+            return None
+
+    def touch(self, path):
+        """Met à jour la date de dernier accès ; faux si le fichier a disparu (évincé par un autre processus)."""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            self.forget(path)
+            return False
+
+    def forget(self, path):
+        """Retire de l'index un fichier qui n'existe plus."""
+        with self.lock:
+            self.total_bytes -= self.entries.pop(path, 0)
+
+    def evict(self, keep=None):
+        """Supprime les fichiers les moins récemment utilisés jusqu'à repasser sous la limite (verrou tenu)."""
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            path, size = next(iter(self.entries.items()))
+            if path == keep:
+                break
+            del self.entries[path]
+            self.total_bytes -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,425 @@
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import warnings
+from contextlib import contextmanager
+from excel_reader import ExcelReader, Track, HASH_COLUMNS
+from metrics import METRICS
+
+warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
+
+# File de travaux SQLite partagée par plusieurs processus d'une même machine (le mode WAL repose sur
+# une mémoire partagée : la base ne doit pas être placée sur un dossier réseau) :
+# un coordinateur met en file les lignes à traiter et reporte les résultats dans l'Excel,
+# des workers metadata / youtube / download réservent des lots avec un bail (lease).
+# Un worker qui plante cesse de renouveler ses baux : ses lignes repassent en attente.
+
+STAGES = ('metadata', 'youtube', 'download')
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    stage TEXT NOT NULL,
+    sheet_row INTEGER NOT NULL,  -- numéro de la ligne dans la feuille
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending, leased, done, failed
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    updated_at REAL,
+    PRIMARY KEY (stage, sheet_row)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (stage, status, sheet_row);
+"""
+
+
+class JobQueue:
+    """
+    Travaux par (étape, ligne de l'Excel) avec statut, bail et nombre de tentatives.
+    Une connexion SQLite par thread ; les réservations se font dans une transaction
+    BEGIN IMMEDIATE, donc deux workers ne peuvent jamais obtenir la même ligne.
+    """
+    def __init__(self, path, lease_seconds=300, max_attempts=3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection().executescript(SCHEMA)
+
+    def connection(self):
+        if not hasattr(self.local, 'connection'):
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA busy_timeout=60000")
+            self.local.connection = connection
+        return self.local.connection
+
+    def transaction(self):
+        """Transaction d'écriture : verrou pris dès le début (pas d'interblocage lecture -> écriture)."""
+        connection = self.connection()
+
+        class Transaction:
+            def __enter__(self):
+                connection.execute("BEGIN IMMEDIATE")
+                return connection
+
+            def __exit__(self, exc_type, exc, tb):
+                connection.execute("ROLLBACK" if exc_type else "COMMIT")
+
+        return Transaction()
+
+    def enqueue(self, stage, tracks):
+        """
+        Met en file des Track. Une ligne déjà en file n'est pas dupliquée ;
+        une ligne en échec définitif est remise en attente avec ses nouvelles données.
+        """
+        now = time.time()
+        records = [(stage, track.row, json.dumps(track.to_dict(), default=str), now) for track in tracks]
+        with self.transaction() as connection:
+            before = connection.total_changes
+            connection.executemany("""
+                INSERT INTO jobs (stage, sheet_row, payload, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (stage, sheet_row) DO UPDATE SET
+                    payload = excluded.payload, status = 'pending', attempts = 0, error = NULL,
+                    worker = NULL, lease_until = NULL, updated_at = excluded.updated_at
+                WHERE jobs.status = 'failed'
+            """, records)
+            return connection.total_changes - before
+
+    def requeue_expired(self, connection, now):
+        """Baux expirés (worker arrêté ou planté) : ligne remise en attente, ou en échec après max_attempts."""
+        connection.execute("""
+            UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                            error = COALESCE(error, 'bail expiré'), worker = NULL, lease_until = NULL, updated_at = ?
+            WHERE status = 'leased' AND lease_until < ?
+        """, (self.max_attempts, now, now))
+
+    def claim(self, stage, worker, batch_size=10):
+        """Réserve jusqu'à batch_size lignes en attente pour ce worker. Retourne une liste de Track."""
+        now = time.time()
+        with self.transaction() as connection:
+            self.requeue_expired(connection, now)
+            rows = connection.execute("""
+                SELECT sheet_row, payload FROM jobs WHERE stage = ? AND status = 'pending'
+                ORDER BY sheet_row LIMIT ?
+            """, (stage, batch_size)).fetchall()
+            connection.executemany("""
+                UPDATE jobs SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?
+                WHERE stage = ? AND sheet_row = ?
+            """, [(worker, now + self.lease_seconds, now, stage, row) for row, _ in rows])
+        return [Track(row, json.loads(payload)) for row, payload in rows]
+
+    def renew(self, stage, worker):
+        """Prolonge les baux de toutes les lignes encore réservées par ce worker."""
+        now = time.time()
+        with self.transaction() as connection:
+            connection.execute("""
+                UPDATE jobs SET lease_until = ? WHERE stage = ? AND worker = ? AND status = 'leased'
+            """, (now + self.lease_seconds, stage, worker))
+
+    def complete(self, stage, worker, row, result):
+        """
+        Enregistre le résultat d'une ligne. Ignoré (retourne False) si le bail a expiré et que
+        la ligne a été reprise par un autre worker entre-temps.
+        """
+        with self.transaction() as connection:
+            cursor = connection.execute("""
+                UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_until = NULL, updated_at = ?
+                WHERE stage = ? AND sheet_row = ? AND worker = ? AND status = 'leased'
+            """, (json.dumps(result, default=str), time.time(), stage, row, worker))
+            return cursor.rowcount == 1
+
+    def fail(self, stage, worker, row, error):
+        """Échec d'une ligne : remise en attente, ou échec définitif après max_attempts tentatives."""
+        with self.transaction() as connection:
+            connection.execute("""
+                UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                                error = ?, worker = NULL, lease_until = NULL, updated_at = ?
+                WHERE stage = ? AND sheet_row = ? AND worker = ? AND status = 'leased'
+            """, (self.max_attempts, str(error), time.time(), stage, row, worker))
+
+    def results(self, stage, limit=500):
+        """Résultats terminés, pas encore reportés dans l'Excel. Retourne [(ligne, résultat)]."""
+        rows = self.connection().execute("""
+            SELECT sheet_row, result FROM jobs WHERE stage = ? AND status = 'done' ORDER BY sheet_row LIMIT ?
+        """, (stage, limit)).fetchall()
+        return [(row, json.loads(result)) for row, result in rows]
+
+    def forget(self, stage, rows):
+        """Supprime les travaux terminés une fois leurs résultats sauvegardés dans l'Excel."""
+        with self.transaction() as connection:
+            connection.executemany("DELETE FROM jobs WHERE stage = ? AND sheet_row = ? AND status = 'done'",
+                                   [(stage, row) for row in rows])
+
+    def queued_rows(self, stage):
+        """Lignes de l'étape en attente, réservées ou terminées mais pas encore reportées dans l'Excel."""
+        return {row for (row,) in self.connection().execute(
+            "SELECT sheet_row FROM jobs WHERE stage = ? AND status != 'failed'", (stage,))}
+
+    def counts(self, stage=None):
+        """Nombre de travaux par statut ({statut: n}), pour une étape ou toutes."""
+        query = "SELECT status, COUNT(*) FROM jobs" + (" WHERE stage = ?" if stage else "") + " GROUP BY status"
+        return dict(self.connection().execute(query, (stage,) if stage else ()).fetchall())
+
+    def active(self, stage):
+        """Vrai s'il reste des lignes en attente ou réservées pour l'étape."""
+        counts = self.counts(stage)
+        return counts.get('pending', 0) + counts.get('leased', 0) > 0
+
+
+def rows_to_process(tracks, stage, changed=()):
+    """
+    Lignes à traiter pour une étape (mêmes filtres que les scripts metadata.py, ytb_finder_fast.py et
+    bot_downloader.py), plus les lignes changed dont les entrées ont été modifiées depuis leur traitement.
+    """
+    if stage == 'metadata':
+        return [track for track in tracks if track.row in changed or track.album is None or track.sortie is None]
+    if stage == 'youtube':
+        return [track for track in tracks
+                if track.row in changed or track.lien in (None, 'Non trouvé') or track.disponible == 'FAUX']
+    return [track for track in tracks
+            if (track.telecharge == False or track.row in changed)
+            and str(track.lien).startswith('http') and track.disponible != 'FAUX']
+
+
+class Coordinator:
+    """Seul processus qui touche au classeur : met en file les lignes puis reporte les résultats par lots."""
+    def __init__(self, job_queue, excel_reader, sheet_name, stages=STAGES, poll_interval=10):
+        self.job_queue = job_queue
+        self.excel_reader = excel_reader
+        self.sheet_name = sheet_name
+        self.stages = stages
+        self.poll_interval = poll_interval
+        self.tracks = {}  # {ligne: Track} des lignes lues par enqueue, tenus à jour par merge
+
+    def enqueue(self, tracks):
+        if 'metadata' in self.stages:
+            # Colonnes de l'album Spotify écrites par les workers metadata (voir metadata.ARTWORK_COLUMNS)
+            self.excel_reader.ensure_columns(self.sheet_name, ['ALBUM_ID', 'POCHETTE'])
+        self.tracks = {track.row: track for track in tracks}
+        for stage in self.stages:
+            changed = self.excel_reader.changed_rows(self.sheet_name, tracks, stage)
+            rows = rows_to_process(tracks, stage, changed)
+            deferred = set()
+            if stage == 'download' and 'youtube' in self.stages:
+                # Lien en cours de recherche : mis en file par merge une fois le nouveau lien reporté
+                deferred = self.job_queue.queued_rows('youtube')
+                rows = [track for track in rows if track.row not in deferred]
+            added = self.job_queue.enqueue(stage, rows)
+            print(f"{stage} : {len(rows)} lignes à traiter (dont {len(changed)} modifiées), {added} ajoutées à la file"
+                  + (f", {len(deferred)} en attente de leur lien YouTube" if deferred else ""))
+        # Empreintes de référence enregistrées par changed_rows
+        self.excel_reader.save()
+
+    def merge(self):
+        """
+        Reporte les résultats terminés dans l'Excel, sauvegarde, puis les retire de la file.
+        Les lignes dont le lien YouTube vient d'être reporté sont mises en file pour le téléchargement.
+        """
+        merged = {}
+        for stage in self.stages:
+            results = self.job_queue.results(stage)
+            for row, updates in results:
+                self.excel_reader.write_row(self.sheet_name, row, updates)
+                if row in self.tracks:
+                    self.tracks[row].update(updates)
+            merged[stage] = [row for row, _ in results]
+        if not any(merged.values()):
+            return 0
+        downloads = []
+        if 'download' in self.stages and merged.get('youtube'):
+            tracks = [self.tracks[row] for row in merged['youtube'] if row in self.tracks]
+            changed = self.excel_reader.changed_rows(self.sheet_name, tracks, 'download')
+            downloads = rows_to_process(tracks, 'download', changed)
+        self.excel_reader.save()
+        if downloads:
+            self.job_queue.enqueue('download', downloads)
+        for stage, rows in merged.items():
+            self.job_queue.forget(stage, rows)
+            METRICS.rows(f"merge_{stage}", len(rows))
+        return sum(len(rows) for rows in merged.values())
+
+    def run(self):
+        """Reporte les résultats jusqu'à ce que toutes les étapes soient terminées (ou Ctrl+C)."""
+        try:
+            while True:
+                # État lu avant le report : un résultat youtube reporté peut ajouter des téléchargements
+                active = any(self.job_queue.active(stage) for stage in self.stages)
+                merged = self.merge()
+                if not active and not merged:
+                    break
+                status = ", ".join(f"{stage} {self.job_queue.counts(stage)}" for stage in self.stages)
+                print(f"{merged} lignes reportées dans l'Excel | {status}")
+                time.sleep(self.poll_interval)
+        finally:
+            self.merge()
+        failed = {stage: self.job_queue.counts(stage).get('failed', 0) for stage in self.stages}
+        print(f"Terminé. Lignes en échec (voir la colonne error de la base) : {failed}")
+
+
+@contextmanager
+def renewing(job_queue, stage, worker):
+    """
+    Renouvelle les baux du worker toutes les lease_seconds / 3 pendant le bloc : une ligne réservée
+    peut attendre longtemps son tour (lot en cours, files du pipeline de téléchargement) sans
+    être reprise par un autre worker, qui la traiterait une seconde fois.
+    """
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(job_queue.lease_seconds / 3):
+            try:
+                job_queue.renew(stage, worker)
+            except sqlite3.Error as e:
+                # Base momentanément indisponible : nouvel essai au prochain battement
+                print(f"\nRenouvellement des baux impossible : {e}")
+
+    thread = threading.Thread(target=heartbeat, name=f"lease-{stage}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_row_worker(job_queue, stage, process_track, worker, batch_size=10, poll_interval=5):
+    """
+    Worker metadata ou youtube : réserve des lots et traite les lignes une à une avec process_track
+    (celui de SpotifyMetadataFetcher ou de YouTubeSearcher). S'arrête quand la file de l'étape est vide.
+    Les baux sont renouvelés en tâche de fond tant que le worker tourne (voir renewing).
+    """
+    with renewing(job_queue, stage, worker):
+        while True:
+            batch = job_queue.claim(stage, worker, batch_size)
+            if not batch:
+                if not job_queue.active(stage):
+                    return
+                time.sleep(poll_interval)  # lignes réservées par d'autres : elles peuvent revenir en attente
+                continue
+            for track in batch:
+                updates = process_track(track)
+                if stage == 'youtube':
+                    if updates.get('LIEN') == 'Erreur':
+                        # Erreur réseau ou blocage : nouvel essai plus tard plutôt que d'écrire « Erreur »
+                        job_queue.fail(stage, worker, track.row, "recherche YouTube en erreur")
+                        continue
+                    # Mêmes colonnes que ytb_finder_fast.py ; nouveau lien, à revérifier par link_validator
+                    updates = {'CONFIANCE': updates['CONFIANCE'], 'LIEN': updates['LIEN'], 'DISPONIBLE': None,
+                               HASH_COLUMNS['youtube']: updates[HASH_COLUMNS['youtube']]}
+                if not job_queue.complete(stage, worker, track.row, updates):
+                    print(f"\nLigne {track.row} : bail expiré, reprise par un autre worker (résultat ignoré)")
+                METRICS.rows(stage)
+
+
+def run_download_worker(job_queue, pipeline, worker, batch_size=10, poll_interval=5):
+    """
+    Worker download : les lignes réservées alimentent le pipeline de bot_downloader au fil de l'eau,
+    les statuts des uploads sont enregistrés dans la file au lieu de l'Excel.
+    """
+    from bot_downloader import STOP
+    def claimed_rows():
+        while True:
+            batch = job_queue.claim('download', worker, batch_size)
+            if not batch:
+                # Lignes encore à l'étape youtube : leur téléchargement sera mis en file au report du lien
+                if not job_queue.active('download') and not job_queue.queued_rows('youtube'):
+                    return
+                time.sleep(poll_interval)
+                continue
+            yield from batch
+
+    # Les lignes réservées peuvent attendre plusieurs minutes dans les files du pipeline :
+    # baux renouvelés en tâche de fond (voir renewing), pas seulement à chaque statut
+    with renewing(job_queue, 'download', worker):
+        try:
+            # Contenu actuel du dossier Drive (miroir local) : les fichiers déjà présents ne sont pas renvoyés
+            pipeline.prepare_folders()
+            pipeline.start(claimed_rows())
+            while True:
+                status = pipeline.status_queue.get()
+                if status is STOP:
+                    return
+                job = status['job']
+                if status['ok']:
+                    print(f"Uploadé : {job['filename']}" if not status['skipped'] else f"Déjà présent sur Drive : {job['filename']}")
+                    if not job_queue.complete('download', worker, job['row'],
+                                              {'TELECHARGE': 'VRAI', HASH_COLUMNS['download']: job['input_hash']}):
+                        print(f"\nLigne {job['row']} : bail expiré, reprise par un autre worker (résultat ignoré)")
+                    METRICS.rows('download')
+                else:
+                    print(f"\nErreur lors du téléchargement de {job['titre']} ({job['url']}) : {status['error']}")
+                    job_queue.fail('download', worker, job['row'], status['error'])
+        finally:
+            pipeline.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="File de travaux partagée entre plusieurs processus.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    coordinator = subparsers.add_parser('coordinator', help="met les lignes en file et reporte les résultats dans l'Excel")
+    coordinator.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    worker = subparsers.add_parser('worker', help="traite les lignes d'une étape")
+    worker.add_argument('stage', choices=STAGES)
+    worker.add_argument('--batch', type=int, default=10, help="lignes réservées à la fois")
+    worker.add_argument('--drive-folder', help="identifiant du dossier Google Drive partagé (étape download)")
+    subparsers.add_parser('status', help="affiche l'état de la file")
+    return parser.parse_args(argv)
+
+
+# Exécution principale
+if __name__ == "__main__":
+    # === CONFIGURATION ===
+    EXCEL_FILE = "Programmation_template.xlsx"
+    SHEET_NAME = "TITRES"
+    DATABASE_FILE = "cache/jobs.sqlite"  # Base partagée par le coordinateur et les workers
+    LEASE_SECONDS = 300  # Durée d'un bail, prolongée après chaque ligne traitée
+    MAX_ATTEMPTS = 3  # Tentatives par ligne avant l'échec définitif
+    SPOTIFY_CREDENTIALS_FILE = "credentials/spotify_credentials.json"
+    SERVICE_ACCOUNT_FILE = "credentials/service_account.json"
+    SCOPES = ['https://www.googleapis.com/auth/drive.file']
+    DOWNLOAD_ROOT = "cache"
+    COOKIES_BROWSER = 'firefox'
+    DRIVE_API_ENDPOINT = os.getenv('DRIVE_API_ENDPOINT')
+    CATALOGUE_FILE = "cache/catalogue.sqlite"  # Catalogue local partagé par les workers metadata
+
+    args = parse_args()
+    JOB_QUEUE = JobQueue(DATABASE_FILE, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS)
+
+    if args.command == 'status':
+        for stage in STAGES:
+            print(f"{stage} : {JOB_QUEUE.counts(stage)}")
+    elif args.command == 'coordinator':
+        METRICS.start_export("cache/metrics/job_queue_coordinator")
+        EXCEL_READER = ExcelReader(EXCEL_FILE)
+        coordinator = Coordinator(JOB_QUEUE, EXCEL_READER, SHEET_NAME, stages=args.stages)
+        coordinator.enqueue(EXCEL_READER.read_tracks(SHEET_NAME))
+        print("Lancez maintenant les workers (python job_queue.py worker <étape>), autant que voulu.")
+        coordinator.run()
+    else:
+        WORKER = f"{os.uname().nodename}-{os.getpid()}"
+        METRICS.start_export(f"cache/metrics/job_queue_{args.stage}_{os.getpid()}")
+        print(f"Worker {WORKER} ({args.stage})")
+        if args.stage == 'download':
+            from bot_downloader import DownloadPipeline
+            if not args.drive_folder:
+                raise SystemExit("--drive-folder est obligatoire pour l'étape download")
+            pipeline = DownloadPipeline(None, SHEET_NAME, SERVICE_ACCOUNT_FILE, SCOPES, args.drive_folder, DOWNLOAD_ROOT,
+                                        api_endpoint=DRIVE_API_ENDPOINT, cookies_browser=COOKIES_BROWSER)
+            run_download_worker(JOB_QUEUE, pipeline, WORKER, batch_size=args.batch)
+        else:
+            if args.stage == 'metadata':
+                from metadata import SpotifyMetadataFetcher
+                from spotify_pool import SpotifyPool
+                from catalogue import Catalogue
+                process_track = SpotifyMetadataFetcher(None, SHEET_NAME, catalogue=Catalogue(CATALOGUE_FILE),
+                                                       spotify=SpotifyPool.from_file(SPOTIFY_CREDENTIALS_FILE)).process_track
+            else:
+                from ytb_finder_fast import YouTubeSearcher
+                process_track = YouTubeSearcher(None, SHEET_NAME).process_track
+            run_row_worker(JOB_QUEUE, args.stage, process_track, WORKER, batch_size=args.batch)
+        print(f"Worker {WORKER} : plus de lignes à traiter pour l'étape {args.stage}.")
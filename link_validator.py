@@ -0,0 +1,214 @@
+import os
+import re
+import json
+import threading
+import warnings
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, Dict
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadError
+from tqdm import tqdm
+from excel_reader import ExcelReader
+from metrics import METRICS
+from profiling import start_from_args
+import cassette
+
+warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
+
+# Extraction de l'identifiant de la vidéo depuis les différents formats de lien YouTube
+VIDEO_ID_PATTERN = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([\w-]{11})')
+
+# Messages yt-dlp indiquant qu'une vidéo n'est définitivement plus accessible (vidéo supprimée,
+# privée, compte fermé, retrait pour droits d'auteur). Les autres erreurs, y compris « not available »
+# (restriction géographique, format, blocage temporaire), donnent un statut inconnu, revérifié plus tard :
+# une ligne marquée morte est recherchée à nouveau par ytb_finder_fast alors que son lien peut marcher.
+DEAD_PATTERNS = [
+    r'video unavailable\.?$',  # message seul, sans raison (vidéo supprimée)
+    r'private video',
+    r'has been removed',
+    r'account associated with this video has been terminated',
+    r'no longer available',
+    r"isn't available anymore",
+    r'copyright claim',
+    r'members-only',
+]
+DEAD_MESSAGE = re.compile('|'.join(DEAD_PATTERNS))
+
+def extract_video_id(url) -> Optional[str]:
+    """Retourne l'identifiant (11 caractères) d'un lien YouTube, ou None."""
+    if not isinstance(url, str):
+        return None
+    match = VIDEO_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+
+class LinkValidator:
+    def __init__(self, excel_reader, sheet_name, cache_file="cache/link_status.json",
+                 max_age_hours=72, max_workers=16):
+        self.excel_reader = excel_reader
+        self.sheet_name = sheet_name
+        self.cache_file = cache_file
+        self.max_age = timedelta(hours=max_age_hours)
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.cache = self.load_cache()
+
+    def load_cache(self) -> Dict[str, Dict]:
+        """Charge le cache des vérifications précédentes (clé : identifiant de la vidéo)."""
+        if not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            print(f"Cache illisible ({self.cache_file}), il sera reconstruit.")
+            return {}
+
+    def save_cache(self):
+        """Écrit le cache de manière atomique."""
+        os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+        tmp_file = self.cache_file + ".tmp"
+        with self.lock:
+            with open(tmp_file, 'w') as file:
+                json.dump(self.cache, file)
+        os.replace(tmp_file, self.cache_file)
+
+    def get_ydl(self):
+        """Une instance YoutubeDL par thread, réutilisée pour toutes les vérifications."""
+        if not hasattr(self.local, 'ydl'):
+            self.local.ydl = YoutubeDL({
+                'quiet': True,
+                'no_warnings': True,
+                'skip_download': True,
+                'noplaylist': True,
+            })
+        return self.local.ydl
+
+    def cached_status(self, video_id) -> Optional[Dict]:
+        """Retourne le statut en cache s'il est encore récent."""
+        entry = self.cache.get(video_id)
+        if not entry:
+            return None
+        checked_at = datetime.fromisoformat(entry['checked_at'])
+        if datetime.now() - checked_at > self.max_age:
+            return None
+        return entry
+
+    def check_video(self, video_id) -> Dict:
+        """
+        Vérifie la disponibilité d'une vidéo avec une simple requête de métadonnées
+        (aucun média n'est téléchargé).
+        """
+        url = f"https://www.youtube.com/watch?v={video_id}"
+        status = {'available': True, 'reason': '', 'checked_at': datetime.now().isoformat(timespec='seconds')}
+        try:
+            # process=False : pas de sélection de formats, seulement les infos de la page
+            with METRICS.request('youtube', 'extract_info'):
+                info = self.get_ydl().extract_info(url, download=False, process=False)
+            availability = (info or {}).get('availability')
+            if availability in ('private', 'premium_only', 'subscriber_only'):
+                status.update(available=False, reason=availability)
+            elif availability == 'needs_auth':
+                # Vidéo soumise à une limite d'âge : inaccessible sans compte ici, mais bot_downloader
+                # la télécharge avec les cookies du navigateur. Statut inconnu plutôt que lien mort.
+                status.update(available=None, reason=availability)
+        except DownloadError as e:
+            message = str(e).lower().strip()
+            if DEAD_MESSAGE.search(message):
+                status.update(available=False, reason=str(e).split(':')[-1].strip())
+            else:
+                # Erreur réseau ou blocage temporaire : statut inconnu, à revérifier
+                status.update(available=None, reason=str(e))
+        return status
+
+    def validate(self, tracks):
+        """
+        Vérifie les liens de toutes les lignes en parallèle et met à jour les colonnes
+        DISPONIBLE et VERIFIE_LE. Les lignes mortes sont marquées pour ytb_finder_fast.
+        """
+        self.excel_reader.ensure_columns(self.sheet_name, ['DISPONIBLE', 'VERIFIE_LE'])
+
+        # Regrouper les lignes par vidéo pour ne vérifier chaque lien qu'une seule fois
+        rows_by_video = {}
+        for track in tracks:
+            video_id = extract_video_id(track.lien)
+            if video_id:
+                rows_by_video.setdefault(video_id, []).append(track)
+
+        statuses = {}
+        to_check = []
+        for video_id in rows_by_video:
+            cached = self.cached_status(video_id)
+            METRICS.cache('link_status', hit=cached is not None)
+            if cached:
+                statuses[video_id] = cached
+            else:
+                to_check.append(video_id)
+        print(f"{len(rows_by_video)} vidéos distinctes, {len(statuses)} déjà vérifiées récemment (cache), {len(to_check)} à vérifier.")
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.check_video, video_id): video_id for video_id in to_check}
+            for n, future in enumerate(tqdm(as_completed(futures), total=len(futures), desc="Vérification des liens")):
+                video_id = futures[future]
+                status = future.result()
+                statuses[video_id] = status
+                METRICS.rows('link_validator')
+                if status['available'] is not None:
+                    with self.lock:
+                        self.cache[video_id] = status
+                # Sauvegarde périodique du cache pour pouvoir reprendre
+                if (n + 1) % 500 == 0:
+                    self.save_cache()
+        self.save_cache()
+
+        dead = 0
+        for video_id, video_tracks in rows_by_video.items():
+            status = statuses[video_id]
+            if status['available'] is None:
+                continue
+            if not status['available']:
+                dead += len(video_tracks)
+            for track in video_tracks:
+                self.excel_reader.update_track(self.sheet_name, track, {
+                    'DISPONIBLE': 'VRAI' if status['available'] else 'FAUX',
+                    'VERIFIE_LE': status['checked_at'],
+                })
+        self.excel_reader.save()
+        return dead
+
+
+# Exécution principale
+if __name__ == "__main__":
+    CASSETTE = cassette.start_from_args("link_validator")  # --record, --replay (voir cassette.py)
+    PROFILER = start_from_args("link_validator")  # --profile, --profile-memory (voir profiling.py)
+    EXCEL_FILE = "Programmation_template.xlsx"
+    EXCEL_READER = ExcelReader(EXCEL_FILE)
+    SHEET_NAME = "TITRES"
+    CACHE_FILE = "cache/link_status.json"
+    METRICS_FILE = "cache/metrics/link_validator"  # Mesures exportées en .json et .prom (node exporter)
+    METRICS.start_export(METRICS_FILE)
+
+    # Charger les lignes de la feuille
+    tracks = EXCEL_READER.read_tracks(SHEET_NAME)
+
+    # Ne garder que les lignes avec un lien YouTube
+    tracks = [track for track in tracks if track.lien and 'youtu' in track.lien]
+
+    print("=" * 90)
+    print("Bienvenue dans le vérificateur de liens YouTube!")
+    print("Ce programme vérifie que les liens de la colonne LIEN sont toujours disponibles.")
+    print(f"Nombre de liens à vérifier: {len(tracks)}")
+    print("  - Requêtes de métadonnées uniquement (aucun téléchargement)")
+    print("  - Vérifications en parallèle, résultats mis en cache par vidéo")
+    print("  - Les liens morts sont marqués DISPONIBLE = FAUX et seront recherchés")
+    print("    à nouveau par ytb_finder_fast.py")
+    print("Appuyez sur Ctrl+C pour arrêter le programme")
+    print("=" * 90)
+
+    validator = LinkValidator(EXCEL_READER, SHEET_NAME, cache_file=CACHE_FILE)
+    dead = validator.validate(tracks)
+
+    print(f"\n-> {dead} lignes avec un lien mort ont été marquées dans le tableau Excel.")
+    print(f"-> Nombre total de requêtes effectuées: {METRICS.total('request_duration_seconds', service='youtube')}")
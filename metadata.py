@@ -1,49 +1,42 @@
-import pandas as pd
 import re
-from excel_reader import ExcelReader
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
+from excel_reader import ExcelReader, Track, input_hash, HASH_COLUMNS
+from catalogue import Catalogue
+from spotify_pool import SpotifyPool, album_image
+from metrics import METRICS
+from profiling import spanned, start_from_args
+import cassette
 from tqdm import tqdm
 import time
 import warnings
 import random
-import json
 from functools import lru_cache
-from typing import Optional, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List
 import os
 
 warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
 
+# Album Spotify et URL de sa pochette, gardés pour intégrer la pochette aux fichiers (bot_downloader.py)
+ARTWORK_COLUMNS = ['ALBUM_ID', 'POCHETTE']
+
 class SpotifyMetadataFetcher:
-    def __init__(self, excel_reader, sheet_name, client_id=None, client_secret=None):
+    def __init__(self, excel_reader, sheet_name, client_id=None, client_secret=None, catalogue=None, spotify=None):
         self.excel_reader = excel_reader
         self.sheet_name = sheet_name
-        self.request_count = 0
-        self.last_request_time = time.time()
+        # Catalogue local (catalogue.py) consulté avant l'API, complété par chaque résultat Spotify
+        self.catalogue = catalogue
         self.track_cache = {}
+        METRICS.watch_cache('spotify_tracks', self.search_spotify_track.cache_info)
         
-        # Configuration Spotify
-        if client_id and client_secret:
-            self.client_id = client_id
-            self.client_secret = client_secret
-        else:
-            # Récupérer depuis les variables d'environnement
-            self.client_id = os.getenv('SPOTIFY_CLIENT_ID')
-            self.client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
-        
-        if not self.client_id or not self.client_secret:
-            raise ValueError("Les credentials Spotify doivent être fournis (client_id, client_secret) ou définis dans les variables d'environnement")
-        
-        # Initialiser le client Spotify
-        try:
-            client_credentials_manager = SpotifyClientCredentials(
-                client_id=self.client_id,
-                client_secret=self.client_secret
-            )
-            self.sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
-            print("✓ Connexion à Spotify API réussie")
-        except Exception as e:
-            raise Exception(f"Erreur lors de l'initialisation de Spotify API: {e}")
+        # Applications Spotify (spotify_pool.py) : un pool déjà configuré, ou une seule application
+        if spotify is None:
+            client_id = client_id or os.getenv('SPOTIFY_CLIENT_ID')
+            client_secret = client_secret or os.getenv('SPOTIFY_CLIENT_SECRET')
+            if not client_id or not client_secret:
+                raise ValueError("Les credentials Spotify doivent être fournis (client_id, client_secret) ou définis dans les variables d'environnement")
+            spotify = SpotifyPool([{'client_id': client_id, 'client_secret': client_secret}])
+        self.spotify = spotify
+        print(f"✓ Connexion à Spotify API réussie ({len(spotify.apps)} application(s))")
     
     def sanitize_string(self, s):
         """Nettoyer une chaîne de caractères pour la recherche."""
@@ -53,6 +46,7 @@ class SpotifyMetadataFetcher:
         s = re.sub(r'[^\w\s\-]', '', s)
         return s.strip()
     
+    @spanned('normalisation')
     def normalize_artist_name(self, artist_name):
         """Normaliser le nom d'artiste pour la recherche."""
         if not artist_name:
@@ -71,6 +65,7 @@ class SpotifyMetadataFetcher:
         
         return artist_name.strip()
     
+    @spanned('normalisation')
     def normalize_title(self, title):
         """Normaliser le titre pour la recherche."""
         if not title:
@@ -82,21 +77,6 @@ class SpotifyMetadataFetcher:
         
         return self.sanitize_string(title)
     
-    def rate_limit(self):
-        """Gestion du rate limiting pour respecter les limites Spotify."""
-        self.request_count += 1
-        
-        # Pause progressive basée sur le nombre de requêtes
-        if self.request_count % 20 == 0:
-            delay = random.uniform(1, 2)
-            time.sleep(delay)
-        elif self.request_count % 100 == 0:
-            print("Pause longue pour respecter les limites de l'API...")
-            time.sleep(random.uniform(5, 10))
-        else:
-            # Délai minimum entre requêtes
-            time.sleep(random.uniform(0.1, 0.3))
-    
     @lru_cache(maxsize=1000)
     def search_spotify_track(self, artist_name: str, title: str) -> Optional[Dict]:
         """
@@ -106,8 +86,6 @@ class SpotifyMetadataFetcher:
         if cache_key in self.track_cache:
             return self.track_cache[cache_key]
         
-        self.rate_limit()
-        
         try:
             # Essayer différentes variantes de requête
             queries = [
@@ -117,7 +95,10 @@ class SpotifyMetadataFetcher:
             ]
             
             for query in queries:
-                results = self.sp.search(q=query, type='track', limit=10, market='FR')
+                # Le pool répartit les requêtes entre les applications et respecte leur budget
+                response = self.spotify.get('search', '/search', {'q': query, 'type': 'track', 'limit': 10, 'market': 'FR'})
+                response.raise_for_status()
+                results = response.json()
                 tracks = results['tracks']['items']
                 
                 if tracks:
@@ -182,21 +163,23 @@ class SpotifyMetadataFetcher:
             'ALBUM': track['album']['name'],
             'SORTIE': track['album']['release_date'],
             'POPULARITE': track['popularity'],
-            'EXPLICITE': track['explicit']
+            'EXPLICITE': track['explicit'],
+            'ALBUM_ID': track['album'].get('id') or 'NaN',
+            'POCHETTE': album_image(track['album']) or 'NaN',
         }
   
         return metadata
     
-    def process_track(self, row_data: Tuple[int, pd.Series]) -> Dict:
+    def process_track(self, track: Track) -> Dict:
         """
-        Traiter une piste individuellement.
+        Traiter une piste individuellement. Retourne les colonnes à mettre à jour,
+        avec l'empreinte des colonnes d'entrée utilisées.
         """
-        idx, row = row_data
-        
+        result = {HASH_COLUMNS['metadata']: input_hash(track, 'metadata')}
         try:
             # Normaliser les données d'entrée
-            artiste_raw = str(row['ARTISTE'])
-            titre_raw = str(row['TITRE'])
+            artiste_raw = track.artiste or ''
+            titre_raw = track.titre or ''
             
             artiste_normalized = self.normalize_artist_name(artiste_raw)
             titre_normalized = self.normalize_title(titre_raw)
@@ -204,69 +187,76 @@ class SpotifyMetadataFetcher:
             # Prendre le premier artiste pour la recherche
             main_artist = artiste_normalized.split(',')[0].strip() if ',' in artiste_normalized else artiste_normalized
             
+            # Chercher d'abord dans le catalogue local (aucune requête)
+            if self.catalogue:
+                known = self.catalogue.lookup(main_artist, titre_normalized)
+                METRICS.cache('catalogue', hit=known is not None)
+                if known:
+                    result.update({column: 'NaN' if value is None else value for column, value in known.items()})
+                    return result
+            
             # Rechercher sur Spotify
-            track = self.search_spotify_track(main_artist, titre_normalized)
+            spotify_track = self.search_spotify_track(main_artist, titre_normalized)
             
-            if track:
+            if spotify_track:
                 
                 # Extraire les métadonnées
-                metadata = self.extract_metadata(track)
-                
-                result = {
-                    'idx': idx,
-                    **metadata
-                }
+                result.update(self.extract_metadata(spotify_track))
+                if self.catalogue:
+                    self.catalogue.add_spotify_track(spotify_track, main_artist, titre_normalized)
             else:
-                result = {
-                    'idx': idx,
+                result.update({
                     'ALBUM': 'NaN',
                     'SORTIE': 'NaN',
                     'POPULARITE': 'NaN',
-                    'EXPLICITE': 'NaN'
-                }
+                    'EXPLICITE': 'NaN',
+                    'ALBUM_ID': 'NaN',
+                    'POCHETTE': 'NaN'
+                })
             
             return result
             
         except Exception as e:
-            print(f"Erreur lors du traitement de la ligne {idx}: {e}")
-            return {
-                'idx': idx,
+            print(f"Erreur lors du traitement de la ligne {track.row}: {e}")
+            result.update({
                 'ALBUM': 'NaN',
                 'SORTIE': 'NaN',
                 'POPULARITE': 'NaN',
-                'EXPLICITE': 'NaN'
-            }
+                'EXPLICITE': 'NaN',
+                'ALBUM_ID': 'NaN',
+                'POCHETTE': 'NaN'
+            })
+            return result
     
-    def process(self, tracks: pd.DataFrame):
+    def process(self, tracks: List[Track], max_workers: int = 1):
         """
         Traiter les pistes avec gestion des erreurs et sauvegarde périodique.
+        Avec max_workers > 1, plusieurs recherches sont en cours à la fois (réparties entre les
+        applications Spotify du pool) ; l'Excel n'est écrit que depuis ce thread, dans l'ordre.
         """
         total = len(tracks)
+        self.excel_reader.ensure_columns(self.sheet_name, ARTWORK_COLUMNS)
         
-        with tqdm(total=total, desc="Récupération des métadonnées Spotify") as pbar:
-            for idx, row in tracks.iterrows():
-                result = self.process_track((idx, row))
-                
-                # Préparer les données pour la mise à jour
-                update_data = {k: v for k, v in result.items() if k != 'idx'}
+        with tqdm(total=total, desc="Récupération des métadonnées Spotify") as pbar, \
+                ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for track, result in zip(tracks, executor.map(self.process_track, tracks)):
                 
                 # Mise à jour immédiate dans Excel
-                self.excel_reader.update_row(
-                    self.sheet_name, 
-                    result['idx'],
-                    update_data
-                )
+                self.excel_reader.update_track(self.sheet_name, track, result)
                 
                 # Sauvegarde périodique
                 if (pbar.n + 1) % 10 == 0:
                     self.excel_reader.save()
                 
                 pbar.update(1)
+                METRICS.rows('metadata')
                 
                 # Gestion des erreurs d'API
                 if result.get('STATUT') == 'ERREUR':
-                    print(f"Erreur détectée ligne {idx}, pause...")
-                    time.sleep(random.uniform(2, 5))
+                    print(f"Erreur détectée ligne {track.row}, pause...")
+                    delay = random.uniform(2, 5)
+                    METRICS.slept(delay, 'metadata')
+                    time.sleep(delay)
         
         # Sauvegarde finale
         self.excel_reader.save()
@@ -275,47 +265,58 @@ class SpotifyMetadataFetcher:
 
 # Exécution principale
 if __name__ == "__main__":
+    CASSETTE = cassette.start_from_args("metadata")  # --record, --replay (voir cassette.py)
+    PROFILER = start_from_args("metadata")  # --profile, --profile-memory (voir profiling.py)
     EXCEL_FILE = "Programmation_template.xlsx"
     EXCEL_READER = ExcelReader(EXCEL_FILE)
     SHEET_NAME = "TITRES"
+    METRICS_FILE = "cache/metrics/metadata"  # Mesures exportées en .json et .prom (node exporter)
+    METRICS.start_export(METRICS_FILE)
+    
+    CATALOGUE_FILE = "cache/catalogue.sqlite"  # Catalogue local consulté avant Spotify (voir catalogue.py)
+    
+    # Charger les lignes de la feuille
+    tracks = EXCEL_READER.read_tracks(SHEET_NAME)
     
-    # Charger le fichier Excel
-    df = EXCEL_READER.read_dataframe(SHEET_NAME)
+    # Les lignes déjà enrichies alimentent le catalogue local, sauf celles dont l'artiste ou le titre
+    # a été modifié depuis (import avant changed_rows, qui enregistre l'empreinte des lignes sans empreinte)
+    CATALOGUE = Catalogue(CATALOGUE_FILE)
+    CATALOGUE.import_tracks(tracks)
 
-    # json file with your Spotify API credentials
+    # json file with your Spotify API credentials (une application ou une liste d'applications)
     SPOTIFY_CREDENTIALS_FILE = "credentials/spotify_credentials.json"
-    # Load Spotify credentials from JSON file
-    with open(SPOTIFY_CREDENTIALS_FILE, 'r') as file:
-        credentials = json.load(file)
-    CLIENT_ID = credentials['client_id']
-    CLIENT_SECRET= credentials['client_secret']
+    SPOTIFY = SpotifyPool.from_file(SPOTIFY_CREDENTIALS_FILE)
+    WORKERS_PER_APP = 2  # Recherches simultanées par application Spotify
     
-    # Filtrer uniquement les lignes où les métadonnées Spotify ne sont pas encore récupérées
-    # On peut filtrer sur une colonne existante ou traiter toutes les lignes
-    df_to_process = df[df['ALBUM'].isna() | df['SORTIE'].isna() | df['EXPLICITE'].isna() | df['POPULARITE'].isna()]
+    # Filtrer uniquement les lignes où les métadonnées Spotify ne sont pas encore récupérées,
+    # ainsi que celles dont l'artiste ou le titre a été modifié depuis. EXPLICITE et POPULARITE restent
+    # vides (NaN) pour les titres trouvés dans un dump MusicBrainz ou un CSV : pas de nouvelle recherche
+    changed = EXCEL_READER.changed_rows(SHEET_NAME, tracks, 'metadata')
+    to_process = [track for track in tracks if track.row in changed or track.album is None or track.sortie is None]
     
     print("=" * 90)
     print("Bienvenue dans le récupérateur de métadonnées Spotify!")
     print("Ce programme va enrichir votre fichier Excel avec les métadonnées Spotify.")
-    print(f"Nombre de titres à traiter: {len(df_to_process)}")
+    print(f"Nombre de titres à traiter: {len(to_process)} (dont {len(changed)} modifiés depuis leur dernier traitement)")
     print(f"Le fichier {EXCEL_FILE} sera mis à jour avec les métadonnées trouvées.")
     print("Métadonnées récupérées:")
     print("  - Album")
     print("  - Date de sortie")
     print("  - Explicite")
     print("  - Popularité")
+    print("  - Album Spotify et pochette")
     print("Appuyez sur Ctrl+C pour arrêter le programme")
     print("=" * 90)
     
     try:
-        # Initialiser le récupérateur (les credentials peuvent être dans les variables d'environnement)
-        fetcher = SpotifyMetadataFetcher(EXCEL_READER, SHEET_NAME, client_id=CLIENT_ID, client_secret=CLIENT_SECRET)
+        # Initialiser le récupérateur
+        fetcher = SpotifyMetadataFetcher(EXCEL_READER, SHEET_NAME, catalogue=CATALOGUE, spotify=SPOTIFY)
         
         # Traiter les pistes
-        fetcher.process(df_to_process)
+        fetcher.process(to_process, max_workers=WORKERS_PER_APP * len(SPOTIFY.apps))
         
         print("\n-> Les métadonnées ont été écrites dans le tableau Excel.")
-        print(f"-> Nombre total de requêtes effectuées: {fetcher.request_count}")
+        print(f"-> Nombre total de requêtes effectuées: {METRICS.total('request_duration_seconds', service='spotify')}")
         
     except Exception as e:
         print(f"Erreur lors de l'initialisation: {e}")
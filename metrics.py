@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Mesures d'exécution partagées par tous les scripts : requêtes et latences par service,
+# caches, pauses du rate limiting, lignes traitées, sauvegardes du classeur.
+# Export JSON et au format « textfile » de Prometheus (node exporter).
+
+PREFIX = "playlist_manager"
+# Bornes des histogrammes de durée (secondes) : d'une requête locale à une conversion ffmpeg
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+HELP = {
+    'request_duration_seconds': "Durée des requêtes par service et par endpoint",
+    'request_errors_total': "Requêtes en erreur par service et par endpoint",
+    'cache_hits_total': "Accès aux caches servis depuis le cache",
+    'cache_misses_total': "Accès aux caches non trouvés",
+    'sleep_seconds_total': "Temps passé en pause (rate limiting, attentes avant nouvel essai)",
+    'rows_total': "Lignes traitées par étape",
+    'rows_per_second': "Débit moyen de chaque étape depuis le début de l'exécution",
+    'stage_duration_seconds': "Durée de traitement d'un élément par étape",
+    'stage_errors_total': "Éléments en échec par étape",
+    'ffmpeg_duration_seconds': "Durée des conversions ffmpeg",
+    'workbook_save_seconds': "Durée des sauvegardes du classeur Excel",
+    'uptime_seconds': "Durée de l'exécution",
+}
+
+
+def label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Metrics:
+    """
+    Compteurs et histogrammes étiquetés (ex: service='spotify', endpoint='search'), thread-safe.
+    Une seule instance (METRICS) est partagée par les modules d'un même processus.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}    # {nom: {étiquettes: valeur}}
+        self.histograms = {}  # {nom: {étiquettes: [compte par borne, somme, nombre]}}
+        self.cache_sources = {}  # {nom du cache: fonction retournant cache_info() d'un lru_cache}
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            key = label_key(labels)
+            if key not in series:
+                series[key] = [[0] * len(BUCKETS), 0.0, 0]
+            histogram = series[key]
+            index = bisect.bisect_left(BUCKETS, value)
+            if index < len(BUCKETS):
+                histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Mesure la durée du bloc dans l'histogramme name (erreurs comprises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def request(self, service, endpoint):
+        """Mesure une requête ; une exception compte comme une erreur puis est propagée."""
+        try:
+            with self.timer('request_duration_seconds', service=service, endpoint=endpoint):
+                yield
+        except Exception:
+            self.inc('request_errors_total', service=service, endpoint=endpoint)
+            raise
+
+    def cache(self, name, hit):
+        self.inc('cache_hits_total' if hit else 'cache_misses_total', cache=name)
+
+    def watch_cache(self, name, cache_info):
+        """Suit un cache functools.lru_cache (fonction cache_info), lu à chaque export."""
+        self.cache_sources[name] = cache_info
+
+    def slept(self, seconds, stage):
+        self.inc('sleep_seconds_total', seconds, stage=stage)
+
+    def rows(self, stage, n=1):
+        self.inc('rows_total', n, stage=stage)
+
+    def total(self, name, **labels):
+        """Somme d'un compteur (ou nombre d'observations d'un histogramme) sur les séries correspondantes."""
+        wanted = set(label_key(labels))
+        with self.lock:
+            counters = self.counters.get(name, {})
+            histograms = self.histograms.get(name, {})
+            return (sum(value for key, value in counters.items() if wanted <= set(key))
+                    + sum(h[2] for key, h in histograms.items() if wanted <= set(key)))
+
+    def collect(self):
+        """Copie cohérente des séries, avec les valeurs dérivées (caches lru, débit par étape)."""
+        with self.lock:
+            counters = {name: dict(series) for name, series in self.counters.items()}
+            histograms = {name: {key: [list(h[0]), h[1], h[2]] for key, h in series.items()}
+                          for name, series in self.histograms.items()}
+        for cache_name, cache_info in self.cache_sources.items():
+            info = cache_info()
+            key = (('cache', cache_name),)
+            for name, value in (('cache_hits_total', info.hits), ('cache_misses_total', info.misses)):
+                series = counters.setdefault(name, {})
+                series[key] = series.get(key, 0) + value
+        uptime = time.time() - self.started
+        gauges = {
+            'uptime_seconds': {(): uptime},
+            'rows_per_second': {key: value / uptime for key, value in counters.get('rows_total', {}).items()},
+        }
+        return counters, histograms, gauges
+
+    def snapshot(self):
+        """Mesures au format JSON : séries étiquetées, latences (moyenne, p50, p95) et taux de succès des caches."""
+        counters, histograms, gauges = self.collect()
+        result = {'counters': {}, 'histograms': {}, 'gauges': {}, 'cache_hit_ratio': {}}
+        for name, series in counters.items():
+            result['counters'][name] = [{'labels': dict(key), 'value': value} for key, value in series.items()]
+        for name, series in gauges.items():
+            result['gauges'][name] = [{'labels': dict(key), 'value': value} for key, value in series.items()]
+        for name, series in histograms.items():
+            result['histograms'][name] = [{
+                'labels': dict(key),
+                'count': count,
+                'sum': total,
+                'mean': total / count if count else 0.0,
+                'p50': quantile(buckets, count, 0.5),
+                'p95': quantile(buckets, count, 0.95),
+            } for key, (buckets, total, count) in series.items()]
+        hits, misses = counters.get('cache_hits_total', {}), counters.get('cache_misses_total', {})
+        for key in set(hits) | set(misses):
+            accesses = hits.get(key, 0) + misses.get(key, 0)
+            result['cache_hit_ratio'][dict(key)['cache']] = hits.get(key, 0) / accesses if accesses else 0.0
+        return result
+
+    def prometheus(self):
+        """Mesures au format texte de Prometheus."""
+        counters, histograms, gauges = self.collect()
+        lines = []
+        for kind, series_by_name in (('counter', counters), ('gauge', gauges)):
+            for name, series in sorted(series_by_name.items()):
+                lines.append(f"# HELP {PREFIX}_{name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{PREFIX}_{name}{format_labels(key)} {value}")
+        for name, series in sorted(histograms.items()):
+            lines.append(f"# HELP {PREFIX}_{name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {PREFIX}_{name} histogram")
+            for key, (buckets, total, count) in sorted(series.items()):
+                cumulative = 0
+                for bound, n in zip(BUCKETS, buckets):
+                    cumulative += n
+                    lines.append(f"{PREFIX}_{name}_bucket{format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{PREFIX}_{name}_bucket{format_labels(key, [('le', '+Inf')])} {count}")
+                lines.append(f"{PREFIX}_{name}_sum{format_labels(key)} {total}")
+                lines.append(f"{PREFIX}_{name}_count{format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Écrit path.json et path.prom de manière atomique (le node exporter ne doit jamais
+        lire un fichier à moitié écrit).
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        for ext, content in (('json', json.dumps(self.snapshot(), indent=2)), ('prom', self.prometheus())):
+            tmp_file = f"{path}.{ext}.tmp"
+            with open(tmp_file, 'w') as file:
+                file.write(content)
+            os.replace(tmp_file, f"{path}.{ext}")
+
+    def start_export(self, path, interval=60):
+        """Export périodique dans un thread, plus un dernier export à la sortie du programme."""
+        def export_loop():
+            while True:
+                time.sleep(interval)
+                self.write(path)
+
+        threading.Thread(target=export_loop, name="metrics-export", daemon=True).start()
+        atexit.register(self.write, path)
+
+
+def quantile(buckets, count, q):
+    """Estimation d'un quantile : borne supérieure du premier intervalle qui l'atteint."""
+    if not count:
+        return 0.0
+    cumulative = 0
+    for bound, n in zip(BUCKETS, buckets):
+        cumulative += n
+        if cumulative >= q * count:
+            return bound
+    return None  # au-delà de la dernière borne
+
+
+METRICS = Metrics()
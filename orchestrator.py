@@ -0,0 +1,263 @@
+import os
+import json
+import queue
+import threading
+import warnings
+from itertools import islice
+from tqdm import tqdm
+from excel_reader import ExcelReader, Track, HASH_COLUMNS
+from metrics import METRICS
+from profiling import start_from_args
+import cassette
+from playlist_fetcher import iter_tracks_by_genre, get_tracks_by_genre
+from spotify_pool import SpotifyPool
+from metadata import SpotifyMetadataFetcher, ARTWORK_COLUMNS
+from catalogue import Catalogue
+from ytb_finder_fast import YouTubeSearcher
+from bot_downloader import DownloadPipeline, STOP
+
+warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
+
+
+class Orchestrator:
+    """
+    Chaîne complète en un seul passage, sans aller-retour par le fichier Excel :
+    recherche Spotify -> métadonnées -> lien YouTube -> téléchargement et upload Drive.
+    Chaque étape a ses propres workers et les morceaux passent d'une étape à l'autre
+    par des files bornées (un étage lent freine le précédent).
+    Un seul écrivain (le thread principal) ajoute et met à jour les lignes de l'Excel,
+    sauvegardé par lots.
+    """
+    def __init__(self, excel_reader, sheet_name, metadata_fetcher, youtube_searcher, download_pipeline,
+                 metadata_workers=2, search_workers=1, queue_size=8, save_every=20):
+        self.excel_reader = excel_reader
+        self.sheet_name = sheet_name
+        self.metadata_fetcher = metadata_fetcher
+        self.youtube_searcher = youtube_searcher
+        self.download_pipeline = download_pipeline
+        self.metadata_workers = metadata_workers
+        self.search_workers = search_workers
+        self.save_every = save_every
+        self.first_row = None
+
+        self.metadata_queue = queue.Queue(maxsize=queue_size)
+        self.search_queue = queue.Queue(maxsize=queue_size)
+        self.download_queue = queue.Queue(maxsize=queue_size)
+        # Les statuts du téléchargeur et les écritures des autres étapes arrivent dans la même file
+        self.sink_queue = download_pipeline.status_queue
+
+    def write(self, track, updates, done=False):
+        """Demande à l'écrivain de mettre à jour la ligne du morceau (done : le morceau s'arrête là)."""
+        self.sink_queue.put({'row': track.row, 'updates': updates, 'done': done})
+
+    def start_stage(self, name, worker, n_workers, in_queue, next_queue, n_next):
+        """
+        Démarre les threads d'une étape. Quand tous ont terminé, on propage la fin
+        de flux (STOP) à l'étape suivante.
+        """
+        threads = [threading.Thread(target=self.stage_loop, args=(name, worker, in_queue), name=f"{name}-{i}", daemon=True)
+                   for i in range(n_workers)]
+        for thread in threads:
+            thread.start()
+
+        def close_stage():
+            for thread in threads:
+                thread.join()
+            for _ in range(n_next):
+                next_queue.put(STOP)
+
+        threading.Thread(target=close_stage, name=f"{name}-closer", daemon=True).start()
+
+    def stage_loop(self, name, worker, in_queue):
+        while True:
+            track = in_queue.get()
+            if track is STOP:
+                return
+            try:
+                with METRICS.timer('stage_duration_seconds', stage=name):
+                    worker(track)
+            except Exception as e:
+                METRICS.inc('stage_errors_total', stage=name)
+                print(f"\nErreur pour {track.artiste} - {track.titre} : {e}")
+                self.write(track, {}, done=True)
+
+    def fetch(self, tracks, playlist):
+        """
+        Étape 1 : les titres trouvés sur Spotify sont ajoutés à l'Excel et envoyés aux
+        métadonnées au fur et à mesure. Les lignes sont numérotées ici, dans l'ordre où
+        l'écrivain les ajoutera.
+        """
+        next_row = self.first_row
+        try:
+            for artist, title, popularity in tracks:
+                row = {"PLAYLIST": playlist, "ARTISTE": artist, "TITRE": title, "LIEN": ""}
+                track = Track(next_row, row)
+                next_row += 1
+                self.sink_queue.put({'append': row})
+                self.metadata_queue.put(track)
+        except Exception as e:
+            print(f"\nErreur lors de la recherche Spotify : {e}")
+        finally:
+            for _ in range(self.metadata_workers):
+                self.metadata_queue.put(STOP)
+
+    def fetch_metadata(self, track):
+        """Étape 2 : album, date de sortie, popularité et explicite depuis Spotify."""
+        updates = self.metadata_fetcher.process_track(track)
+        track.update(updates)
+        self.write(track, updates)
+        METRICS.rows('metadata')
+        self.search_queue.put(track)
+
+    def search_link(self, track):
+        """Étape 3 : recherche du lien YouTube ; seuls les morceaux avec un lien continuent."""
+        result = self.youtube_searcher.process_track(track)
+        updates = {
+            'CONFIANCE': result['CONFIANCE'],
+            'LIEN': result['LIEN'],
+            'DISPONIBLE': None,  # nouveau lien, à revérifier par link_validator
+            HASH_COLUMNS['youtube']: result[HASH_COLUMNS['youtube']],
+        }
+        track.update(updates)
+        found = str(result['LIEN']).startswith('http')
+        self.write(track, updates, done=not found)
+        METRICS.rows('youtube')
+        if found:
+            self.download_queue.put(track)
+
+    def links_found(self):
+        """Étape 4 : alimente le téléchargeur avec les Track qui ont un lien."""
+        while True:
+            track = self.download_queue.get()
+            if track is STOP:
+                return
+            yield track
+
+    def run(self, tracks, playlist, total=None):
+        """
+        Lance toutes les étapes sur un itérable de (artiste, titre, popularité)
+        et écrit les résultats dans l'Excel.
+        """
+        # Colonnes des empreintes d'entrée écrites par chaque étape (voir excel_reader.HASH_COLUMNS)
+        # et de l'album Spotify (pochettes)
+        self.excel_reader.ensure_columns(self.sheet_name, list(HASH_COLUMNS.values()) + ARTWORK_COLUMNS)
+        # append_row écrit toujours après la dernière ligne de la feuille
+        self.first_row = self.excel_reader.workbook[self.sheet_name].max_row + 1
+        self.download_pipeline.prepare_folders([playlist])
+        try:
+            self.download_pipeline.start(self.links_found())
+            threading.Thread(target=self.fetch, args=(tracks, playlist), name="fetch", daemon=True).start()
+            self.start_stage("metadata", self.fetch_metadata, self.metadata_workers, self.metadata_queue,
+                             self.search_queue, self.search_workers)
+            self.start_stage("search", self.search_link, self.search_workers, self.search_queue,
+                             self.download_queue, 1)
+            self.write_rows(total)
+        finally:
+            self.download_pipeline.close()
+            self.excel_reader.save()
+
+    def write_rows(self, total=None):
+        """Écrivain unique : ajouts de lignes, résultats des étapes et statuts des uploads."""
+        writes = 0
+        with tqdm(total=total, desc="Morceaux traités") as pbar:
+            while True:
+                item = self.sink_queue.get()
+                if item is STOP:
+                    return
+                if 'job' in item:
+                    # Statut d'un upload, géré par le téléchargeur
+                    self.download_pipeline.write_status(item)
+                    pbar.update(1)
+                elif 'append' in item:
+                    self.excel_reader.append_row(self.sheet_name, item['append'])
+                else:
+                    self.excel_reader.write_row(self.sheet_name, item['row'], item['updates'])
+                    if item['done']:
+                        pbar.update(1)
+                writes += 1
+                # Sauvegarde par lots
+                if writes % self.save_every == 0:
+                    self.excel_reader.save()
+
+
+# Exécution principale
+if __name__ == "__main__":
+    CASSETTE = cassette.start_from_args("orchestrator")  # --record, --replay (voir cassette.py)
+    PROFILER = start_from_args("orchestrator")  # --profile, --profile-memory (voir profiling.py)
+    # === CONFIGURATION ===
+    EXCEL_FILE = "Programmation_template.xlsx"
+    SHEET_NAME = "TITRES"
+    SPOTIFY_CREDENTIALS_FILE = "credentials/spotify_credentials.json"
+    SERVICE_ACCOUNT_FILE = "credentials/service_account.json"  # Fichier de compte de service
+    SCOPES = ['https://www.googleapis.com/auth/drive.file']
+    DOWNLOAD_ROOT = "cache"  # Dossier racine des téléchargements
+    RANK_BY_POPULARITY = False  # True : récupère 2x plus de titres et garde les plus populaires (attend la fin de la recherche)
+    METADATA_WORKERS = 2  # Requêtes de métadonnées Spotify simultanées, par application Spotify
+    SEARCH_WORKERS = 1  # Recherches YouTube simultanées (1 pour éviter le rate limiting)
+    DOWNLOAD_WORKERS = 4  # Téléchargements YouTube simultanés
+    TRANSCODE_WORKERS = os.cpu_count()  # Conversions ffmpeg simultanées (une par cœur)
+    UPLOAD_WORKERS = 4  # Uploads Google Drive simultanés
+    AUDIO_FORMAT = 'mp3'  # 'mp3', 'm4a' ou 'opus' (voir bot_downloader.py)
+    COOKIES_BROWSER = 'firefox'  # Navigateur dont on extrait les cookies une fois par exécution (None : aucun)
+    DRIVE_API_ENDPOINT = os.getenv('DRIVE_API_ENDPOINT')  # ex: http://localhost:8000/ pour un faux serveur Drive
+    SPOTIFY = SpotifyPool.from_file(SPOTIFY_CREDENTIALS_FILE)  # Une ou plusieurs applications (voir spotify_pool.py)
+    with open(SERVICE_ACCOUNT_FILE, 'r') as file:
+        CLIENT_EMAIL = json.load(file)['client_email']  # Email du compte de service
+    CATALOGUE_FILE = "cache/catalogue.sqlite"  # Catalogue local consulté avant Spotify (voir catalogue.py)
+    METRICS_FILE = "cache/metrics/orchestrator"  # Mesures exportées en .json et .prom (node exporter)
+    EXCEL_READER = ExcelReader(EXCEL_FILE)
+    METRICS.start_export(METRICS_FILE)
+
+    print("=" * 90)
+    print("Bienvenue dans l'orchestrateur de playlist !")
+    print("Ce programme enchaîne en un seul passage, sans relire l'Excel entre les étapes :")
+    print("  - recherche des titres populaires d'un genre sur Spotify")
+    print("  - récupération des métadonnées Spotify")
+    print("  - recherche des liens YouTube")
+    print("  - téléchargement et upload dans Google Drive")
+    print(f"Le fichier {EXCEL_FILE} sera mis à jour au fur et à mesure.")
+    print(f"-> vérifier que le compte de service ({CLIENT_EMAIL}) ait accès au dossier partagé (en édition)")
+    print("Appuyez sur Ctrl+C pour arrêter le programme")
+    print("=" * 90)
+    genre = input("--> Veuillez entrer le mot clé de recherche pour spotify (par exemple, 'Rap FR') : ")
+    n = input("--> Veuillez entrer le nombre de titres à récupérer (par exemple, 150) : ")
+    while not n.isdigit() or int(n) <= 0:
+        n = input("---> Veuillez entrer un nombre valide pour le nombre de titres : ")
+    n = int(n)
+    playlist_name = input("--> Veuillez entrer le nom de la playlist pour l'Excel (par exemple, 'Hip-hop/Rap FR') : ")
+    while not playlist_name.strip() in EXCEL_READER.get_playlist_names():
+        print(f"Le nom de la playlist '{playlist_name}' n'existe pas dans le fichier Excel.")
+        print("Voici les playlists existantes :")
+        for name in EXCEL_READER.get_playlist_names():
+            print(f"- {name}")
+        playlist_name = input("---> Veuillez entrer un nom de playlist valide : ")
+    shared_folder_link = input("--> Veuillez entrer le lien du dossier partagé dans Google Drive : ")
+    while not shared_folder_link.startswith("https://drive.google.com/drive/folders/"):
+        shared_folder_link = input("Lien invalide. Veuillez entrer un lien valide : ")
+    PARENT_FOLDER_ID = shared_folder_link.split("/")[-1].split("?")[0]
+
+    # Titres déjà présents dans l'Excel, ignorés par la recherche Spotify
+    existing = EXCEL_READER.read_tracks(SHEET_NAME)
+    present_titles = {(track.artiste, track.titre) for track in existing}
+    CATALOGUE = Catalogue(CATALOGUE_FILE)
+    CATALOGUE.import_tracks(existing)  # lignes à jour seulement (empreinte des métadonnées identique)
+    if RANK_BY_POPULARITY:
+        tracks = get_tracks_by_genre(genre, n, SPOTIFY, present_titles)
+    else:
+        # Les titres partent vers les étapes suivantes dès qu'ils sont trouvés (popularité lue par metadata)
+        tracks = islice(iter_tracks_by_genre(genre, SPOTIFY, present_titles, with_popularity=False), n)
+
+    metadata_fetcher = SpotifyMetadataFetcher(EXCEL_READER, SHEET_NAME, catalogue=CATALOGUE, spotify=SPOTIFY)
+    youtube_searcher = YouTubeSearcher(EXCEL_READER, SHEET_NAME)
+    download_pipeline = DownloadPipeline(EXCEL_READER, SHEET_NAME, SERVICE_ACCOUNT_FILE, SCOPES, PARENT_FOLDER_ID, DOWNLOAD_ROOT,
+                                         download_workers=DOWNLOAD_WORKERS, transcode_workers=TRANSCODE_WORKERS,
+                                         upload_workers=UPLOAD_WORKERS, api_endpoint=DRIVE_API_ENDPOINT,
+                                         cookies_browser=COOKIES_BROWSER, audio_format=AUDIO_FORMAT)
+    orchestrator = Orchestrator(EXCEL_READER, SHEET_NAME, metadata_fetcher, youtube_searcher, download_pipeline,
+                                metadata_workers=METADATA_WORKERS * len(SPOTIFY.apps), search_workers=SEARCH_WORKERS)
+    orchestrator.run(tracks, playlist_name, total=n)
+
+    print(f"\n-> Playlist '{playlist_name}' traitée de la recherche Spotify jusqu'à Google Drive.")
+    print(f"-> Requêtes Spotify : {METRICS.total('request_duration_seconds', service='spotify')}, "
+          f"requêtes YouTube : {METRICS.total('request_duration_seconds', service='youtube')}")
+    print(f"-> Mesures détaillées : {METRICS_FILE}.json et {METRICS_FILE}.prom")
@@ -1,52 +1,32 @@
 import musicbrainzngs
 import requests
-import base64
-import time
-import json
 from excel_reader import ExcelReader
-
-# === CONFIGURATION ===
-# spotify credentials
-# json file with your Spotify API credentials
-SPOTIFY_CREDENTIALS_FILE = "credentials/spotify_credentials.json"
-# Load Spotify credentials from JSON file
-with open(SPOTIFY_CREDENTIALS_FILE, 'r') as file:
-    credentials = json.load(file)
-CLIENT_ID = credentials['client_id']
-CLIENT_SECRET= credentials['client_secret']
-titres = []  # liste des titres récupérés
-EXCEL_FILE = "Programmation_template.xlsx"  # Remplace par le nom de ton fichier
-EXCEL_READER = ExcelReader(EXCEL_FILE)
-PRESENT_TITLES = EXCEL_READER.read_dataframe("TITRES")  # lire les titres déjà présents dans l'Excel
+from spotify_pool import SpotifyPool
+from metrics import METRICS
+from profiling import start_from_args
+import cassette
 
 musicbrainzngs.set_useragent("RadioPlaylistBuilder", "1.0", "email@exemple.com")
 
 
-def get_spotify_token():
-    """Obtient un token d'accès Spotify via Client Credentials Flow."""
-    auth_str = f"{CLIENT_ID}:{CLIENT_SECRET}"
-    b64_auth = base64.b64encode(auth_str.encode()).decode()
-    headers = {
-        "Authorization": f"Basic {b64_auth}",
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-    data = {"grant_type": "client_credentials"}
-    r = requests.post("https://accounts.spotify.com/api/token", headers=headers, data=data)
-    r.raise_for_status()
-    return r.json()["access_token"]
-
-def search_playlists(query, token, limit=5, offset=0):
-    """Recherche des playlists sur Spotify."""
-    headers = {"Authorization": f"Bearer {token}"}
+def search_playlists(query, spotify, limit=5, offset=0):
+    """Recherche des playlists sur Spotify (spotify : SpotifyPool)."""
     params = {
         "q": query,
         "type": "playlist",
         "limit": limit,
         "offset": offset
     }
-    response = requests.get("https://api.spotify.com/v1/search", headers=headers, params=params)
+    try:
+        response = spotify.get('search_playlists', "/search", params)
+    except requests.RequestException as e:
+        # Toujours limité après plusieurs tentatives, ou pas de réponse
+        METRICS.inc('request_errors_total', service='spotify', endpoint='search_playlists')
+        print("Erreur lors de la recherche :", e)
+        return []
 
     if response.status_code != 200:
+        METRICS.inc('request_errors_total', service='spotify', endpoint='search_playlists')
         print("Erreur lors de la recherche :", response.json())
         return []
 
@@ -54,13 +34,17 @@ def search_playlists(query, token, limit=5, offset=0):
     playlists = data.get("playlists", {}).get("items", [])
     return playlists
 
-def get_playlist_tracks(playlist_id, token):
+def get_playlist_tracks(playlist_id, spotify):
     """Récupère les titres d'une playlist Spotify."""
-    headers = {"Authorization": f"Bearer {token}"}
-    url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
-    response = requests.get(url, headers=headers)
+    try:
+        response = spotify.get('playlist_tracks', f"/playlists/{playlist_id}/tracks")
+    except requests.RequestException as e:
+        METRICS.inc('request_errors_total', service='spotify', endpoint='playlist_tracks')
+        print("Erreur lors de la récupération des titres :", e)
+        return []
 
     if response.status_code != 200:
+        METRICS.inc('request_errors_total', service='spotify', endpoint='playlist_tracks')
         print("Erreur lors de la récupération des titres :", response.json())
         return []
 
@@ -78,13 +62,17 @@ def get_playlist_tracks(playlist_id, token):
 
     return track_infos
 
-def get_spotify_popularity(artist, title, token):
+def get_spotify_popularity(artist, title, spotify):
     """Recherche la popularité d'un titre sur Spotify."""
     query = f"track:{title} artist:{artist}"
-    headers = {"Authorization": f"Bearer {token}"}
     params = {"q": query, "type": "track", "limit": 1}
-    r = requests.get("https://api.spotify.com/v1/search", headers=headers, params=params)
+    try:
+        r = spotify.get('search', "/search", params)
+    except requests.RequestException:
+        METRICS.inc('request_errors_total', service='spotify', endpoint='search')
+        return 0
     if r.status_code != 200:
+        METRICS.inc('request_errors_total', service='spotify', endpoint='search')
         return 0
     results = r.json()
     items = results.get("tracks", {}).get("items", [])
@@ -99,24 +87,27 @@ def sort_by_popularity(tracks):
     """
     return sorted(tracks, key=lambda x: x[2], reverse=True)
 
-# récupère n titres populaires par genre en utilisant les playlists Spotify
-def get_tracks_by_genre(genre, n=100, token=None):
-    if token is None: print("Token Spotify manquant.")
-    fetched_tracks = []
-    needed_tracks = n*2 # pour récupérer plus de titres et pouvoir trier par popularité
+def iter_tracks_by_genre(genre, spotify, present_titles=(), with_popularity=True):
+    """
+    Générateur des titres (artiste, titre, popularité) trouvés dans les playlists Spotify
+    d'un genre, au fur et à mesure de leur récupération. Les doublons et les couples
+    (artiste, titre) de present_titles sont ignorés. S'arrête quand il n'y a plus de playlist
+    (ou quand l'appelant arrête de consommer). Sans with_popularity, la popularité vaut None
+    (une requête de moins par titre).
+    """
+    seen = set(present_titles)
     offset = 0
     limit = 1
-    print(f"Recherche de {n} titres populaires pour le genre '{genre}'...")
-    while len(fetched_tracks) < needed_tracks:
-        playlists = search_playlists(genre, token, limit, offset)
+    while True:
+        playlists = search_playlists(genre, spotify, limit, offset)
         if not playlists:
-            print(f"Aucune playlist trouvée pour le genre '{genre}'.")
-            return []
+            print(f"Plus de playlist trouvée pour le genre '{genre}'.")
+            return
 
         for pl in playlists:
             if not pl:
                 continue
-            tracks = get_playlist_tracks(pl['id'], token)
+            tracks = get_playlist_tracks(pl['id'], spotify)
             for title, artists in tracks:
                 # sanitize nom artiste et titre 
                 for i in range(len(artists)):
@@ -127,16 +118,29 @@ def get_tracks_by_genre(genre, n=100, token=None):
                 
                 if isinstance(artists, list): artist = ", ".join(artists)
                 else: artist = artists
-                # récupérer popularité Spotify
-                popularity = get_spotify_popularity(artist, title, token)
-                fetched_tracks.append((artist, title, popularity))
-                time.sleep(0.1)  # pour éviter le throttling
+                # enlever les doublons et les titres déjà présents dans l'Excel
+                if (artist, title) in seen:
+                    continue
+                seen.add((artist, title))
+                popularity = None
+                if with_popularity:
+                    # récupérer popularité Spotify
+                    popularity = get_spotify_popularity(artist, title, spotify)
+                METRICS.rows('fetch')
+                yield (artist, title, popularity)
         # incrémenter l'offset pour la prochaine requête
         offset += limit
-        # enlever les doublons
-        fetched_tracks = list(set(fetched_tracks))
-        # enlever les titres déjà présents dans l'Excel
-        fetched_tracks = [track for track in fetched_tracks if (track[0], track[1]) not in zip(PRESENT_TITLES['ARTISTE'], PRESENT_TITLES['TITRE'])]
+
+# récupère n titres populaires par genre en utilisant les playlists Spotify
+def get_tracks_by_genre(genre, n=100, spotify=None, present_titles=()):
+    if spotify is None: print("Applications Spotify manquantes.")
+    fetched_tracks = []
+    needed_tracks = n*2 # pour récupérer plus de titres et pouvoir trier par popularité
+    print(f"Recherche de {n} titres populaires pour le genre '{genre}'...")
+    for track in iter_tracks_by_genre(genre, spotify, present_titles):
+        fetched_tracks.append(track)
+        if len(fetched_tracks) >= needed_tracks:
+            break
     # Trier par popularité décroissante
     fetched_tracks = sort_by_popularity(fetched_tracks)
     # retourner les n premiers titres
@@ -144,6 +148,18 @@ def get_tracks_by_genre(genre, n=100, token=None):
 
 # Exécution principale
 if __name__ == "__main__":
+    CASSETTE = cassette.start_from_args("playlist_fetcher")  # --record, --replay (voir cassette.py)
+    PROFILER = start_from_args("playlist_fetcher")  # --profile, --profile-memory (voir profiling.py)
+    # === CONFIGURATION ===
+    # json file with your Spotify API credentials (une application ou une liste d'applications)
+    SPOTIFY_CREDENTIALS_FILE = "credentials/spotify_credentials.json"
+    SPOTIFY = SpotifyPool.from_file(SPOTIFY_CREDENTIALS_FILE)
+    EXCEL_FILE = "Programmation_template.xlsx"  # Remplace par le nom de ton fichier
+    EXCEL_READER = ExcelReader(EXCEL_FILE)
+    PRESENT_TITLES = EXCEL_READER.read_tracks("TITRES")  # lire les titres déjà présents dans l'Excel
+    METRICS_FILE = "cache/metrics/playlist_fetcher"  # Mesures exportées en .json et .prom (node exporter)
+    METRICS.start_export(METRICS_FILE)
+
     # ==== INTERAGIR AVEC L'UTILISATEUR ====
     print("=========================================================================================")
     print("Bienvenue dans le générateur de playlist !                                              |")
@@ -166,8 +182,8 @@ if __name__ == "__main__":
             print(f"- {name}")
         playlist_name = input("---> Veuillez entrer un nom de playlist valide : ")
     print("------------------------------------------------------------------------------------------")
-    token = get_spotify_token()
-    tracks = get_tracks_by_genre(genre, n, token)
+    present_titles = {(track.artiste, track.titre) for track in PRESENT_TITLES}
+    tracks = get_tracks_by_genre(genre, n, SPOTIFY, present_titles)
     
     if not tracks:
         print("Aucun titre trouvé.")
@@ -0,0 +1,220 @@
+import os
+import io
+import sys
+import json
+import time
+import atexit
+import pstats
+import cProfile
+import argparse
+import functools
+import threading
+import tracemalloc
+from datetime import datetime
+from contextlib import contextmanager
+from metrics import METRICS
+
+# Profilage à la demande des scripts (option --profile) : cProfile sur tous les threads,
+# instantanés mémoire tracemalloc et durées des sections critiques (spans).
+# Chaque exécution écrit un rapport dans son propre dossier pour pouvoir comparer les runs.
+
+PROFILE_DIR = os.path.join("cache", "profiles")
+# Jusqu'à Python 3.11, cProfile ne voit que le thread qui l'active : un profileur par thread.
+# Depuis 3.12, il passe par sys.monitoring : un seul profileur actif à la fois (en activer un
+# second lève ValueError), qui voit déjà tous les threads.
+PER_THREAD_PROFILES = sys.version_info < (3, 12)
+ACTIVE = False  # les spans ne coûtent presque rien tant que le profilage est inactif
+
+
+@contextmanager
+def span(name):
+    """Durée d'une section (chargement du classeur, update_row, normalisation...), mesurée avec --profile."""
+    if not ACTIVE:
+        yield
+        return
+    with METRICS.timer('span_duration_seconds', span=name):
+        yield
+
+
+def spanned(name):
+    """Décorateur : span autour de chaque appel de la fonction."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ACTIVE:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Profiler:
+    """
+    cProfile sur tous les threads (un profileur par thread démarré ensuite avant Python 3.12),
+    tracemalloc optionnel avec un instantané toutes les interval secondes, écrit aussitôt sur le disque
+    (seul le premier est gardé en mémoire, pour mesurer la croissance).
+    Les conversions ffmpeg du pool de processus sont mesurées par leur durée (metrics), pas par cProfile.
+    """
+    def __init__(self, name, report_dir, memory=False, interval=30, frames=1):
+        self.name = name
+        self.report_dir = report_dir
+        self.memory = memory
+        self.interval = interval
+        self.frames = frames
+        self.lock = threading.Lock()
+        self.main_profile = cProfile.Profile()
+        self.thread_profiles = []
+        self.first_snapshot = None
+        self.memory_samples = []  # [{'t_s', 'traced_mb', 'peak_mb'}]
+        self.stop_event = threading.Event()
+        self.started = None
+
+    def profile_thread(self, *args):
+        """Premier événement de chaque nouveau thread : il reçoit son propre profileur."""
+        profile = cProfile.Profile()
+        with self.lock:
+            self.thread_profiles.append(profile)
+        profile.enable()  # remplace ce hook pour la suite du thread
+
+    def start(self):
+        global ACTIVE
+        ACTIVE = True
+        self.started = time.perf_counter()
+        os.makedirs(self.report_dir, exist_ok=True)
+        if self.memory:
+            tracemalloc.start(self.frames)
+            self.take_snapshot()
+            threading.Thread(target=self.sample_memory, name="profiling-memory", daemon=True).start()
+        if PER_THREAD_PROFILES:
+            threading.setprofile(self.profile_thread)
+        self.main_profile.enable()
+
+    def take_snapshot(self, filename=None):
+        """Instantané mémoire : le premier sert de référence, les suivants sont résumés dans un fichier."""
+        elapsed = time.perf_counter() - self.started
+        snapshot = tracemalloc.take_snapshot()
+        traced, peak = tracemalloc.get_traced_memory()
+        self.memory_samples.append({'t_s': round(elapsed, 1), 'traced_mb': traced / 1024 ** 2, 'peak_mb': peak / 1024 ** 2})
+        if self.first_snapshot is None:
+            self.first_snapshot = snapshot
+            return
+        self.write_text(filename or f"memory-{elapsed:06.0f}s.txt", self.format_memory(snapshot, elapsed))
+
+    def sample_memory(self):
+        while not self.stop_event.wait(self.interval):
+            self.take_snapshot()
+
+    def stop(self):
+        """Arrête le profilage et écrit le rapport de l'exécution."""
+        global ACTIVE
+        self.main_profile.disable()
+        if PER_THREAD_PROFILES:
+            threading.setprofile(None)
+        self.stop_event.set()
+        ACTIVE = False
+        duration = time.perf_counter() - self.started
+
+        stats = pstats.Stats(self.main_profile)
+        with self.lock:
+            for profile in self.thread_profiles:
+                stats.add(profile)
+        stats.dump_stats(os.path.join(self.report_dir, "cpu.prof"))
+        self.write_text("cpu.txt", self.format_stats(stats))
+
+        spans = self.collect_spans()
+        with open(os.path.join(self.report_dir, "spans.json"), 'w') as file:
+            json.dump(spans, file, indent=2)
+        self.write_text("spans.txt", format_spans(spans))
+        with open(os.path.join(self.report_dir, "metrics.json"), 'w') as file:
+            json.dump(METRICS.snapshot(), file, indent=2)
+
+        run = {'script': self.name, 'argv': sys.argv, 'duration_s': duration, 'threads_profiled': len(self.thread_profiles)}
+        if self.memory:
+            self.take_snapshot("memory.txt")
+            run['memory_samples'] = self.memory_samples
+            tracemalloc.stop()
+        with open(os.path.join(self.report_dir, "run.json"), 'w') as file:
+            json.dump(run, file, indent=2)
+        print(f"Rapport de profilage : {self.report_dir}")
+
+    def write_text(self, filename, text):
+        with open(os.path.join(self.report_dir, filename), 'w') as file:
+            file.write(text)
+
+    def format_stats(self, stats, limit=60):
+        output = io.StringIO()
+        stats.stream = output
+        stats.sort_stats('cumulative').print_stats(limit)
+        stats.sort_stats('tottime').print_stats(limit)
+        return output.getvalue()
+
+    def collect_spans(self):
+        """Spans et histogrammes de durée des métriques (requêtes, ffmpeg, sauvegardes), par temps total."""
+        spans = {}
+        for name, series in METRICS.snapshot()['histograms'].items():
+            for entry in series:
+                labels = ",".join(f"{key}={value}" for key, value in sorted(entry['labels'].items()))
+                key = f"{name}{{{labels}}}" if name != 'span_duration_seconds' else entry['labels']['span']
+                spans[key] = {'count': entry['count'], 'total_s': entry['sum'], 'mean_s': entry['mean'], 'p95_s': entry['p95']}
+        return dict(sorted(spans.items(), key=lambda item: item[1]['total_s'], reverse=True))
+
+    def format_memory(self, snapshot, elapsed, limit=25):
+        """Plus grosses allocations de l'instantané, puis croissance depuis le premier."""
+        lines = [f"Allocations les plus importantes ({elapsed:.0f}s) :"]
+        lines += [str(stat) for stat in snapshot.statistics('lineno')[:limit]]
+        lines += ["", "Plus fortes croissances depuis le début :"]
+        lines += [str(stat) for stat in snapshot.compare_to(self.first_snapshot, 'lineno')[:limit]]
+        return "\n".join(lines) + "\n"
+
+
+def format_spans(spans):
+    lines = [f"{'section':<70} {'appels':>8} {'total (s)':>10} {'moyenne (ms)':>13} {'p95 (s)':>8}"]
+    for name, span_stats in spans.items():
+        p95 = span_stats['p95_s']
+        lines.append(f"{name:<70} {span_stats['count']:>8} {span_stats['total_s']:>10.2f} "
+                     f"{span_stats['mean_s'] * 1000:>13.2f} {p95 if p95 is not None else '-':>8}")
+    return "\n".join(lines) + "\n"
+
+
+def start_from_args(name, argv=None):
+    """
+    Lit les options de profilage de la ligne de commande d'un script (--profile, rapport écrit à la
+    sortie du programme). Les autres options sont laissées aux autres lecteurs (cassette.start_from_args).
+    Retourne le Profiler ou None.
+    """
+    parser = argparse.ArgumentParser(prog=f"{name}.py")
+    parser.add_argument('--profile', action='store_true', help="profiler l'exécution (cProfile et durées des sections)")
+    parser.add_argument('--profile-memory', action='store_true', help="ajouter des instantanés mémoire tracemalloc (implique --profile)")
+    parser.add_argument('--profile-interval', type=float, default=30, help="secondes entre deux instantanés mémoire")
+    parser.add_argument('--profile-dir', default=PROFILE_DIR, help="dossier des rapports (un sous-dossier par exécution)")
+    args, _ = parser.parse_known_args(argv)
+    if not (args.profile or args.profile_memory):
+        return None
+    report_dir = os.path.join(args.profile_dir, f"{name}-{datetime.now():%Y%m%d-%H%M%S}")
+    profiler = Profiler(name, report_dir, memory=args.profile_memory, interval=args.profile_interval)
+    profiler.start()
+    atexit.register(profiler.stop)
+    return profiler
+
+
+def compare(run_a, run_b):
+    """Compare les sections de deux rapports (temps total et moyen)."""
+    spans = []
+    for run in (run_a, run_b):
+        with open(os.path.join(run, "spans.json")) as file:
+            spans.append(json.load(file))
+    print(f"{'section':<70} {'total A (s)':>11} {'total B (s)':>11} {'moy. A (ms)':>12} {'moy. B (ms)':>12}")
+    for name in sorted(set(spans[0]) | set(spans[1]), key=lambda n: -max(s.get(n, {}).get('total_s', 0) for s in spans)):
+        a, b = spans[0].get(name, {}), spans[1].get(name, {})
+        print(f"{name:<70} {a.get('total_s', 0):>11.2f} {b.get('total_s', 0):>11.2f} "
+              f"{a.get('mean_s', 0) * 1000:>12.2f} {b.get('mean_s', 0) * 1000:>12.2f}")
+
+
+# Comparaison de deux exécutions : python profiling.py cache/profiles/<run A> cache/profiles/<run B>
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare deux rapports de profilage.")
+    parser.add_argument('run_a')
+    parser.add_argument('run_b')
+    args = parser.parse_args()
+    compare(args.run_a, args.run_b)
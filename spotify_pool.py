@@ -0,0 +1,189 @@
+import json
+import time
+import base64
+import os
+import threading
+import requests
+from metrics import METRICS
+
+# Pool d'applications Spotify : chaque application (client_id/client_secret) a son propre token et
+# son propre budget de requêtes. Les requêtes vont à l'application la moins chargée ; une application
+# qui reçoit un 429 est mise de côté le temps indiqué par Retry-After.
+
+# URLs de l'API Spotify (ex: http://localhost:8001 pour un faux serveur, voir benchmark.py)
+SPOTIFY_ACCOUNTS_URL = os.getenv('SPOTIFY_ACCOUNTS_URL', 'https://accounts.spotify.com')
+SPOTIFY_API_URL = os.getenv('SPOTIFY_API_URL', 'https://api.spotify.com/v1')
+
+RATE = 3.0  # Requêtes par seconde par application (valeur par défaut, "rate" dans le fichier de credentials)
+BURST = 10  # Requêtes qu'une application inactive peut envoyer d'affilée
+DRAIN_SECONDS = 30  # Mise à l'écart après un 429 sans en-tête Retry-After
+MAX_ATTEMPTS = 5  # Tentatives d'une requête (429, token expiré) avant l'échec
+TOKEN_MARGIN = 60  # Renouvellement du token avant son expiration (secondes)
+TIMEOUT = 30  # Secondes avant d'abandonner une requête (connexion bloquée)
+
+
+def album_image(album, max_width=640):
+    """URL de la plus grande pochette d'un album Spotify ne dépassant pas max_width (None si aucune)."""
+    images = sorted((image for image in album.get('images') or [] if image.get('url')),
+                    key=lambda image: image.get('width') or 0, reverse=True)
+    fitting = [image for image in images if (image.get('width') or 0) <= max_width]
+    image = (fitting or images or [None])[0]
+    return image['url'] if image else None
+
+def load_spotify_apps(credentials_file):
+    """
+    Lit le fichier JSON des credentials Spotify : une application ({"client_id", "client_secret"})
+    ou une liste d'applications, chacune avec "name", "rate" (requêtes/s) et "burst" facultatifs.
+    """
+    with open(credentials_file, 'r') as file:
+        credentials = json.load(file)
+    apps = credentials if isinstance(credentials, list) else [credentials]
+    for app in apps:
+        if not app.get('client_id') or not app.get('client_secret'):
+            raise ValueError(f"client_id et client_secret sont obligatoires pour chaque application de {credentials_file}")
+    return apps
+
+
+class SpotifyApp:
+    """
+    Une application Spotify : token d'accès, budget (seau à jetons), mise à l'écart après un 429
+    et sa propre session HTTP (connexions TLS réutilisées d'une requête à l'autre).
+    """
+    def __init__(self, client_id, client_secret, name=None, rate=RATE, burst=BURST):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.name = name or client_id[:8]
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.drained_until = 0.0
+        self.in_flight = 0
+        self.disabled = False
+        self.access_token = None
+        self.expires_at = 0.0
+        self.token_lock = threading.Lock()
+        self.session = requests.Session()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Secondes avant que l'application puisse envoyer une requête."""
+        return max(self.drained_until - now, (1 - self.tokens) / self.rate, 0.0)
+
+    def token(self):
+        """Token d'accès (Client Credentials Flow), renouvelé peu avant son expiration."""
+        with self.token_lock:
+            if self.access_token is None or time.monotonic() > self.expires_at - TOKEN_MARGIN:
+                b64_auth = base64.b64encode(f"{self.client_id}:{self.client_secret}".encode()).decode()
+                headers = {
+                    "Authorization": f"Basic {b64_auth}",
+                    "Content-Type": "application/x-www-form-urlencoded"
+                }
+                with METRICS.request('spotify', 'token'):
+                    r = self.session.post(f"{SPOTIFY_ACCOUNTS_URL}/api/token", headers=headers,
+                                          data={"grant_type": "client_credentials"}, timeout=TIMEOUT)
+                r.raise_for_status()
+                data = r.json()
+                self.access_token = data["access_token"]
+                self.expires_at = time.monotonic() + data.get("expires_in", 3600)
+            return self.access_token
+
+
+class SpotifyPool:
+    """
+    Requêtes à l'API Spotify réparties sur plusieurs applications. Thread-safe : le débit total
+    est la somme des budgets des applications, à condition d'envoyer assez de requêtes en parallèle.
+    """
+    def __init__(self, apps):
+        self.apps = [app if isinstance(app, SpotifyApp) else
+                     SpotifyApp(app['client_id'], app['client_secret'], app.get('name'),
+                                app.get('rate', RATE), app.get('burst', BURST)) for app in apps]
+        if not self.apps:
+            raise ValueError("Aucune application Spotify configurée")
+        self.lock = threading.Lock()
+        self.turn = 0
+
+    @classmethod
+    def from_file(cls, credentials_file):
+        return cls(load_spotify_apps(credentials_file))
+
+    def acquire(self):
+        """Réserve une requête sur l'application la moins chargée, en attendant si toutes sont à court de budget."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                apps = [app for app in self.apps if not app.disabled]
+                if not apps:
+                    raise RuntimeError("Aucune application Spotify utilisable (credentials refusés)")
+                for app in apps:
+                    app.refill(now)
+                # Budget disponible d'abord, puis le plus de jetons restants, le moins de requêtes en cours,
+                # et à égalité chacune son tour
+                n = len(self.apps)
+                app = min(apps, key=lambda a: (a.wait_time(now), -a.tokens, a.in_flight,
+                                               (self.apps.index(a) - self.turn) % n))
+                wait = app.wait_time(now)
+                if wait <= 0:
+                    app.tokens -= 1
+                    app.in_flight += 1
+                    self.turn = (self.apps.index(app) + 1) % n
+                    return app
+            if wait > 5:
+                print(f"Applications Spotify limitées, pause de {wait:.0f}s...")
+            METRICS.slept(wait, 'spotify')
+            time.sleep(wait)
+
+    def release(self, app):
+        with self.lock:
+            app.in_flight -= 1
+
+    def drain(self, app, retry_after):
+        """Met l'application de côté après un 429 (Retry-After en secondes)."""
+        try:
+            seconds = float(retry_after)
+        except (TypeError, ValueError):
+            seconds = DRAIN_SECONDS
+        with self.lock:
+            app.drained_until = max(app.drained_until, time.monotonic() + seconds)
+            app.tokens = min(app.tokens, 0.0)
+        METRICS.inc('spotify_app_drained_total', app=app.name)
+
+    def get(self, endpoint, path, params=None):
+        """
+        GET {SPOTIFY_API_URL}{path} (ou une URL complète) : un 429 met l'application de côté et la
+        requête repart sur une autre, un 401 renouvelle le token. Retourne la réponse ; lève
+        requests.HTTPError si la requête est encore refusée (429, 401) après MAX_ATTEMPTS tentatives,
+        requests.Timeout si Spotify ne répond pas dans les TIMEOUT secondes.
+        """
+        url = path if path.startswith('http') else f"{SPOTIFY_API_URL}{path}"
+        response = None
+        for _ in range(MAX_ATTEMPTS):
+            app = self.acquire()
+            try:
+                try:
+                    token = app.token()
+                except requests.HTTPError as e:
+                    if e.response is not None and e.response.status_code in (400, 401, 403):
+                        print(f"Application Spotify {app.name} désactivée : credentials refusés")
+                        app.disabled = True
+                        continue
+                    raise
+                METRICS.inc('spotify_app_requests_total', app=app.name)
+                with METRICS.request('spotify', endpoint):
+                    response = app.session.get(url, headers={"Authorization": f"Bearer {token}"}, params=params,
+                                               timeout=TIMEOUT)
+            finally:
+                self.release(app)
+            if response.status_code == 429:
+                self.drain(app, response.headers.get('Retry-After'))
+            elif response.status_code == 401:
+                app.access_token = None
+            else:
+                return response
+        if response is None:
+            raise RuntimeError("Aucune application Spotify n'a pu envoyer la requête")
+        raise requests.HTTPError(f"Spotify : HTTP {response.status_code} après {MAX_ATTEMPTS} tentatives ({endpoint})",
+                                 response=response)
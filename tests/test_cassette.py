@@ -0,0 +1,54 @@
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cassette
+from fake_services import FakeSpotify
+
+
+class SecretRedactionTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'spotify.jsonl.gz')
+        self.spotify = FakeSpotify().start()
+        self.addCleanup(self.spotify.stop)
+
+    def test_token_not_written_and_replayed_as_placeholder(self):
+        recording = cassette.install(self.path, 'record')
+        try:
+            token = requests.post(f"{self.spotify.url}/api/token", data={'grant_type': 'client_credentials'},
+                                  auth=('client', 'secret')).json()
+            search = requests.get(f"{self.spotify.url}/v1/search", params={'q': 'Titre 1', 'type': 'track'},
+                                  headers={'Authorization': f"Bearer {token['access_token']}"}).json()
+        finally:
+            recording.close()
+        self.assertEqual(token['access_token'], 'benchmark')  # le programme reçoit le vrai jeton
+        with gzip.open(self.path, 'rt', encoding='utf-8') as file:
+            self.assertNotIn('benchmark', file.read())
+
+        replay = cassette.install(self.path, 'replay')
+        try:
+            replayed = requests.post(f"{self.spotify.url}/api/token", data={'grant_type': 'client_credentials'}).json()
+            self.assertEqual(replayed, {**token, 'access_token': cassette.REDACTED})
+            self.assertEqual(requests.get(f"{self.spotify.url}/v1/search", params={'type': 'track', 'q': 'Titre 1'}).json(), search)
+        finally:
+            replay.close()
+
+    def test_authorization_header_redacted(self):
+        headers = cassette.redact_headers({'Authorization': 'Bearer abc', 'Content-Type': 'application/json'})
+        self.assertEqual(headers, {'Authorization': cassette.REDACTED, 'Content-Type': 'application/json'})
+
+    def test_other_content_unchanged(self):
+        for text in ('{"tracks": {"items": []}}', 'not json "access_token"', '["access_token"]'):
+            self.assertEqual(cassette.redact_content(text), text)
+
+
+if __name__ == '__main__':
+    unittest.main()
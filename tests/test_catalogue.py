@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from catalogue import Catalogue
+from excel_reader import Track, input_hash
+
+
+def enriched_track(row, artist, title, album):
+    """Ligne enrichie par metadata.py : métadonnées et empreinte de l'artiste et du titre traités."""
+    track = Track(row, {'ARTISTE': artist, 'TITRE': title, 'ALBUM': album, 'SORTIE': '2020-01-01'})
+    track.empreinte_metadata = input_hash(track, 'metadata')
+    return track
+
+
+class ImportTracksTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.catalogue = Catalogue(os.path.join(self.directory.name, 'catalogue.sqlite'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_up_to_date_row_is_imported(self):
+        self.catalogue.import_tracks([enriched_track(2, 'Artiste', 'Titre', 'Album')])
+        self.assertEqual(self.catalogue.lookup('Artiste', 'Titre')['ALBUM'], 'Album')
+
+    def test_edited_row_is_not_imported(self):
+        # Titre modifié à la main après l'enrichissement : l'album est celui de l'ancien titre
+        track = enriched_track(2, 'Artiste', 'Ancien titre', 'Stale Album')
+        track.titre = 'Nouveau titre'
+        self.catalogue.import_tracks([track])
+        self.assertIsNone(self.catalogue.lookup('Artiste', 'Nouveau titre'))
+        self.assertIsNone(self.catalogue.lookup('Artiste', 'Ancien titre'))
+
+    def test_row_without_fingerprint_is_not_imported(self):
+        track = enriched_track(2, 'Artiste', 'Titre', 'Album')
+        track.empreinte_metadata = None
+        self.catalogue.import_tracks([track])
+        self.assertIsNone(self.catalogue.lookup('Artiste', 'Titre'))
+
+
+class LookupTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.catalogue = Catalogue(os.path.join(self.directory.name, 'catalogue.sqlite'))
+        self.catalogue.add([
+            {'artist': 'The Beatles', 'title': 'Love Me Do', 'album': 'Please Please Me'},
+            {'artist': 'The Beatles', 'title': 'Hey Jude - Remastered 2015', 'album': '1'},
+            {'artist': 'The Beatles', 'title': 'Help! (Mono) - Remastered 2009', 'album': 'Help!'},
+        ], 'musicbrainz')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_version_suffix_is_ignored(self):
+        self.assertEqual(self.catalogue.lookup('The Beatles', 'Hey Jude')['ALBUM'], '1')
+        self.assertEqual(self.catalogue.lookup('The Beatles', 'Help!')['ALBUM'], 'Help!')
+        self.assertEqual(self.catalogue.lookup('The Beatles', 'Hey Jude - 2009 Remaster')['ALBUM'], '1')
+
+    def test_title_containing_the_words_is_not_a_match(self):
+        self.assertIsNone(self.catalogue.lookup('The Beatles', 'Love'))
+        self.assertIsNone(self.catalogue.lookup('The Beatles', 'Jude'))
+
+    def test_shorter_version_preferred(self):
+        self.catalogue.add([{'artist': 'The Beatles', 'title': 'Hey Jude - Remastered', 'album': 'Past Masters'}], 'musicbrainz')
+        self.assertEqual(self.catalogue.lookup('The Beatles', 'Hey Jude')['ALBUM'], 'Past Masters')
+
+
+if __name__ == '__main__':
+    unittest.main()
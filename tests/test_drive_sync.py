@@ -0,0 +1,120 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bot_downloader import build_drive_service
+from drive_sync import DriveMirror, FOLDER_MIMETYPE
+from fake_services import FakeDrive
+from google.auth.credentials import AnonymousCredentials
+
+ROOT_ID = 'racine'
+
+
+class DriveMirrorTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.drive = FakeDrive().start()
+        self.addCleanup(self.drive.stop)
+        self.service = build_drive_service(AnonymousCredentials(), api_endpoint=self.drive.url + '/')
+        self.addCleanup(self.service.close)
+        self.mirror = DriveMirror(os.path.join(directory, 'mirror.sqlite'), ROOT_ID)
+        self.rock = self.folder('Rock')
+        self.jazz = self.folder('Jazz')
+        self.add('a.mp3', self.rock)
+        self.add('b.mp3', self.jazz)
+        self.mirror.sync(self.service)
+
+    def folder(self, name, parent=ROOT_ID):
+        return self.drive.add_file({'name': name, 'parents': [parent], 'mimeType': FOLDER_MIMETYPE}, b'')['id']
+
+    def add(self, name, parent, data=b'audio'):
+        return self.drive.add_file({'name': name, 'parents': [parent], 'mimeType': 'audio/mpeg'}, data)['id']
+
+    def move(self, file_id, parent):
+        """Déplacement d'un fichier (non géré par l'API du faux serveur)."""
+        with self.drive.lock:
+            self.drive.files[file_id]['parent'] = parent
+            self.drive.record_change(file_id)
+
+    def names(self, folder_id):
+        return sorted(file['name'] for file in self.mirror.files(folder_id))
+
+    def sync_changes(self):
+        before = self.drive.snapshot()
+        self.mirror.sync(self.service)
+        after = self.drive.snapshot()
+        self.assertGreater(after.get('changes', 0), before.get('changes', 0))
+        self.assertEqual(after.get('changes_start', 0), before.get('changes_start', 0))  # pas de listing complet
+
+    def test_full_sync(self):
+        self.assertEqual(self.mirror.folders(), {'Jazz': self.jazz, 'Rock': self.rock})
+        self.assertEqual(self.names(self.rock), ['a.mp3'])
+        self.assertEqual(self.mirror.summary(), [('Jazz', 1, 5), ('Rock', 1, 5)])
+
+    def test_added_files_and_folders(self):
+        self.add('c.mp3', self.rock, b'plus long')
+        pop = self.folder('Pop')
+        self.add('d.mp3', pop)
+        self.sync_changes()
+        self.assertEqual(self.names(self.rock), ['a.mp3', 'c.mp3'])
+        self.assertEqual(self.mirror.folders()['Pop'], pop)
+        self.assertEqual(self.names(pop), ['d.mp3'])
+
+    def test_folder_listed_after_its_files(self):
+        # Dossier créé puis fichier dedans, mais changements reçus dans l'ordre inverse
+        pop = self.folder('Pop')
+        self.add('d.mp3', pop)
+        with self.drive.lock:
+            self.drive.changes[-2:] = reversed(self.drive.changes[-2:])
+        self.sync_changes()
+        self.assertEqual(self.names(pop), ['d.mp3'])
+
+    def test_trashed_folder_removes_its_content(self):
+        self.service.files().update(fileId=self.rock, body={'trashed': True}, supportsAllDrives=True).execute()
+        self.sync_changes()
+        self.assertEqual(self.mirror.folders(), {'Jazz': self.jazz})
+        self.assertEqual(self.mirror.files(self.rock), [])
+
+    def test_trashed_flag_removes_nested_folders(self):
+        live = self.folder('Live', parent=self.jazz)
+        self.add('e.mp3', live)
+        self.mirror.sync(self.service)
+        # Drive signale la corbeille par trashed dans le fichier, sans removed
+        with self.drive.lock:
+            file = self.drive.api_file(self.drive.files[self.jazz])
+            self.drive.changes.append({'fileId': self.jazz, 'removed': False, 'file': {**file, 'trashed': True}})
+        self.sync_changes()
+        self.assertEqual(self.mirror.folders(), {'Rock': self.rock})
+        self.assertEqual(self.mirror.folders(self.jazz), {})
+        self.assertEqual(self.mirror.files(live), [])
+        self.assertEqual(self.names(self.rock), ['a.mp3'])
+
+    def test_file_moved_out_of_tree(self):
+        file_id = self.mirror.files(self.rock)[0]['id']
+        self.move(file_id, 'ailleurs')
+        self.sync_changes()
+        self.assertEqual(self.mirror.files(self.rock), [])
+
+    def test_folder_moved_into_tree(self):
+        # Son contenu n'apparaît pas dans les changements : il est listé
+        outside = self.folder('Classique', parent='ailleurs')
+        self.add('f.mp3', outside)
+        self.mirror.sync(self.service)
+        self.assertNotIn('Classique', self.mirror.folders())
+        self.move(outside, ROOT_ID)
+        self.sync_changes()
+        self.assertEqual(self.mirror.folders()['Classique'], outside)
+        self.assertEqual(self.names(outside), ['f.mp3'])
+
+    def test_full_sync_replaces_mirror(self):
+        self.mirror.add({'id': 'fantome', 'name': 'x.mp3'}, self.rock)
+        self.mirror.sync(self.service, full=True)
+        self.assertEqual(self.names(self.rock), ['a.mp3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import sys
+import shutil
+import tempfile
+import zipfile
+import unittest
+from datetime import datetime
+
+import pandas as pd
+from openpyxl import load_workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmark import make_workbook
+from excel_reader import ExcelReader, input_hash, sheet_parts
+
+SHEET_NAME = 'TITRES'
+
+
+class WorkbookTestCase(unittest.TestCase):
+    """Classeur synthétique (benchmark.make_workbook) généré une fois, copié pour chaque test."""
+    rows = 20
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.source = make_workbook(os.path.join(cls.directory, 'source.xlsx'), cls.rows)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        self.path = os.path.join(self.directory, f'{self._testMethodName}.xlsx')
+        shutil.copy(self.source, self.path)
+        self.reader = ExcelReader(self.path)
+        self.tracks = self.reader.read_tracks(SHEET_NAME)
+
+
+class ChangedRowsTest(WorkbookTestCase):
+    def test_reference_hash_only_for_processed_rows(self):
+        changed = self.reader.changed_rows(SHEET_NAME, self.tracks, 'download')
+        self.assertEqual(changed, set())
+        for track in self.tracks:
+            expected = input_hash(track, 'download') if track.telecharge is True else None
+            self.assertEqual(track.empreinte_telecharge, expected, track)
+
+    def test_edited_row_is_changed(self):
+        self.reader.changed_rows(SHEET_NAME, self.tracks, 'download')
+        uploaded = next(track for track in self.tracks if track.telecharge is True)
+        self.reader.update_track(SHEET_NAME, uploaded, {'LIEN': 'https://www.youtube.com/watch?v=AAAAAAAAAAA'})
+        self.assertEqual(self.reader.changed_rows(SHEET_NAME, self.tracks, 'download'), {uploaded.row})
+
+    def test_row_processed_after_link_change_is_not_changed(self):
+        # Ligne jamais téléchargée dont le lien est rempli ensuite (ytb_finder) : pas une modification
+        pending = next(track for track in self.tracks if track.telecharge is False)
+        self.reader.changed_rows(SHEET_NAME, self.tracks, 'download')
+        self.reader.update_track(SHEET_NAME, pending, {'LIEN': 'https://www.youtube.com/watch?v=BBBBBBBBBBB'})
+        self.assertEqual(self.reader.changed_rows(SHEET_NAME, self.tracks, 'download'), set())
+
+
+class PatchSaveTest(WorkbookTestCase):
+    """patch_save réécrit le XML de la feuille à la main : le fichier doit rester lisible par openpyxl et pandas."""
+
+    def reload(self):
+        return load_workbook(self.path)['TITRES'], pd.read_excel(self.path, sheet_name=SHEET_NAME)
+
+    def test_patched_cells_round_trip(self):
+        track = self.tracks[3]
+        updates = {'TITRE': 'Rock & <Roll> "été"', 'POPULARITE': 42, 'EXPLICITE': True, 'CONFIANCE': 2.5}
+        self.reader.update_track(SHEET_NAME, track, updates)
+        self.assertTrue(self.reader.patch_save())
+        sheet, dataframe = self.reload()
+        values = {sheet.cell(row=1, column=c).value: sheet.cell(row=track.row, column=c).value
+                  for c in range(1, sheet.max_column + 1)}
+        self.assertEqual({column: values[column] for column in updates}, updates)
+        line = dataframe.iloc[track.row - 2]
+        self.assertEqual(line['TITRE'], updates['TITRE'])
+        self.assertEqual(line['POPULARITE'], 42)
+        self.assertEqual(line['CONFIANCE'], 2.5)
+        # Lignes voisines et formules intactes
+        self.assertEqual(sheet.cell(row=track.row + 1, column=3).value, self.tracks[4].titre)
+        self.assertTrue(str(values['VALIDE']).startswith('=IF('))
+
+    def test_other_members_copied_unchanged(self):
+        with zipfile.ZipFile(self.path) as archive:
+            before = {name: archive.read(name) for name in archive.namelist()}
+            part = sheet_parts(archive)[SHEET_NAME]
+        self.reader.update_track(SHEET_NAME, self.tracks[0], {'LIEN': 'https://www.youtube.com/watch?v=CCCCCCCCCCC'})
+        self.assertTrue(self.reader.patch_save())
+        with zipfile.ZipFile(self.path) as archive:
+            self.assertIsNone(archive.testzip())
+            after = {name: archive.read(name) for name in archive.namelist()}
+        self.assertEqual(after.keys(), before.keys())
+        self.assertEqual({name: data for name, data in after.items() if name != part},
+                         {name: data for name, data in before.items() if name != part})
+
+    def test_new_column_then_patch(self):
+        self.reader.ensure_columns(SHEET_NAME, ['DISPONIBLE'])
+        self.reader.save()  # ajout de colonne : sauvegarde complète par openpyxl
+        self.reader.update_track(SHEET_NAME, self.tracks[5], {'DISPONIBLE': 'FAUX'})
+        self.assertTrue(self.reader.patch_save())  # cellule absente du XML : insérée
+        sheet, dataframe = self.reload()
+        self.assertEqual(sheet.cell(row=1, column=sheet.max_column).value, 'DISPONIBLE')
+        self.assertEqual(sheet.cell(row=self.tracks[5].row, column=sheet.max_column).value, 'FAUX')
+        self.assertEqual(dataframe['DISPONIBLE'].notna().sum(), 1)
+        self.assertEqual(next(iter(sheet.tables.values())).ref, f"A1:{sheet.cell(row=1, column=sheet.max_column).column_letter}{self.rows + 1}")
+
+    def test_date_cell_falls_back_to_openpyxl(self):
+        self.reader.ensure_columns(SHEET_NAME, ['VERIFIE_LE'])
+        self.reader.save()
+        checked = datetime(2024, 5, 17, 8, 30)
+        self.reader.update_track(SHEET_NAME, self.tracks[2], {'VERIFIE_LE': checked})
+        self.assertFalse(self.reader.patch_save())  # date non gérée par cell_xml : rien n'est écrit
+        self.reader.save()
+        sheet, dataframe = self.reload()
+        self.assertEqual(sheet.cell(row=self.tracks[2].row, column=sheet.max_column).value, checked)
+        self.assertEqual(dataframe['VERIFIE_LE'].iloc[self.tracks[2].row - 2], pd.Timestamp(checked))
+
+    def test_formula_cell_falls_back_to_openpyxl(self):
+        track = self.tracks[1]
+        self.reader.update_track(SHEET_NAME, track, {'VALIDE': True})
+        self.assertFalse(self.reader.patch_save())
+        self.reader.save()
+        sheet, _ = self.reload()
+        self.assertIs(sheet.cell(row=track.row, column=9).value, True)
+        self.assertTrue(str(sheet.cell(row=track.row + 1, column=9).value).startswith('=IF('))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from file_cache import FileCache
+
+
+def cached_files(root):
+    return sorted(filename for _, _, filenames in os.walk(root) for filename in filenames)
+
+
+class FileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def store(self, cache, key, data):
+        temp = cache.temp_path(key, 'mp3')
+        with open(temp, 'wb') as file:
+            file.write(data)
+        return cache.put(key, temp, 'mp3')
+
+    def test_evicts_least_recently_used(self):
+        cache = FileCache(self.root, 2500)
+        self.store(cache, 'aaaa', b'a' * 1000)
+        self.store(cache, 'bbbb', b'b' * 1000)
+        self.assertIsNotNone(cache.get('aaaa', 'mp3'))  # aaaa devient le plus récent
+        self.store(cache, 'cccc', b'c' * 1000)
+        self.assertIsNone(cache.get('bbbb', 'mp3'))
+        self.assertEqual(cached_files(self.root), ['aaaa.mp3', 'cccc.mp3'])
+        self.assertEqual(cache.total_bytes, 2000)
+
+    def test_keeps_file_larger_than_limit(self):
+        cache = FileCache(self.root, 500)
+        self.store(cache, 'aaaa', b'a' * 100)
+        self.store(cache, 'bbbb', b'b' * 1000)
+        self.assertEqual(cache.read('bbbb', 'mp3'), b'b' * 1000)
+        self.assertEqual(cached_files(self.root), ['bbbb.mp3'])
+
+    def test_lru_order_survives_restart(self):
+        cache = FileCache(self.root, 2500)
+        self.store(cache, 'aaaa', b'a' * 1000)
+        self.store(cache, 'bbbb', b'b' * 1000)
+        os.utime(cache.path_for('aaaa', 'mp3'), (1, 1))
+        os.utime(cache.path_for('bbbb', 'mp3'), (2, 2))
+        cache = FileCache(self.root, 2500)
+        self.store(cache, 'cccc', b'c' * 1000)
+        self.assertEqual(cached_files(self.root), ['bbbb.mp3', 'cccc.mp3'])
+
+    def test_limit_shared_between_processes(self):
+        # Deux instances sur le même dossier : celle qui range relit le dossier avant l'éviction
+        first = FileCache(self.root, 2500, rescan_seconds=0)
+        second = FileCache(self.root, 2500, rescan_seconds=0)
+        self.store(first, 'aaaa', b'a' * 1000)
+        self.store(second, 'bbbb', b'b' * 1000)
+        self.store(first, 'cccc', b'c' * 1000)
+        self.assertEqual(len(cached_files(self.root)), 2)
+        self.assertLessEqual(first.total_bytes, 2500)
+        # Fichier rangé par l'autre instance depuis sa dernière relecture
+        self.assertEqual(second.read('cccc', 'mp3'), b'c' * 1000)
+
+    def test_missing_file_raises_key_error(self):
+        cache = FileCache(self.root, 10000)
+        path = self.store(cache, 'aaaa', b'a' * 10)
+        os.remove(path)  # évincé par un autre processus
+        with self.assertRaises(KeyError):
+            cache.copy_to('aaaa', 'mp3', os.path.join(self.root, 'copie'))
+        self.assertEqual(cache.total_bytes, 0)
+
+    def test_stale_temp_files_removed(self):
+        cache = FileCache(self.root, 10000)
+        recent = cache.temp_path('aaaa', 'mp3')
+        stale = cache.temp_path('bbbb', 'mp3')
+        for path in (recent, stale):
+            with open(path, 'wb') as file:
+                file.write(b'x')
+        os.utime(stale, (0, 0))
+        cache = FileCache(self.root, 10000)
+        self.assertTrue(os.path.exists(recent))  # peut-être en cours d'écriture par un autre processus
+        self.assertFalse(os.path.exists(stale))
+        self.assertEqual(cache.total_bytes, 0)
+
+    def test_concurrent_put_and_copy_to(self):
+        cache = FileCache(self.root, 5 * 1000)
+        keys = [f"{i:04d}" for i in range(40)]
+        content = {key: key.encode() * 250 for key in keys}
+        errors = []
+        destination = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, destination)
+
+        def writer(offset):
+            for key in keys[offset::4]:
+                self.store(cache, key, content[key])
+
+        def reader(number):
+            for _ in range(5):
+                for key in keys:
+                    dest = os.path.join(destination, f"{number}-{key}")
+                    try:
+                        cache.copy_to(key, 'mp3', dest)
+                    except KeyError:
+                        continue  # pas encore rangé ou déjà évincé
+                    with open(dest, 'rb') as file:
+                        if file.read() != content[key]:
+                            errors.append(key)
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(4)]
+        threads += [threading.Thread(target=reader, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        on_disk = {os.path.join(dirpath, filename): os.path.getsize(os.path.join(dirpath, filename))
+                   for dirpath, _, filenames in os.walk(self.root) for filename in filenames}
+        self.assertEqual(dict(cache.entries), on_disk)
+        self.assertEqual(cache.total_bytes, sum(on_disk.values()))
+        self.assertLessEqual(cache.total_bytes, cache.max_bytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
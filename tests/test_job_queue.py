@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from excel_reader import Track
+from job_queue import JobQueue, renewing
+
+LEASE_SECONDS = 0.3
+
+
+def make_tracks(rows):
+    return [Track(row, {'ARTISTE': f"Artiste {row}", 'TITRE': f"Titre {row}"}) for row in rows]
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.queue = JobQueue(os.path.join(directory, 'jobs.db'), lease_seconds=LEASE_SECONDS, max_attempts=2)
+        self.queue.enqueue('youtube', make_tracks(range(2, 12)))
+
+    def test_enqueue_does_not_duplicate(self):
+        self.assertEqual(self.queue.enqueue('youtube', make_tracks(range(2, 14))), 2)
+        self.assertEqual(self.queue.counts('youtube'), {'pending': 12})
+
+    def test_claim_is_exclusive(self):
+        first = self.queue.claim('youtube', 'a', batch_size=4)
+        second = self.queue.claim('youtube', 'b', batch_size=100)
+        self.assertEqual([track.row for track in first], [2, 3, 4, 5])
+        self.assertEqual([track.row for track in second], list(range(6, 12)))
+        self.assertEqual(first[0].titre, 'Titre 2')
+        self.assertEqual(self.queue.claim('youtube', 'c'), [])
+
+    def test_concurrent_claims(self):
+        self.queue.enqueue('youtube', make_tracks(range(12, 200)))
+        claimed = {}
+
+        def worker(name):
+            rows = claimed.setdefault(name, [])
+            while True:
+                tracks = self.queue.claim('youtube', name, batch_size=3)
+                if not tracks:
+                    return
+                rows += [track.row for track in tracks]
+
+        threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        rows = [row for worker_rows in claimed.values() for row in worker_rows]
+        self.assertEqual(sorted(rows), list(range(2, 200)))
+
+    def test_expired_lease_is_reclaimed(self):
+        self.queue.claim('youtube', 'a', batch_size=2)
+        time.sleep(LEASE_SECONDS * 1.5)  # worker a arrêté ou bloqué
+        reclaimed = self.queue.claim('youtube', 'b', batch_size=2)
+        self.assertEqual([track.row for track in reclaimed], [2, 3])
+        # Le résultat tardif de a est ignoré, celui de b est gardé
+        self.assertFalse(self.queue.complete('youtube', 'a', 2, {'LIEN': 'a'}))
+        self.assertTrue(self.queue.complete('youtube', 'b', 2, {'LIEN': 'b'}))
+        self.assertEqual(self.queue.results('youtube'), [(2, {'LIEN': 'b'})])
+        self.queue.fail('youtube', 'a', 3, 'trop tard')  # ignoré aussi
+        self.assertEqual(self.queue.counts('youtube'), {'done': 1, 'leased': 1, 'pending': 8})
+
+    def test_failed_after_max_attempts(self):
+        self.queue.claim('youtube', 'a', batch_size=1)
+        self.queue.fail('youtube', 'a', 2, 'erreur')
+        self.assertEqual([track.row for track in self.queue.claim('youtube', 'b', batch_size=1)], [2])
+        time.sleep(LEASE_SECONDS * 1.5)
+        self.queue.claim('youtube', 'c', batch_size=0)  # remet en file les baux expirés
+        self.assertEqual(self.queue.counts('youtube'), {'failed': 1, 'pending': 9})
+        self.assertNotIn(2, self.queue.queued_rows('youtube'))
+        # Remise en file d'une ligne en échec définitif (nouvelles données)
+        self.assertEqual(self.queue.enqueue('youtube', make_tracks([2])), 1)
+        self.assertEqual(self.queue.counts('youtube'), {'pending': 10})
+
+    def test_renewing_keeps_leases(self):
+        claimed = self.queue.claim('youtube', 'a', batch_size=2)
+        with renewing(self.queue, 'youtube', 'a'):
+            time.sleep(LEASE_SECONDS * 3)  # lignes en attente dans le pipeline du worker
+            self.assertEqual([track.row for track in self.queue.claim('youtube', 'b', batch_size=2)], [4, 5])
+        for track in claimed:
+            self.assertTrue(self.queue.complete('youtube', 'a', track.row, {}))
+
+    def test_forget_done_rows(self):
+        self.queue.claim('youtube', 'a', batch_size=2)
+        self.queue.complete('youtube', 'a', 2, {})
+        self.queue.forget('youtube', [2, 3])  # 3 n'est pas terminée : gardée
+        self.assertEqual(self.queue.queued_rows('youtube'), set(range(3, 12)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import io
+import os
+import sys
+import hashlib
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bot_downloader import PipeMediaUpload, build_drive_service, upload_media
+from fake_services import FakeDrive
+from google.auth.credentials import AnonymousCredentials
+
+CHUNK_SIZE = 256 * 1024  # plus petite taille de morceau acceptée par Drive
+
+
+class FlakyDrive(FakeDrive):
+    """
+    FakeDrive qui, pour un numéro de morceau donné, n'en garde que la moitié (308 avec
+    l'avancement réel) ou répond par une erreur 503 sans rien garder.
+    """
+    def __init__(self, truncate=(), fail=(), **kwargs):
+        super().__init__(**kwargs)
+        self.truncate = set(truncate)
+        self.fail = set(fail)
+        self.chunks = 0
+
+    def route(self, handler, method, path, params, body):
+        if path == '/upload/drive/v3/files' and method == 'PUT' and body:
+            with self.lock:
+                self.chunks += 1
+                number = self.chunks
+            if number in self.fail:
+                return 'upload_error', 503, {}, {'error': {'code': 503}}
+            if number in self.truncate:
+                body = body[:len(body) // 2]
+        return super().route(handler, method, path, params, body)
+
+
+class PipeMediaUploadTest(unittest.TestCase):
+    def test_chunks_and_size_known_at_last_chunk(self):
+        data = os.urandom(CHUNK_SIZE * 2 + 1000)
+        media = PipeMediaUpload(io.BytesIO(data[10:]), 'audio/mpeg', chunksize=CHUNK_SIZE, prefix=data[:10])
+        sent, sizes, begin = [], [], 0
+        while begin < len(data):
+            sizes.append(media.size())
+            chunk = media.getbytes(begin, CHUNK_SIZE)
+            sent.append(len(chunk))
+            # Seuls le morceau en cours et le suivant sont gardés en mémoire
+            self.assertLessEqual(len(media._buffer), 2 * CHUNK_SIZE + 1)
+            begin += len(chunk)
+        self.assertEqual(sent, [CHUNK_SIZE, CHUNK_SIZE, 1000])
+        self.assertEqual(sizes, [None, None, len(data)])
+        self.assertEqual(media.getbytes(CHUNK_SIZE * 2, CHUNK_SIZE), data[CHUNK_SIZE * 2:])
+
+    def test_resend_from_acknowledged_offset(self):
+        data = os.urandom(CHUNK_SIZE * 2)
+        media = PipeMediaUpload(io.BytesIO(data), 'audio/mpeg', chunksize=CHUNK_SIZE)
+        media.size()
+        media.getbytes(0, CHUNK_SIZE)
+        # Drive n'a confirmé que 1000 octets : le reste du morceau est renvoyé
+        media.size()
+        self.assertEqual(media.getbytes(1000, CHUNK_SIZE), data[1000:1000 + CHUNK_SIZE])
+
+
+class PipeUploadDriveTest(unittest.TestCase):
+    """Upload d'un flux vers le faux serveur Drive avec upload_media."""
+
+    def upload(self, drive, data, prefix=b''):
+        drive.start()
+        self.addCleanup(drive.stop)
+        service = build_drive_service(AnonymousCredentials(), api_endpoint=drive.url + '/')
+        self.addCleanup(service.close)
+        media = PipeMediaUpload(io.BytesIO(data), 'audio/mpeg', chunksize=CHUNK_SIZE, prefix=prefix)
+        with mock.patch('bot_downloader.time.sleep'):
+            return upload_media(service, media, 'titre.mp3', 'dossier')
+
+    def check_file(self, drive, response, data):
+        self.assertEqual(response['md5Checksum'], hashlib.md5(data).hexdigest())
+        self.assertEqual(int(response['size']), len(data))
+        file = drive.files[response['id']]
+        self.assertEqual((file['name'], file['parent']), ('titre.mp3', 'dossier'))
+
+    def test_upload_in_chunks(self):
+        data = os.urandom(CHUNK_SIZE * 2 + 5000)
+        drive = FakeDrive()
+        response = self.upload(drive, data[100:], prefix=data[:100])
+        self.check_file(drive, response, data)
+        self.assertEqual(drive.snapshot()['upload_chunk'], 3)
+
+    def test_resume_after_partial_chunk(self):
+        data = os.urandom(CHUNK_SIZE * 2 + 5000)
+        drive = FlakyDrive(truncate=[1])
+        response = self.upload(drive, data)
+        self.check_file(drive, response, data)
+        # Le morceau suivant repart du dernier octet confirmé par le 308
+        self.assertEqual(drive.snapshot()['upload_chunk'], 3)
+
+    def test_resume_after_error(self):
+        data = os.urandom(CHUNK_SIZE * 3)
+        drive = FlakyDrive(fail=[2])
+        response = self.upload(drive, data)
+        self.check_file(drive, response, data)
+        self.assertEqual(drive.snapshot()['upload_error'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
-import pandas as pd
 import re
-from excel_reader import ExcelReader
+from excel_reader import ExcelReader, Track, input_hash, HASH_COLUMNS
+from metrics import METRICS
+from profiling import span, start_from_args
+import cassette
 from youtubesearchpython import VideosSearch, ChannelsSearch, Video
 from tqdm import tqdm
 import time
@@ -10,7 +12,7 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import lru_cache
 import requests
 import traceback
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, List, Tuple
 
 warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
 
@@ -28,6 +30,7 @@ class YouTubeSearcher:
         self.artist_channel_cache = {}
         self.request_count = 0
         self.last_request_time = time.time()
+        METRICS.watch_cache('youtube_channels', self.get_ytb_artist_channel_name.cache_info)
         
     def sanitize_string(self, s):
         """Nettoyer une chaîne de caractères."""
@@ -50,7 +53,8 @@ class YouTubeSearcher:
         
         try:
             query = f"{artist_name} official channel"
-            search = ChannelsSearch(query, limit=1)
+            with METRICS.request('youtube', 'channel_search'):
+                search = ChannelsSearch(query, limit=1)
             channels = search.result()['result']
             
             if channels:
@@ -70,13 +74,14 @@ class YouTubeSearcher:
         # Pause progressive basée sur le nombre de requêtes
         if self.request_count % 10 == 0:
             delay = random.uniform(2, 4)
-            time.sleep(delay)
         elif self.request_count % 50 == 0:
             print("Pause longue pour éviter le rate limiting...")
-            time.sleep(random.uniform(10, 15))
+            delay = random.uniform(10, 15)
         else:
             # Délai minimum entre requêtes
-            time.sleep(random.uniform(0.5, 1.5))
+            delay = random.uniform(0.5, 1.5)
+        METRICS.slept(delay, 'youtube')
+        time.sleep(delay)
     
     def search_video_lightweight(self, query: str, limit: int = 3) -> Optional[Dict]:
         """
@@ -86,7 +91,8 @@ class YouTubeSearcher:
         self.rate_limit()
         
         try:
-            search = VideosSearch(query, limit=limit)
+            with METRICS.request('youtube', 'video_search'):
+                search = VideosSearch(query, limit=limit)
             results = search.result()['result']
             
             if results:
@@ -124,7 +130,8 @@ class YouTubeSearcher:
         #récupère la description complète de la vidéo
         url = video_info.get('url', '')
         try: 
-            desc = Video.getInfo(url).get("description") 
+            with METRICS.request('youtube', 'video_info'):
+                desc = Video.getInfo(url).get("description")
         except Exception as e:
             print(f"Erreur lors de la récupération de la description pour {url}: {e}")
             desc = ""
@@ -151,34 +158,35 @@ class YouTubeSearcher:
         
         return 0
     
-    def process_track(self, row_data: Tuple[int, pd.Series]) -> Dict:
+    def process_track(self, track: Track) -> Dict:
         """
-        Traiter une piste individuellement.
+        Traiter une piste individuellement. Retourne les colonnes à mettre à jour,
+        avec l'empreinte des colonnes d'entrée utilisées.
         """
-        idx, row = row_data
-        
+        empreinte = {HASH_COLUMNS['youtube']: input_hash(track, 'youtube')}
         try:
-            # Extraction des artistes
-            artiste_raw = str(row['ARTISTE'])
-            # suppression de ce qu'il y a entre parenthèses
-            artiste_raw = re.sub(r'\(.*?\)', '', artiste_raw)
-            # remplacer les différentes mentions de feat., ft., avec, et, & par une virgule
-            separators = [r"\s+feat\.?\s+", r"\s+ft\.?\s+", r"\s+avec\s+", r"\s+et\s+", r"\s*&\s*"]
-            for sep in separators: artiste_raw = re.sub(sep, ',', artiste_raw, flags=re.IGNORECASE)
-            # On remplace les points virgules par une seule virgule
-            artiste_raw = re.sub(r'\s*;\s*', ',', artiste_raw)
-            # On supprime les espaces en début et fin de chaîne
-            artiste_raw = artiste_raw.strip()
-            # On récupère le nom des artistes
-            artist_names_raw = artiste_raw.split(',') if ',' in artiste_raw else [artiste_raw]
-            artist_names = [self.sanitize_string(name) for name in artist_names_raw]
-            main_artist = artist_names[0] if artist_names else ""
+            with span('normalisation'):
+                # Extraction des artistes
+                artiste_raw = track.artiste or ''
+                # suppression de ce qu'il y a entre parenthèses
+                artiste_raw = re.sub(r'\(.*?\)', '', artiste_raw)
+                # remplacer les différentes mentions de feat., ft., avec, et, & par une virgule
+                separators = [r"\s+feat\.?\s+", r"\s+ft\.?\s+", r"\s+avec\s+", r"\s+et\s+", r"\s*&\s*"]
+                for sep in separators: artiste_raw = re.sub(sep, ',', artiste_raw, flags=re.IGNORECASE)
+                # On remplace les points virgules par une seule virgule
+                artiste_raw = re.sub(r'\s*;\s*', ',', artiste_raw)
+                # On supprime les espaces en début et fin de chaîne
+                artiste_raw = artiste_raw.strip()
+                # On récupère le nom des artistes
+                artist_names_raw = artiste_raw.split(',') if ',' in artiste_raw else [artiste_raw]
+                artist_names = [self.sanitize_string(name) for name in artist_names_raw]
+                main_artist = artist_names[0] if artist_names else ""
             
-            # Extraction du titre
-            titre_raw = str(row['TITRE'])
-            pattern = r'[\(\[\-]?\s*(feat|ft|with|avec|et)\b.*$'
-            titre = re.sub(pattern, '', titre_raw, flags=re.IGNORECASE)
-            titre = self.sanitize_string(titre)
+                # Extraction du titre
+                titre_raw = track.titre or ''
+                pattern = r'[\(\[\-]?\s*(feat|ft|with|avec|et)\b.*$'
+                titre = re.sub(pattern, '', titre_raw, flags=re.IGNORECASE)
+                titre = self.sanitize_string(titre)
             
             # Obtenir le nom de la chaîne de l'artiste (avec cache)
             artist_channel_name = self.get_ytb_artist_channel_name(main_artist)
@@ -216,30 +224,30 @@ class YouTubeSearcher:
             # Résultat final
             if best_url:
                 return {
-                    'idx': idx,
                     'CONFIANCE': best_score,
                     'LIEN': best_url,
-                    'TELECHARGE': 'FAUX'
+                    'TELECHARGE': 'FAUX',
+                    **empreinte
                 }
             else:
                 return {
-                    'idx': idx,
                     'CONFIANCE': 'NaN',
                     'LIEN': 'NaN',
-                    'TELECHARGE': 'FAUX'
+                    'TELECHARGE': 'FAUX',
+                    **empreinte
                 }
                 
         except Exception as e:
-            print(f"Erreur lors du traitement de la ligne {idx}:")
+            print(f"Erreur lors du traitement de la ligne {track.row}:")
             traceback.print_exc()
             return {
-                'idx': idx,
                 'CONFIANCE': 'NaN',
                 'LIEN': 'Erreur',
-                'TELECHARGE': 'FAUX'
+                'TELECHARGE': 'FAUX',
+                **empreinte
             }
     
-    def process(self, tracks: pd.DataFrame, max_workers: int = 3):
+    def process(self, tracks: List[Track], max_workers: int = 3):
         """
         Traiter les pistes avec gestion des erreurs 403.
         """
@@ -248,26 +256,30 @@ class YouTubeSearcher:
         
         # Diviser le travail en lots pour mieux gérer le rate limiting
         batch_size = 10
-        batches = [tracks.iloc[i:i+batch_size] for i in range(0, len(tracks), batch_size)]
+        batches = [tracks[i:i+batch_size] for i in range(0, len(tracks), batch_size)]
         
         with tqdm(total=total, desc="Recherche des URLs") as pbar:
             for batch_num, batch in enumerate(batches):
                 # Pause entre les lots
                 if batch_num > 0:
-                    time.sleep(random.uniform(3, 5))
+                    delay = random.uniform(3, 5)
+                    METRICS.slept(delay, 'youtube')
+                    time.sleep(delay)
                 
                 # Traitement séquentiel dans chaque lot pour éviter trop de requêtes simultanées
-                for idx, row in batch.iterrows():
-                    result = self.process_track((idx, row))
+                for track in batch:
+                    result = self.process_track(track)
                     
                     # Mise à jour immédiate dans Excel
-                    self.excel_reader.update_row(
+                    self.excel_reader.update_track(
                         self.sheet_name, 
-                        result['idx'],
+                        track,
                         {
                             'CONFIANCE': result['CONFIANCE'],
                             'LIEN': result['LIEN'],
-                            'TELECHARGEMENT': 'FAUX'
+                            'TELECHARGEMENT': 'FAUX',
+                            'DISPONIBLE': None,  # nouveau lien, à revérifier par link_validator
+                            HASH_COLUMNS['youtube']: result[HASH_COLUMNS['youtube']],
                         }
                     )
                     
@@ -276,11 +288,14 @@ class YouTubeSearcher:
                         self.excel_reader.save()
                     
                     pbar.update(1)
+                    METRICS.rows('youtube')
                     
                     # Gestion des erreurs 403
                     if 'Erreur' in str(result.get('LIEN', '')):
                         print("Erreur détectée, pause prolongée...")
-                        time.sleep(random.uniform(30, 60))
+                        delay = random.uniform(30, 60)
+                        METRICS.slept(delay, 'youtube')
+                        time.sleep(delay)
         
         # Sauvegarde finale
         self.excel_reader.save()
@@ -289,21 +304,29 @@ class YouTubeSearcher:
 
 # Exécution principale
 if __name__ == "__main__":
+    CASSETTE = cassette.start_from_args("ytb_finder_fast")  # --record, --replay (voir cassette.py)
+    PROFILER = start_from_args("ytb_finder_fast")  # --profile, --profile-memory (voir profiling.py)
     EXCEL_FILE = "Programmation_template.xlsx"
     EXCEL_READER = ExcelReader(EXCEL_FILE)
     SHEET_NAME = "TITRES"
+    METRICS_FILE = "cache/metrics/ytb_finder_fast"  # Mesures exportées en .json et .prom (node exporter)
+    METRICS.start_export(METRICS_FILE)
     
-    # Charger le fichier Excel
-    df = EXCEL_READER.read_dataframe(SHEET_NAME)
+    # Charger les lignes de la feuille
+    tracks = EXCEL_READER.read_tracks(SHEET_NAME)
     
     # Filtrer uniquement les lignes où la colonne 'LIEN' est vide ou 'Non trouvé'
-    df = df[(df['LIEN'].isna()) | (df['LIEN'] == 'Non trouvé')]
+    # ainsi que les liens morts signalés par link_validator.py
+    # ainsi que celles dont l'artiste ou le titre a été modifié depuis la recherche
+    changed = EXCEL_READER.changed_rows(SHEET_NAME, tracks, 'youtube')
+    tracks = [track for track in tracks
+              if track.row in changed or track.lien in (None, 'Non trouvé') or track.disponible == 'FAUX']
     # drop les 400 premières lignes pour les tests
 
     print("=" * 90)
     print("Bienvenue dans le générateur de liens YouTube optimisé!")
     print("Ce programme va rechercher les liens YouTube pour les titres dans le fichier Excel.")
-    print(f"Nombre de titres à traiter: {len(df)}")
+    print(f"Nombre de titres à traiter: {len(tracks)} (dont {len(changed)} modifiés depuis leur dernière recherche)")
     print(f"Le fichier {EXCEL_FILE} sera mis à jour avec les liens trouvés.")
     print("Optimisations appliquées:")
     print("  - Recherche sans yt-dlp pour éviter les erreurs SABR")
@@ -317,8 +340,8 @@ if __name__ == "__main__":
     searcher = YouTubeSearcher(EXCEL_READER, SHEET_NAME)
     
     # Traiter les pistes
-    searcher.process(df, max_workers=1)  # Utilisation d'un seul worker pour éviter le rate limiting
+    searcher.process(tracks, max_workers=1)  # Utilisation d'un seul worker pour éviter le rate limiting
     
     print("\n-> Les liens ont été écrits dans le tableau Excel.")
-    print(f"-> Nombre total de requêtes effectuées: {searcher.request_count}")
+    print(f"-> Nombre total de requêtes effectuées: {METRICS.total('request_duration_seconds', service='youtube')}")
     
\ No newline at end of file